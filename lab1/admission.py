@@ -0,0 +1,117 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Packet_in admission control. Every switch port has a token bucket, packet_ins
+# beyond its rate are rejected before any handler work is done. A source whose
+# packet_ins keep getting rejected is reported once per window, so the app can
+# block it at the switch with a short-lived drop flow instead of paying for
+# every packet on the control channel.
+#
+# Discovery probes are exempt (exempt()): on a trunk port every host behind
+# the link shares the port's budget, and a storm from one of them must not
+# cost the probes that keep the link alive.
+
+import time
+
+from classifier import ETH_TYPE_LLDP
+
+_EXEMPT = (ETH_TYPE_LLDP.to_bytes(2, 'big'),)  # EtherTypes never rejected
+
+# Results of AdmissionControl.check()
+ADMIT = 'admit'   # handle the packet_in
+REJECT = 'reject' # over the port's rate, drop it
+BLOCK = 'block'   # rejected, and the source is an offender: install a drop flow
+
+
+class AdmissionControl(object):
+
+    def __init__(self, rate=200, burst=400, offender_rejects=100, offender_window=1.0,
+                 clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.offender_rejects = offender_rejects
+        self.offender_window = offender_window
+        self.clock = clock
+        self.buckets = {}  # (dpid, in_port) -> [tokens, last refill]
+        self.rejects = {}  # (dpid, in_port, src) -> [rejects in window, window start]
+        self.rejected = 0
+        self.blocked = 0
+
+    def check(self, dpid, in_port, src):
+        now = self.clock()
+        key = (dpid, in_port)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return ADMIT
+
+        self.rejected += 1
+        key = (dpid, in_port, src)
+        count = self.rejects.get(key)
+        if count is None or now - count[1] > self.offender_window:
+            count = self.rejects[key] = [0, now]
+        count[0] += 1
+        if count[0] < self.offender_rejects:
+            return REJECT
+        # Start over, a blocked source is reported again only if it keeps going
+        # once its drop flow is gone
+        del self.rejects[key]
+        self.blocked += 1
+        return BLOCK
+
+    def forget(self, dpid):
+        for key in [k for k in self.buckets if k[0] == dpid]:
+            del self.buckets[key]
+        for key in [k for k in self.rejects if k[0] == dpid]:
+            del self.rejects[key]
+
+    def expire(self):
+        # Full buckets and old windows carry no state worth keeping
+        now = self.clock()
+        idle = self.burst / self.rate
+        for key in [k for k, (_, last) in self.buckets.items() if now - last > idle]:
+            del self.buckets[key]
+        for key in [k for k, (_, start) in self.rejects.items() if now - start > self.offender_window]:
+            del self.rejects[key]
+
+
+def exempt(data):
+    # Whether a packet_in (its raw frame) skips admission control
+    return bytes(data[12:14]) in _EXEMPT
+
+
+def meters_supported(datapath, features, meter_id):
+    # Whether a meter features reply allows a packet rate drop meter with this id
+    ofproto = datapath.ofproto
+    return any(f.max_meter >= meter_id and f.band_types & (1 << ofproto.OFPMBT_DROP) and
+               f.capabilities & ofproto.OFPMF_PKTPS for f in features)
+
+
+def meter_mods(datapath, meter_id, rate, burst):
+    # Replace whatever meter_id was before (a previous controller run may have left
+    # one) with a drop band at rate packets per second
+    ofproto = datapath.ofproto
+    parser = datapath.ofproto_parser
+    band = parser.OFPMeterBandDrop(rate=rate, burst_size=burst)
+    return [parser.OFPMeterMod(datapath, command=ofproto.OFPMC_DELETE, meter_id=meter_id),
+            parser.OFPMeterMod(datapath, command=ofproto.OFPMC_ADD,
+                               flags=ofproto.OFPMF_PKTPS | ofproto.OFPMF_BURST,
+                               meter_id=meter_id, bands=[band])]
@@ -14,24 +14,52 @@
  limitations under the License.
  """
 
+import os
+import sys
+
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
-from ryu.lib.packet import ethernet, packet, ipv6
+from ryu.lib import hub
 from ryu.ofproto import ofproto_v1_3
 from ipaddress import IPv4Address
 
+# The shared controller modules live next to this file
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import arp_frames
+import classifier
+import discovery
+import mac_table
+import spanning_tree
+import tracing
+
 
 class LearningSwitch(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
+    # Seconds between rounds of the LLDP discovery, see discovery.py
+    DISCOVERY_TICK = 0.1
+
     def __init__(self, *args, **kwargs):
         super(LearningSwitch, self).__init__(*args, **kwargs)
 
-        self.mac_to_port = {}
+        self.mac_table = mac_table.MacTable()
+        self.datapaths = {}
+
+        # Flooding follows a spanning tree of the links LLDP finds, see spanning_tree.py
+        self.discovery = discovery.Discovery()
+        self.broadcast = spanning_tree.BroadcastTree(self.discovery)
+        self.discovery.subscribe(self.broadcast.update)
+        self.threads.append(hub.spawn(self._discovery_loop))
 
         # Here you can initialize the data structures you want to keep at the controller
+        self.trace = tracing.EventLog.from_env()
+
+    def close(self):
+        self.trace.close()
+        super(LearningSwitch, self).close()
 
     
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
@@ -47,9 +75,62 @@ class LearningSwitch(app_manager.RyuApp):
                                           ofproto.OFPCML_NO_BUFFER)]
         self.add_flow(datapath, 0, match, actions)
 
-        self.mac_to_port[datapath.id] = {}
-
-        print("Switch connected: ", datapath.id)
+        self.mac_table.add_switch(datapath.id)
+        self.datapaths[datapath.id] = datapath
+
+        # The broadcast group, its ports come with discovery. A group left by an
+        # earlier run goes first.
+        datapath.send_msg(spanning_tree.group_mod(datapath, ofproto.OFPGC_DELETE))
+        datapath.send_msg(spanning_tree.group_mod(datapath, ofproto.OFPGC_ADD,
+                                                  self.broadcast.installed(datapath.id)))
+        datapath.send_msg(parser.OFPPortDescStatsRequest(datapath, 0))
+
+        self.logger.info("Switch connected: %s", datapath.id)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def state_change_handler(self, ev):
+        datapath = ev.datapath
+        if datapath.id is not None and self.datapaths.get(datapath.id) is datapath:
+            del self.datapaths[datapath.id]
+            self.discovery.remove_switch(datapath.id)
+            self.broadcast.forget(datapath.id)
+
+    @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, MAIN_DISPATCHER)
+    def port_desc_handler(self, ev):
+        ofproto = ev.msg.datapath.ofproto
+        self.discovery.add_switch(ev.msg.datapath.id, dict(
+            (port.port_no, arp_frames.mac_bytes(port.hw_addr)) for port in ev.msg.body
+            if port.port_no <= ofproto.OFPP_MAX and not port.state & ofproto.OFPPS_LINK_DOWN))
+
+    @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
+    def port_status_handler(self, ev):
+        msg = ev.msg
+        ofproto = msg.datapath.ofproto
+        up = msg.reason != ofproto.OFPPR_DELETE and not msg.desc.state & ofproto.OFPPS_LINK_DOWN
+        self.discovery.port_changed(msg.datapath.id, msg.desc.port_no, up,
+                                    arp_frames.mac_bytes(msg.desc.hw_addr))
+
+    # Sends the LLDP probes that are due and updates the broadcast groups whose
+    # ports changed
+    def _discovery_loop(self):
+        while True:
+            hub.sleep(self.DISCOVERY_TICK)
+            for dpid, port, frame in self.discovery.due():
+                datapath = self.datapaths.get(dpid)
+                if datapath is None:
+                    continue
+                ofproto = datapath.ofproto
+                parser = datapath.ofproto_parser
+                datapath.send_msg(parser.OFPPacketOut(
+                    datapath=datapath, buffer_id=ofproto.OFP_NO_BUFFER,
+                    in_port=ofproto.OFPP_CONTROLLER, actions=[parser.OFPActionOutput(port)],
+                    data=frame))
+            self.discovery.expire()
+            for dpid, ports in self.broadcast.changed().items():
+                datapath = self.datapaths.get(dpid)
+                if datapath is not None:
+                    datapath.send_msg(spanning_tree.group_mod(
+                        datapath, datapath.ofproto.OFPGC_MODIFY, ports))
 
     # Add a flow entry to the flow-table
     def add_flow(self, datapath, priority, match, actions):
@@ -70,36 +151,46 @@ class LearningSwitch(app_manager.RyuApp):
         ofproto = msg.datapath.ofproto  #Openflow protocol for the switch
         parser = msg.datapath.ofproto_parser    # Parser for the openflow protocol message
         in_port = msg.match['in_port']  # input port from the packet message
-        pkt = packet.Packet(msg.data)   #parse packet data from openflow message
-        eth = pkt.get_protocol(ethernet.ethernet)   #ethernet protocol header
+        eth = classifier.classify(msg.data)   #ethernet header, read in place without parsing every layer
+        if eth is None:
+            return
+
+        # A discovery probe that came back through a neighbour
+        if eth.ethertype == classifier.ETH_TYPE_LLDP:
+            self.discovery.received(datapath.id, in_port, msg.data)
+            return
 
         # Drop IPv6 packets (we use only ipv4 packages)
-        if pkt.get_protocol(ipv6.ipv6):
+        if eth.ethertype == classifier.ETH_TYPE_IPV6:
             match = parser.OFPMatch(eth_type=eth.ethertype)
             actions = []
             self.add_flow(datapath, 1, match, actions)
-            print("Dropped IPv6 Packet")
+            if self.trace.enabled:
+                self.trace.emit('ipv6_drop', dpid=datapath.id)
             return
 
         src_mac = eth.src   #source MAC
         dst_mac = eth.dst   #Destination MAC
 
-        print("Source: ", src_mac)
-        print("Destination: ", dst_mac)
-
-        self.mac_to_port[datapath.id][src_mac] = in_port
+        if self.trace.enabled:
+            self.trace.emit('packet_in', dpid=datapath.id, in_port=in_port,
+                            src=src_mac, dst=dst_mac)
 
+        self.mac_table.learn(datapath.id, mac_table.mac_to_int(eth.src_raw), in_port)
 
-        print("Got Packages")
-        print("")
         self.package_flooding(datapath, msg, in_port)
 
 
+    # Flood along the spanning tree: the broadcast group skips the in_port. Until
+    # discovery settled every port of the switch the group lacks edge ports, the
+    # switch floods on its own.
     def package_flooding(self, datapath, msg, in_port):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
-        actions = [parser.OFPActionOutput(port) for port in self.mac_to_port[datapath.id].values()
-                   if port != in_port]
+        if self.discovery.all_settled(datapath.id):
+            actions = [parser.OFPActionGroup(spanning_tree.BROADCAST_GROUP)]
+        else:
+            actions = [parser.OFPActionOutput(ofproto.OFPP_FLOOD)]
         data = None
         if msg.buffer_id == ofproto.OFP_NO_BUFFER:
             data = msg.data
@@ -0,0 +1,98 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# ARP frames for packet_outs without building and serializing a packet.Packet
+# each time. Every sender (a router port, or a host the proxy answers for) has
+# a template with the fixed fields filled in. A frame is the template copied
+# into a slot of one preallocated arena with the target fields patched, and
+# frames are cached by their addresses, least recently used ones making room.
+# Callers get a memoryview of the slot, packet_outs copy it when serialized.
+#
+# Slots are reused once the cache is full, so a frame has to be sent (the
+# queues flushed) before capacity other new frames are built.
+
+import socket
+from collections import OrderedDict
+
+FRAME_LEN = 42
+ARP_REQUEST = 1
+ARP_REPLY = 2
+
+_BROADCAST = b'\xff' * 6
+_ZERO_MAC = bytes(6)
+# Ethernet type ARP, hardware type ethernet, protocol IPv4, address lengths
+_FIXED = b'\x08\x06\x00\x01\x08\x00\x06\x04'
+
+
+def mac_bytes(mac):
+    return bytes.fromhex(mac.replace(':', ''))
+
+
+class ArpFrames(object):
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.arena = bytearray(FRAME_LEN * capacity)
+        self.view = memoryview(self.arena)
+        self.slots = OrderedDict()  # (opcode, src mac, src ip, dst mac, dst ip) -> offset
+        self.free = [i * FRAME_LEN for i in range(capacity - 1, -1, -1)]
+        self.templates = {}         # (opcode, src mac, src ip) -> bytearray
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def template(self, opcode, src_mac, src_ip):
+        key = (opcode, src_mac, src_ip)
+        template = self.templates.get(key)
+        if template is None:
+            if len(self.templates) >= self.capacity:
+                self.templates.clear()
+            sha = mac_bytes(src_mac)
+            template = self.templates[key] = bytearray(
+                _BROADCAST + sha + _FIXED + opcode.to_bytes(2, 'big') +
+                sha + socket.inet_aton(src_ip) + _ZERO_MAC + bytes(4))
+        return template
+
+    def frame(self, opcode, src_mac, src_ip, dst_mac, dst_ip):
+        # Requests go to broadcast with an empty target MAC, dst_mac is ignored
+        if opcode == ARP_REQUEST:
+            dst_mac = None
+        key = (opcode, src_mac, src_ip, dst_mac, dst_ip)
+        offset = self.slots.get(key)
+        if offset is not None:
+            self.hits += 1
+            self.slots.move_to_end(key)
+            return self.view[offset:offset + FRAME_LEN]
+
+        self.misses += 1
+        offset = self.free.pop() if self.free else self.slots.popitem(last=False)[1]
+        end = offset + FRAME_LEN
+        self.arena[offset:end] = self.template(opcode, src_mac, src_ip)
+        if dst_mac is not None:
+            tha = mac_bytes(dst_mac)
+            self.arena[offset:offset + 6] = tha
+            self.arena[end - 10:end - 4] = tha
+        self.arena[end - 4:end] = socket.inet_aton(dst_ip)
+        self.slots[key] = offset
+        return self.view[offset:end]
+
+    def reply(self, src_mac, src_ip, dst_mac, dst_ip):
+        return self.frame(ARP_REPLY, src_mac, src_ip, dst_mac, dst_ip)
+
+    def request(self, src_mac, src_ip, dst_ip):
+        return self.frame(ARP_REQUEST, src_mac, src_ip, None, dst_ip)
@@ -0,0 +1,131 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# ARP proxy state of the controller. Requests are answered from a bounded,
+# aging cache whenever possible. For unknown targets only one probe is
+# flooded per target and rate limit interval; every requester that asks in
+# the meantime is queued and answered once the target shows up.
+
+import time
+from collections import OrderedDict
+
+# Results of ArpProxy.request()
+REPLY = 'reply'   # answer with the returned MAC
+FLOOD = 'flood'   # flood one probe for the target
+WAIT = 'wait'     # a probe is already out (or rate limited), the requester was queued
+
+
+class Probe(object):
+    __slots__ = ('sent', 'requesters')
+
+    def __init__(self, sent):
+        self.sent = sent
+        # mac -> (dpid, port, ip). Keyed by MAC only, so repeated requests of a host and
+        # copies of our own flooded probe seen on other switches collapse into one entry.
+        self.requesters = {}
+
+
+class ArpProxy(object):
+
+    def __init__(self, ttl=300, capacity=4096, probe_timeout=1.0, flood_interval=1.0,
+                 gateways=None, clock=time.monotonic):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.probe_timeout = probe_timeout
+        self.flood_interval = flood_interval
+        self.clock = clock
+        self.entries = OrderedDict()  # ip -> (mac, expiry), least recently used first
+        self.probes = {}              # target ip -> Probe
+        self.last_flood = {}          # target ip -> time of the last flooded probe
+        self.gateways = dict(gateways or {})  # ip -> mac, always answered
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, ip):
+        mac = self.gateways.get(ip)
+        if mac is not None:
+            return mac
+        entry = self.entries.get(ip)
+        if entry is None:
+            return None
+        if entry[1] < self.clock():
+            del self.entries[ip]
+            return None
+        self.entries.move_to_end(ip)
+        return entry[0]
+
+    def learn(self, ip, mac):
+        # Insert or refresh a binding, gratuitous ARP ends up here as well. Returns
+        # the queued requesters for ip as (dpid, port, mac, ip) tuples.
+        if ip in self.gateways:
+            return []
+        self.entries[ip] = (mac, self.clock() + self.ttl)
+        self.entries.move_to_end(ip)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        probe = self.probes.pop(ip, None)
+        if probe is None:
+            return []
+        self.last_flood.pop(ip, None)
+        return [(dpid, port, req_mac, req_ip)
+                for req_mac, (dpid, port, req_ip) in probe.requesters.items()]
+
+    def items(self):
+        # (ip, mac, expiry) of the cached bindings, least recently used first
+        for ip, (mac, expiry) in self.entries.items():
+            yield ip, mac, expiry
+
+    def restore(self, ip, mac, expiry):
+        # Put back a binding from items(), unless it has expired by now
+        if expiry < self.clock() or ip in self.gateways:
+            return False
+        self.entries[ip] = (mac, expiry)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return True
+
+    def request(self, dpid, port, src_mac, src_ip, target_ip):
+        # Decide how to handle an ARP request, returns (REPLY, mac), (FLOOD, None) or (WAIT, None)
+        mac = self.lookup(target_ip)
+        if mac is not None:
+            return REPLY, mac
+
+        now = self.clock()
+        probe = self.probes.get(target_ip)
+        if probe is None or now - probe.sent > self.probe_timeout:
+            if probe is None:
+                probe = self.probes[target_ip] = Probe(now)
+            probe.requesters.setdefault(src_mac, (dpid, port, src_ip))
+            if now - self.last_flood.get(target_ip, -self.flood_interval) >= self.flood_interval:
+                probe.sent = now
+                self.last_flood[target_ip] = now
+                return FLOOD, None
+            return WAIT, None
+
+        probe.requesters.setdefault(src_mac, (dpid, port, src_ip))
+        return WAIT, None
+
+    def expire(self):
+        # Drop stale cache entries and unanswered probes, call this periodically
+        now = self.clock()
+        for ip in [ip for ip, (_, expiry) in self.entries.items() if expiry < now]:
+            del self.entries[ip]
+        for ip in [ip for ip, probe in self.probes.items()
+                   if now - probe.sent > max(self.probe_timeout, self.flood_interval) * 10]:
+            del self.probes[ip]
+        for ip in [ip for ip, sent in self.last_flood.items() if now - sent > self.flood_interval]:
+            del self.last_flood[ip]
@@ -0,0 +1,120 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+#!/bin/env python3
+
+# Packet_in parse cost: ryu's packet.Packet + get_protocol, as the handlers
+# used to do it, against classifier.classify on the same frames.
+#
+#   python3 bench_classifier.py --pcap s1.pcap
+#   python3 bench_classifier.py --write-pcap mix.pcap
+
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+
+from ryu.lib.packet import packet, ethernet, ipv6, arp
+
+import pcap
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import classifier
+
+
+def synthetic_frames(count, seed=1):
+    # Roughly what reaches the controller: ARP, IPv4 first packets and IPv6 noise
+    rnd = random.Random(seed)
+    frames = []
+    for _ in range(count):
+        src = struct.pack('!HI', 0, rnd.getrandbits(32))
+        dst = struct.pack('!HI', 0, rnd.getrandbits(32))
+        kind = rnd.random()
+        if kind < 0.3:
+            frames.append(b'\xff' * 6 + src + struct.pack('!HHHBBH', 0x0806, 1, 0x0800, 6, 4, 1)
+                          + src + bytes([10, 0, 1, rnd.randint(2, 254)])
+                          + bytes(6) + bytes([10, 0, 1, rnd.randint(2, 254)]))
+        elif kind < 0.8:
+            ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 1428, 0, 0, 64, 6, 0,
+                             bytes([10, 0, 1, rnd.randint(2, 254)]),
+                             bytes([10, 0, 2, rnd.randint(2, 254)]))
+            tcp = struct.pack('!HHIIBBHHH', 40000, 80, 1, 0, 0x50, 0x02, 65535, 0, 0)
+            frames.append(dst + src + b'\x08\x00' + ip + tcp + bytes(1388))
+        else:
+            ip6 = struct.pack('!IHBB16s16s', 0x60000000, 24, 58, 255, bytes(16), bytes(16))
+            frames.append(b'\x33\x33\x00\x00\x00\x16' + src + b'\x86\xdd' + ip6 + bytes(24))
+    return frames
+
+
+def ryu_parse(data):
+    pkt = packet.Packet(data)
+    eth = pkt.get_protocol(ethernet.ethernet)
+    if pkt.get_protocol(ipv6.ipv6):
+        return eth.ethertype
+    arp_pkt = pkt.get_protocol(arp.arp)
+    if arp_pkt:
+        return arp_pkt.dst_ip
+    return eth.src, eth.dst
+
+
+def fast_parse(data):
+    frame = classifier.classify(data)
+    if frame.ethertype == classifier.ETH_TYPE_IPV6:
+        return frame.ethertype
+    if frame.ethertype == classifier.ETH_TYPE_ARP:
+        return frame.arp().dst_ip
+    return frame.src, frame.dst
+
+
+def measure(parse, frames, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for data in frames:
+            parse(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark packet_in classification')
+    parser.add_argument('--pcap', help='classify the frames of this capture')
+    parser.add_argument('--write-pcap', help='write the synthetic frames to this file and exit')
+    parser.add_argument('--frames', type=int, default=50000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    frames = list(pcap.read_pcap(args.pcap)) if args.pcap else synthetic_frames(args.frames)
+    if args.write_pcap:
+        pcap.write_pcap(args.write_pcap, frames)
+        return
+
+    ryu_time = measure(ryu_parse, frames, args.rounds)
+    fast_time = measure(fast_parse, frames, args.rounds)
+    print('frames:          %d' % len(frames))
+    print('ryu packet:      %.2f us/frame, %.0f frames/s'
+          % (ryu_time / len(frames) * 1e6, len(frames) / ryu_time))
+    print('classifier:      %.2f us/frame, %.0f frames/s'
+          % (fast_time / len(frames) * 1e6, len(frames) / fast_time))
+    print('speedup:         %.1fx' % (ryu_time / fast_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+#!/bin/env python3
+
+# Controller benchmark suite. Loads the ans_controller.py apps in-process,
+# connects fake datapaths and replays packet_in streams against them: the
+# synthetic scenarios (ARP storm, many-flow unicast, IPv6 noise) or a recorded
+# trace. Frames that hit a flow the app installed on the emulated switch do not
+# reach the controller, as on a real switch.
+#
+#   python3 bench_controllers.py
+#   python3 bench_controllers.py --scenario arp_storm --hosts 512 --frames 50000
+#   python3 bench_controllers.py --trace s1.pcap --dpid 1 --json results.json
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import fake_datapath
+import pcap
+import scenarios
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir))
+
+from metrics import Histogram
+
+CONTROLLERS = [os.path.join(HERE, '..', 'ans_controller.py'),
+               os.path.join(HERE, '..', 'new_approach', 'ans_controller.py'),
+               os.path.join(HERE, '..', 'forwarding_test', 'ans_controller.py')]
+
+
+def load_records(path, dpid, in_port):
+    # A fake_datapath JSONL trace, or a pcap replayed as seen on one switch port
+    if path.endswith('.pcap'):
+        return [(dpid, in_port, frame) for frame in pcap.read_pcap(path)]
+    return list(fake_datapath.read_trace(path))
+
+
+def run(controller, records, ports, emulate=True, admission=False):
+    app = fake_datapath.load_app(controller)
+    if not admission and getattr(app, 'admission', None) is not None:
+        # Replays run far above any sane per-port rate, measure the handlers instead
+        app.admission = None
+    datapaths = {}
+    latency = Histogram('handler_seconds', '')
+    packet_ins = 0
+    elapsed = 0.0
+    # The controllers may log to stdout, keep that out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        for dpid, in_port, data in records:
+            datapath = datapaths.get(dpid)
+            if datapath is None:
+                datapath = datapaths[dpid] = fake_datapath.FakeDatapath(dpid, ports=range(1, ports + 1))
+                fake_datapath.connect(app, datapath)
+                fake_datapath.deliver_replies(app, datapath)
+                datapath.reset_counters()
+            if emulate:
+                entry = datapath.flow_table.lookup(fake_datapath.frame_fields(in_port, data))
+                if entry is not None and not datapath.flow_table.punts_to_controller(entry):
+                    continue
+            ev = fake_datapath.packet_in(datapath, in_port, data)
+            start = time.perf_counter()
+            fake_datapath.deliver(app, ev)
+            took = time.perf_counter() - start
+            elapsed += took
+            latency.observe(took)
+            packet_ins += 1
+            fake_datapath.deliver_replies(app, datapath)
+    close = getattr(app, 'close', None)
+    if close is not None:
+        close()
+    return {
+        'frames': len(records),
+        'packet_in': packet_ins,
+        'packet_in_per_s': packet_ins / elapsed if elapsed else 0.0,
+        'p50_us': latency.quantile(0.5) * 1e6,
+        'p99_us': latency.quantile(0.99) * 1e6,
+        'flow_mods': sum(dp.flow_mods for dp in datapaths.values()),
+        'packet_outs': sum(dp.packet_outs for dp in datapaths.values()),
+        'writes': sum(dp.writes for dp in datapaths.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the controllers on replayed packet_in streams')
+    parser.add_argument('controllers', nargs='*', default=CONTROLLERS)
+    parser.add_argument('--scenario', action='append', choices=sorted(scenarios.SCENARIOS),
+                        help='run only this scenario, default all of them')
+    parser.add_argument('--trace', help='replay a recorded trace (.jsonl or .pcap) instead')
+    parser.add_argument('--dpid', type=int, default=1, help='switch a pcap trace was captured on')
+    parser.add_argument('--in-port', type=int, default=1, help='port a pcap trace was captured on')
+    parser.add_argument('--hosts', type=int, default=64)
+    parser.add_argument('--switches', type=int, default=2)
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--no-emulation', action='store_true',
+                        help='send every frame to the controller, ignoring installed flows')
+    parser.add_argument('--admission', action='store_true',
+                        help='keep the packet_in rate limits of the apps enabled')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    if args.trace:
+        streams = [(os.path.basename(args.trace), load_records(args.trace, args.dpid, args.in_port))]
+    else:
+        streams = [(name, scenarios.SCENARIOS[name](args.hosts, args.frames, args.switches))
+                   for name in (args.scenario or sorted(scenarios.SCENARIOS))]
+    # Enough ports for every host of the scenario
+    ports = max(64, args.hosts // args.switches + 1)
+
+    results = []
+    print('%-12s %-32s %8s %10s %8s %8s %9s %11s %7s' % (
+        'scenario', 'controller', 'pkt_in', 'pkt_in/s', 'p50 us', 'p99 us',
+        'flow_mod', 'packet_out', 'writes'))
+    for name, records in streams:
+        for controller in args.controllers:
+            result = run(controller, records, ports, not args.no_emulation, args.admission)
+            result.update(scenario=name, controller=os.path.relpath(controller))
+            results.append(result)
+            print('%-12s %-32s %8d %10.0f %8.1f %8.1f %9d %11d %7d' % (
+                name, result['controller'][-32:], result['packet_in'], result['packet_in_per_s'],
+                result['p50_us'], result['p99_us'], result['flow_mods'],
+                result['packet_outs'], result['writes']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+#!/bin/env python3
+
+# Firewall compile time and table size for generated rule lists. The rules
+# pick their addresses from a few sites, subnets and hosts, so lists repeat
+# and overlap the way long-lived ones do. Next to the compiled flows is what
+# installing every rule as is would take: one flow per rule and port block,
+# one priority per rule.
+#
+#   python3 bench_firewall.py
+#   python3 bench_firewall.py --rules 10000 --default deny
+
+import argparse
+import os
+import random
+import sys
+import time
+from ipaddress import IPv4Network
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import firewall
+
+DEFAULT_SIZES = (100, 1000, 10000)
+SERVICES = ((6, (80, 80)), (6, (443, 443)), (6, (22, 22)), (17, (53, 53)), (6, (8000, 8999)),
+            (17, (1024, 65535)), (1, None), (None, None))
+
+
+def addresses(rnd, sites=8, subnets=16, hosts=32):
+    # Sites /16, subnets /24, hosts /32, weighted towards the hosts
+    pool = []
+    for site in range(sites):
+        pool.append(IPv4Network('10.%d.0.0/16' % site))
+        for subnet in range(subnets):
+            pool.append(IPv4Network('10.%d.%d.0/24' % (site, subnet)))
+            pool.extend(IPv4Network('10.%d.%d.%d/32' % (site, subnet, rnd.randrange(1, 255)))
+                        for _ in range(hosts // subnets or 1))
+    return pool
+
+
+def generate(n, rnd):
+    pool = addresses(rnd)
+    anywhere = IPv4Network('0.0.0.0/0')
+    rules = []
+    for line in range(1, n + 1):
+        proto, dport = rnd.choice(SERVICES)
+        src = anywhere if rnd.random() < 0.05 else rnd.choice(pool)
+        dst = rnd.choice(pool)
+        action = firewall.ALLOW if rnd.random() < 0.6 else firewall.DENY
+        rules.append(firewall.Rule(action, proto, src, dst, firewall.ANY_PORT,
+                                   dport or firewall.ANY_PORT, line))
+    return rules
+
+
+def run(n, default, seed):
+    rules = generate(n, random.Random(seed))
+    naive = sum(len(firewall.rule_matches(rule)) for rule in rules)
+    start = time.perf_counter()
+    result = firewall.compile(rules, default)
+    took = time.perf_counter() - start
+    print('%6d rules  %7.2fs  %6d kept  %6d shadowed  %6d redundant  %7d correlated'
+          % (n, took, len(result.kept), len(result.shadowed), len(result.redundant),
+             len(result.correlated)))
+    print('        flows %6d -> %6d   priorities %6d -> %4d'
+          % (naive, len(result.flows), n, result.n_levels))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Firewall compile time and table size')
+    parser.add_argument('--rules', type=int, action='append', help='rule list size, repeatable')
+    parser.add_argument('--default', choices=(firewall.ALLOW, firewall.DENY), default=firewall.ALLOW)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    for n in args.rules or DEFAULT_SIZES:
+        run(n, args.default, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+#!/bin/env python3
+
+# Flow table occupancy on generated topologies: one entry per (src, dst)
+# host pair crossing a switch (the reactive design), one per destination (the
+# planner) and the flow compiler's prefix rules, with unknown addresses either
+# don't-care or forced to the controller. Also times a full compile and the
+# incremental recompile after a link failure.
+#
+#   python3 bench_flow_compiler.py
+#   python3 bench_flow_compiler.py --topo fat-tree --k 8 --gateway
+
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import topo_gen
+from flow_compiler import FlowCompiler
+from proactive import ProactivePlanner
+from topology import Topology
+
+DEFAULT_TOPOLOGIES = [('fat-tree', {'k': 8}), ('leaf-spine', {'spines': 4, 'leaves': 32, 'hosts': 32}),
+                      ('linear', {'switches': 16, 'hosts': 16})]
+
+
+def pair_entries(topology, planner):
+    # Per switch: host pairs whose path crosses it, i.e. exact (src, dst) flows
+    per_switch = Counter()
+    hosts_at = Counter(host.dpid for host in topology.hosts.values())
+    for a, count_a in hosts_at.items():
+        for b, count_b in hosts_at.items():
+            pairs = count_a * count_b - (count_a if a == b else 0)
+            path = planner.paths.path(a, b) if pairs else None
+            for dpid in path or ():
+                per_switch[dpid] += pairs
+    return per_switch
+
+
+def compile_all(planner, exact):
+    compiler = FlowCompiler(exact)
+    start = time.perf_counter()
+    for dpid in planner.topology.switches:
+        adds, removes = planner.install_all(dpid)
+        compiler.compile(dpid, adds, removes)
+    return compiler, time.perf_counter() - start
+
+
+def summary(counts):
+    counts = list(counts)
+    return '%8d %8d %10d' % (max(counts), sum(counts) / len(counts), sum(counts))
+
+
+def run(kind, params, gateway, seed):
+    desc = topo_gen.generate(kind, gateway=gateway, **params)
+    topology = Topology.from_dict(desc)
+    planner = ProactivePlanner(topology)
+    switches = sorted(topology.switches)
+    print('%s %s: %d switches, %d hosts' % (kind, ' '.join('%s=%s' % kv for kv in sorted(params.items())),
+                                           len(switches), len(topology.hosts)))
+    print('  %-26s %8s %8s %10s' % ('rules per switch', 'max', 'mean', 'total'))
+
+    pairs = pair_entries(topology, planner)
+    print('  %-26s %s' % ('(src, dst) pairs', summary(pairs[d] for d in switches)))
+    print('  %-26s %s' % ('per destination', summary(len(planner.desired(d)) for d in switches)))
+    for exact in (False, True):
+        compiler, took = compile_all(planner, exact)
+        name = 'compiled, %s' % ('exact' if exact else "don't-care")
+        print('  %-26s %s   %.2fs' % (name, summary(compiler.occupancy(d)[0] + compiler.occupancy(d)[2]
+                                                     for d in switches), took))
+
+    # Incremental: a fabric link fails and comes back
+    rnd = random.Random(seed)
+    compiler, _ = compile_all(planner, False)
+    link = rnd.choice([(l['src'], l['src_port']) for l in desc['links']])
+    for up in (False, True):
+        start = time.perf_counter()
+        changes = planner.link_changed(link[0], link[1], up)
+        planned = sum(len(a) + len(r) for a, r in changes.values())
+        compiled = 0
+        for dpid, (adds, removes) in changes.items():
+            adds, removes = compiler.compile(dpid, adds, removes)
+            compiled += len(adds) + len(removes)
+        print('  link %s port %s %-5s %d switches, %d planner changes -> %d flow_mods, %.1f ms'
+              % (link[0], link[1], 'up' if up else 'down', len(changes), planned, compiled,
+                 (time.perf_counter() - start) * 1e3))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flow table occupancy with and without the flow compiler')
+    parser.add_argument('--topo', choices=('fat-tree', 'leaf-spine', 'linear'),
+                        help='only this topology, with the generator options below')
+    topo_gen.add_arguments(parser)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.topo:
+        params = {'fat-tree': {'k': args.k},
+                  'leaf-spine': {'spines': args.spines, 'leaves': args.leaves, 'hosts': args.hosts},
+                  'linear': {'switches': args.switches, 'hosts': args.hosts}}[args.topo]
+        topologies = [(args.topo, params)]
+    else:
+        topologies = DEFAULT_TOPOLOGIES
+    for kind, params in topologies:
+        run(kind, params, args.gateway, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+#!/bin/env python3
+
+# MAC learning table benchmark: MacTable against the old dict of dicts keyed
+# by dpid and MAC string, memory and learn/lookup throughput
+#
+#   python3 bench_mac_table.py --macs 1000000 --switches 100
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from mac_table import MacTable
+
+
+def measure(build):
+    # (result, bytes the result holds on to, seconds), timed without tracemalloc
+    # since tracing slows every allocation down
+    gc.collect()
+    start = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the MAC learning table')
+    parser.add_argument('--macs', type=int, default=1000000)
+    parser.add_argument('--switches', type=int, default=100)
+    parser.add_argument('--lookups', type=int, default=1000000)
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    per_switch = args.macs // args.switches
+    # Raw source addresses as the packet_in handlers see them, unicast only
+    learned = [(i % args.switches + 1, (rnd.getrandbits(47) << 1).to_bytes(6, 'big'),
+                rnd.randint(1, 48)) for i in range(per_switch * args.switches)]
+    probes = [rnd.choice(learned)[:2] for _ in range(args.lookups)]
+
+    # Both tables pay for turning the raw address into their key, a colon string
+    # (what frame.src returns) for the old one and an int for MacTable
+    def build_dicts():
+        mac_to_port = {}
+        for dpid, mac, port in learned:
+            mac_to_port.setdefault(dpid, {})[mac.hex(':')] = port
+        return mac_to_port
+
+    def build_table():
+        table = MacTable(capacity=per_switch)
+        for dpid, mac, port in learned:
+            table.learn(dpid, int.from_bytes(mac, 'big'), port)
+        return table
+
+    dicts, dict_bytes, dict_learn = measure(build_dicts)
+    table, table_bytes, table_learn = measure(build_table)
+
+    start = time.perf_counter()
+    for dpid, mac in probes:
+        mac_to_port = dicts[dpid]
+        mac = mac.hex(':')
+        if mac in mac_to_port:
+            mac_to_port[mac]
+    dict_lookup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for dpid, mac in probes:
+        table.lookup(dpid, int.from_bytes(mac, 'big'))
+    table_lookup = time.perf_counter() - start
+
+    # Learning new stations past the capacity evicts the least recently seen ones
+    fresh = [(dpid, rnd.getrandbits(47) << 1, port) for dpid, _, port in learned[:args.lookups]]
+    start = time.perf_counter()
+    for dpid, mac, port in fresh:
+        table.learn(dpid, mac, port)
+    evict_learn = time.perf_counter() - start
+
+    print('stations:              %d on %d switches' % (len(learned), args.switches))
+    print('%-22s %12s %14s %14s' % ('', 'memory', 'learn', 'lookup'))
+    for name, size, learn, lookup in (('dict of dicts (str)', dict_bytes, dict_learn, dict_lookup),
+                                      ('MacTable', table_bytes, table_learn, table_lookup)):
+        print('%-22s %9.1f MB %9.0f k/s %9.0f k/s'
+              % (name, size / 1e6, len(learned) / learn / 1e3, len(probes) / lookup / 1e3))
+    print('learn with eviction:   %.0f k/s (%d evicted)'
+          % (len(fresh) / evict_learn / 1e3, table.evicted))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+#!/bin/env python3
+
+# Replays a packet trace against one or more controllers and counts how many
+# frames still end up at the controller as packet_in. By default it compares
+# new_approach before reactive forwarding (its source at BASELINE, taken from
+# git) with the one in the tree.
+#
+#   python3 bench_reactive.py --record trace.jsonl
+#   python3 bench_reactive.py --trace trace.jsonl --before f42e8a1
+#   python3 bench_reactive.py --trace trace.jsonl ../ans_controller.py ../new_approach/ans_controller.py
+
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import tempfile
+import time
+
+import fake_datapath
+import scenarios
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(HERE, '..', 'new_approach', 'ans_controller.py')
+BASELINE = 'f42e8a1'  # the tree before reactive forwarding
+
+
+def app_at(rev, directory):
+    # Writes new_approach's app as of rev into directory, returns its path
+    source = subprocess.check_output(
+        ['git', 'show', '%s:./%s' % (rev, os.path.relpath(APP, HERE).replace(os.sep, '/'))], cwd=HERE)
+    path = os.path.join(directory, 'ans_controller_%s.py' % rev)
+    with open(path, 'wb') as f:
+        f.write(source)
+    return path
+
+
+def synthetic_trace(hosts, frames, seed=1):
+    # Unicast between random host pairs on one switch, host i sits on port i
+    return scenarios.unicast(hosts, frames, switches=1, seed=seed)
+
+
+def replay(controller, records):
+    app = fake_datapath.load_app(controller)
+    datapaths = {}
+    punted = 0
+    failed = 0
+    elapsed = 0.0
+    # The controllers trace to stdout, keep that out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        for dpid, in_port, data in records:
+            if dpid not in datapaths:
+                datapaths[dpid] = fake_datapath.FakeDatapath(dpid, ports=range(1, 65))
+                fake_datapath.connect(app, datapaths[dpid])
+                fake_datapath.deliver_replies(app, datapaths[dpid])
+            datapath = datapaths[dpid]
+            entry = datapath.flow_table.lookup(fake_datapath.frame_fields(in_port, data))
+            if entry is not None and not datapath.flow_table.punts_to_controller(entry):
+                continue
+            punted += 1
+            ev = fake_datapath.packet_in(datapath, in_port, data)
+            start = time.perf_counter()
+            try:
+                fake_datapath.deliver(app, ev)
+            except Exception:
+                # The baseline app raises on most packet_ins (ryu logs and goes
+                # on), the frame was punted all the same
+                failed += 1
+            elapsed += time.perf_counter() - start
+    flow_mods = sum(dp.flow_mods for dp in datapaths.values())
+    return punted, failed, elapsed, flow_mods
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a packet trace against LearningSwitch controllers')
+    parser.add_argument('controllers', nargs='*',
+                        help='controllers to replay against, default new_approach before and now')
+    parser.add_argument('--before', default=BASELINE,
+                        help='git revision of new_approach to compare against (default %(default)s)')
+    parser.add_argument('--trace', help='replay this trace instead of a synthetic one')
+    parser.add_argument('--record', help='write the synthetic trace to this file and exit')
+    parser.add_argument('--hosts', type=int, default=16)
+    parser.add_argument('--frames', type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.trace:
+        records = list(fake_datapath.read_trace(args.trace))
+    else:
+        records = synthetic_trace(args.hosts, args.frames)
+    if args.record:
+        fake_datapath.write_trace(args.record, records)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.controllers:
+            controllers = [(os.path.relpath(path), path) for path in args.controllers]
+        else:
+            controllers = [('new_approach@%s' % args.before, app_at(args.before, directory)),
+                           ('new_approach', APP)]
+        print('%-40s %10s %10s %12s %10s %10s' % ('controller', 'frames', 'packet_in', 'packet_in/s',
+                                                  'flow_mods', 'errors'))
+        for name, controller in controllers:
+            punted, failed, elapsed, flow_mods = replay(controller, records)
+            rate = punted / elapsed if elapsed else 0.0
+            print('%-40s %10d %10d %12.0f %10d %10d' % (name, len(records), punted, rate,
+                                                        flow_mods, failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+#!/bin/env python3
+
+# Longest prefix match micro-benchmark: RouteTable against a linear scan
+#
+#   python3 bench_route_lookup.py --prefixes 20000 --lookups 200000
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from router import RouteTable
+
+
+def random_prefixes(count, rnd):
+    prefixes = set()
+    while len(prefixes) < count:
+        plen = rnd.choice((8, 12, 16, 16, 20, 22, 24, 24, 24, 28, 32))
+        net = rnd.getrandbits(32) & ((0xffffffff << (32 - plen)) & 0xffffffff)
+        prefixes.add((net, plen))
+    return sorted(prefixes)
+
+
+def linear_lookup(routes, ip):
+    best = None
+    for net, mask, plen, route in routes:
+        if ip & mask == net and (best is None or plen > best[0]):
+            best = (plen, route)
+    return best and best[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark RouteTable longest prefix match')
+    parser.add_argument('--prefixes', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--linear-lookups', type=int, default=200,
+                        help='lookups for the linear scan baseline, it is slow')
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    prefixes = random_prefixes(args.prefixes, rnd)
+
+    table = RouteTable()
+    start = time.perf_counter()
+    for i, (net, plen) in enumerate(prefixes):
+        table.add('%d.%d.%d.%d/%d' % (net >> 24, (net >> 16) & 0xff, (net >> 8) & 0xff,
+                                      net & 0xff, plen), i % 48 + 1)
+    build = time.perf_counter() - start
+
+    linear = [(int(r.network.network_address), int(r.network.netmask), r.network.prefixlen, r)
+              for r in table.routes()]
+
+    # Half of the addresses fall into a known prefix, the rest is random
+    addresses = [rnd.choice(prefixes)[0] | rnd.getrandbits(8) if i % 2 else rnd.getrandbits(32)
+                 for i in range(args.lookups)]
+
+    for ip in addresses[:args.linear_lookups]:
+        assert table.lookup(ip) is linear_lookup(linear, ip)
+
+    start = time.perf_counter()
+    for ip in addresses:
+        table.lookup(ip)
+    indexed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for ip in addresses[:args.linear_lookups]:
+        linear_lookup(linear, ip)
+    scan = time.perf_counter() - start
+
+    print('prefixes:              %d (%d distinct lengths)' % (len(table), len(table._tables)))
+    print('build time:            %.3f s' % build)
+    print('indexed lookup:        %.2f us/lookup, %.0f lookups/s'
+          % (indexed / len(addresses) * 1e6, len(addresses) / indexed))
+    print('linear scan lookup:    %.2f us/lookup, %.0f lookups/s'
+          % (scan / args.linear_lookups * 1e6, args.linear_lookups / scan))
+
+
+if __name__ == '__main__':
+    main()
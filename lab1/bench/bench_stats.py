@@ -0,0 +1,86 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+#!/bin/env python3
+
+# Stats poller benchmark: handling one round of port and flow stats replies of
+# a large fabric in the RateSeries ring buffers, and the utilisation queries
+# routing makes against them
+#
+#   python3 bench_stats.py --switches 500 --ports 48 --flows 20000
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from stats import RateSeries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the stats ring buffers')
+    parser.add_argument('--switches', type=int, default=500)
+    parser.add_argument('--ports', type=int, default=48)
+    parser.add_argument('--flows', type=int, default=20000, help='flows per round, over all switches')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=1000000)
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    now = [1.0]
+    ports = RateSeries(clock=lambda: now[0])
+    flows = RateSeries(clock=lambda: now[0])
+    port_keys = [[(dpid, port) for port in range(1, args.ports + 1)]
+                 for dpid in range(1, args.switches + 1)]
+    flow_keys = [[(dpid, 10, (('eth_dst', i),)) for i in range(args.flows // args.switches)]
+                 for dpid in range(1, args.switches + 1)]
+    tx = [0] * (args.ports + 1)
+
+    # One reply per switch and round, as the poller hands them over
+    port_time = flow_time = 0.0
+    for _ in range(args.rounds):
+        now[0] += 1
+        for keys in port_keys:
+            tx = [count + rnd.randint(0, 10 ** 8) for count in tx]
+            start = time.perf_counter()
+            ports.update(ports.rows(keys, lambda key: 1e9), tx[1:])
+            port_time += time.perf_counter() - start
+        for keys in flow_keys:
+            counts = [rnd.randint(0, 10 ** 9) * now[0] for _ in keys]
+            start = time.perf_counter()
+            flows.update(flows.rows(keys), counts)
+            flow_time += time.perf_counter() - start
+
+    probes = [rnd.choice(rnd.choice(port_keys)) for _ in range(args.queries)]
+    start = time.perf_counter()
+    for key in probes:
+        ports.utilisation(key)
+    query_time = time.perf_counter() - start
+
+    print('%d switches, %d ports, %d flows, %d rounds' %
+          (args.switches, len(ports), len(flows), args.rounds))
+    print('port stats  %8.2f ms per round  %6.2f us per reply' %
+          (port_time / args.rounds * 1e3, port_time / args.rounds / args.switches * 1e6))
+    print('flow stats  %8.2f ms per round  %6.2f us per reply' %
+          (flow_time / args.rounds * 1e3, flow_time / args.rounds / args.switches * 1e6))
+    print('utilisation %8.2f us per query' % (query_time / args.queries * 1e6))
+
+
+if __name__ == '__main__':
+    main()
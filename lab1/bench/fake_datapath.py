@@ -0,0 +1,310 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# In-process stand-in for an OpenFlow switch connection, used by the benchmarks.
+# It records everything a ryu app sends and emulates the flow tables, so a trace
+# can be replayed without Mininet, OVS or root.
+
+import importlib.util
+import inspect
+import json
+import os
+import struct
+
+from ryu.base import app_manager
+from ryu.controller import ofp_event
+from ryu.ofproto import ofproto_parser, ofproto_v1_3, ofproto_v1_3_parser
+
+
+def mac_to_str(raw):
+    return ':'.join('%02x' % b for b in raw)
+
+
+def frame_fields(in_port, data):
+    # OXM field values of a raw ethernet frame, in the format OFPMatch.items() uses
+    dst, src, eth_type = struct.unpack_from('!6s6sH', data, 0)
+    fields = {'in_port': in_port, 'eth_dst': mac_to_str(dst),
+              'eth_src': mac_to_str(src), 'eth_type': eth_type}
+    if eth_type == 0x0800 and len(data) >= 34:
+        proto, = struct.unpack_from('!B', data, 23)
+        fields['ip_proto'] = proto
+        fields['ipv4_src'] = '.'.join(str(b) for b in data[26:30])
+        fields['ipv4_dst'] = '.'.join(str(b) for b in data[30:34])
+        l4 = 14 + (data[14] & 0xf) * 4
+        if proto in (6, 17) and len(data) >= l4 + 4:
+            prefix = 'tcp' if proto == 6 else 'udp'
+            fields[prefix + '_src'], fields[prefix + '_dst'] = struct.unpack_from('!HH', data, l4)
+    return fields
+
+
+def _field_matches(value, wanted):
+    if value is None:
+        return False
+    if isinstance(wanted, tuple):
+        wanted, mask = wanted
+        if isinstance(value, str) and '.' in value:
+            value, wanted, mask = (struct.unpack('!I', bytes(int(b) for b in x.split('.')))[0]
+                                   for x in (value, wanted, mask))
+        elif isinstance(value, str):
+            value, wanted, mask = (int(x.replace(':', ''), 16) for x in (value, wanted, mask))
+        return value & mask == wanted & mask
+    return value == wanted
+
+
+class FlowEntry(object):
+    __slots__ = ('table_id', 'priority', 'match', 'instructions', 'cookie', 'packets')
+
+    def __init__(self, priority, match, instructions, cookie=0, table_id=0):
+        self.table_id = table_id
+        self.priority = priority
+        self.match = match
+        self.instructions = instructions
+        self.cookie = cookie
+        self.packets = 0
+
+    def matches(self, fields):
+        return all(_field_matches(fields.get(k), v) for k, v in self.match.items())
+
+
+class FlowTable(object):
+    # Flow table emulation: highest priority entry wins, goto-table instructions are
+    # followed, timeouts are ignored. Tables are created as flows go into them.
+
+    def __init__(self):
+        self.tables = {}  # table_id -> entries, highest priority first
+
+    @property
+    def entries(self):
+        return [e for table_id in sorted(self.tables) for e in self.tables[table_id]]
+
+    def apply(self, mod):
+        ofproto = ofproto_v1_3
+        match = dict(mod.match.items())
+        if mod.command == ofproto.OFPFC_ADD:
+            entries = [e for e in self.tables.get(mod.table_id, [])
+                       if not (e.priority == mod.priority and e.match == match)]
+            entries.append(FlowEntry(mod.priority, match, mod.instructions, mod.cookie, mod.table_id))
+            entries.sort(key=lambda e: -e.priority)
+            self.tables[mod.table_id] = entries
+            return
+        for table_id in list(self.tables):
+            if mod.table_id not in (ofproto.OFPTT_ALL, table_id):
+                continue
+            if mod.command == ofproto.OFPFC_DELETE_STRICT:
+                self.tables[table_id] = [e for e in self.tables[table_id]
+                                         if not (e.priority == mod.priority and e.match == match)]
+            elif mod.command == ofproto.OFPFC_DELETE:
+                # Non-strict delete removes every entry at least as specific as the match
+                self.tables[table_id] = [e for e in self.tables[table_id]
+                                         if not all(e.match.get(k) == v for k, v in match.items())]
+
+    def lookup(self, fields):
+        # The entry that decides what happens to a packet, None on a miss without
+        # a table-miss entry
+        table_id = 0
+        while True:
+            for entry in self.tables.get(table_id, ()):
+                if entry.matches(fields):
+                    entry.packets += 1
+                    break
+            else:
+                return None
+            goto = [inst for inst in entry.instructions
+                    if isinstance(inst, ofproto_v1_3_parser.OFPInstructionGotoTable)]
+            if not goto:
+                return entry
+            table_id = goto[0].table_id
+
+    def stats(self):
+        # The entries as the body of a flow-stats reply
+        parser = ofproto_v1_3_parser
+        return [parser.OFPFlowStats(table_id=e.table_id, duration_sec=0, duration_nsec=0,
+                                    priority=e.priority, idle_timeout=0, hard_timeout=0,
+                                    flags=0, cookie=e.cookie, packet_count=e.packets,
+                                    byte_count=0, match=parser.OFPMatch(**e.match),
+                                    instructions=e.instructions)
+                for e in self.entries]
+
+    def punts_to_controller(self, entry):
+        # True if a packet hitting this entry is sent to the controller
+        for inst in entry.instructions:
+            for action in getattr(inst, 'actions', []):
+                if getattr(action, 'port', None) == ofproto_v1_3.OFPP_CONTROLLER:
+                    return True
+        return False
+
+
+class FakeDatapath(object):
+    # Mimics the parts of ryu.controller.controller.Datapath the apps use
+
+    ofproto = ofproto_v1_3
+    ofproto_parser = ofproto_v1_3_parser
+
+    def __init__(self, dpid, ports=(1, 2, 3, 4), n_tables=8):
+        self.id = dpid
+        self.n_tables = n_tables
+        self.xid = 0
+        self.ports = dict((p, ofproto_v1_3_parser.OFPPort(
+            p, '00:00:00:00:%02x:%02x' % (dpid & 0xff, p), 's%d-eth%d' % (dpid, p),
+            0, 0, 0, 0, 0, 0, 0, 0)) for p in ports)
+        self.flow_table = FlowTable()
+        self.sent = []
+        self.replies = []  # switch -> controller messages, e.g. barrier replies
+        self.writes = 0
+        self.flow_mods = 0
+        self.packet_outs = 0
+        self.bytes_sent = 0
+
+    def set_xid(self, msg):
+        self.xid = (self.xid + 1) & 0xffffffff
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send(self, buf):
+        # One socket write, possibly holding several messages (flow_programmer batches)
+        self.writes += 1
+        self.bytes_sent += len(buf)
+        offset = 0
+        while offset + ofproto_v1_3.OFP_HEADER_SIZE <= len(buf):
+            version, msg_type, msg_len, xid = ofproto_parser.header(buf[offset:])
+            body = bytes(buf[offset:offset + msg_len])
+            offset += msg_len
+            if msg_type == ofproto_v1_3.OFPT_BARRIER_REQUEST:
+                reply = ofproto_v1_3_parser.OFPBarrierReply(self)
+                reply.xid = xid
+                self.replies.append(reply)
+            elif msg_type == ofproto_v1_3.OFPT_MULTIPART_REQUEST and \
+                    struct.unpack_from('!H', body, ofproto_v1_3.OFP_HEADER_SIZE)[0] == ofproto_v1_3.OFPMP_FLOW:
+                # A flow-stats request for everything (reconcile.py), answered in one part
+                self.sent.append(body)
+                reply = ofproto_v1_3_parser.OFPFlowStatsReply(self, body=self.flow_table.stats(), flags=0)
+                reply.xid = xid
+                self.replies.append(reply)
+            elif msg_type == ofproto_v1_3.OFPT_MULTIPART_REQUEST and \
+                    struct.unpack_from('!H', body, ofproto_v1_3.OFP_HEADER_SIZE)[0] == \
+                    ofproto_v1_3.OFPMP_TABLE_FEATURES:
+                # Table features (pipeline.py): n_tables tables, properties left out
+                self.sent.append(body)
+                reply = ofproto_v1_3_parser.OFPTableFeaturesStatsReply(
+                    self, body=[self.table_features(table_id) for table_id in range(self.n_tables)],
+                    flags=0)
+                reply.xid = xid
+                self.replies.append(reply)
+            elif msg_type == ofproto_v1_3.OFPT_FLOW_MOD:
+                # Decoded back into an OFPFlowMod to feed the emulated flow table
+                self._received(ofproto_parser.msg(self, version, msg_type, msg_len, xid, body))
+            elif msg_type == ofproto_v1_3.OFPT_PACKET_OUT:
+                self.packet_outs += 1
+                self.sent.append(body)
+            else:
+                self.sent.append(body)
+        return True
+
+    def _received(self, msg):
+        self.sent.append(msg)
+        if isinstance(msg, ofproto_v1_3_parser.OFPFlowMod):
+            self.flow_mods += 1
+            self.flow_table.apply(msg)
+        elif isinstance(msg, ofproto_v1_3_parser.OFPPacketOut):
+            self.packet_outs += 1
+
+    def table_features(self, table_id):
+        return ofproto_v1_3_parser.OFPTableFeaturesStats(
+            table_id=table_id, name='table%d' % table_id, metadata_match=0, metadata_write=0,
+            config=0, max_entries=1000000, properties=[])
+
+    def send_msg(self, msg):
+        if msg.xid is None:
+            self.set_xid(msg)
+        msg.serialize()
+        self.writes += 1
+        self.bytes_sent += len(msg.buf)
+        self._received(msg)
+        return True
+
+    def send_packet_out(self, buffer_id=0xffffffff, in_port=None, actions=None, data=None):
+        out = self.ofproto_parser.OFPPacketOut(self, buffer_id, in_port, actions, data)
+        self.send_msg(out)
+
+    def reset_counters(self):
+        self.sent = []
+        self.replies = []
+        self.writes = 0
+        self.flow_mods = 0
+        self.packet_outs = 0
+        self.bytes_sent = 0
+
+
+def load_app(path):
+    # Import an ans_controller.py by file name and instantiate its RyuApp
+    path = os.path.abspath(path)
+    name = 'bench_app_%x' % (hash(path) & 0xffffffff)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    app_cls = [cls for _, cls in inspect.getmembers(module, inspect.isclass)
+               if issubclass(cls, app_manager.RyuApp) and cls.__module__ == name][0]
+    # Every run starts from scratch, nothing persisted by an earlier one
+    app_cls.STATE_FILE = None
+    contexts = dict((key, ctx_cls()) for key, ctx_cls in app_cls._CONTEXTS.items())
+    return app_cls(**contexts)
+
+
+def deliver(app, ev):
+    # Call every handler the app registered with @set_ev_cls for this event class
+    handled = False
+    for _, method in inspect.getmembers(app, inspect.ismethod):
+        callers = getattr(method, 'callers', None)
+        if callers and ev.__class__ in callers:
+            method(ev)
+            handled = True
+    return handled
+
+
+def connect(app, datapath):
+    msg = ofproto_v1_3_parser.OFPSwitchFeatures(datapath, datapath.id, 256, 254, 0, 0)
+    deliver(app, ofp_event.EventOFPSwitchFeatures(msg))
+
+
+def deliver_replies(app, datapath):
+    # Hand the queued replies (barriers, flow-stats) to the app, as the switch
+    # would, until handling them queues no more
+    while datapath.replies:
+        replies, datapath.replies = datapath.replies, []
+        for reply in replies:
+            deliver(app, ofp_event.ofp_msg_to_ev(reply))
+
+
+def packet_in(datapath, in_port, data, buffer_id=ofproto_v1_3.OFP_NO_BUFFER):
+    msg = ofproto_v1_3_parser.OFPPacketIn(
+        datapath, buffer_id, len(data), ofproto_v1_3.OFPR_NO_MATCH, 0, 0,
+        ofproto_v1_3_parser.OFPMatch(in_port=in_port), data)
+    return ofp_event.EventOFPPacketIn(msg)
+
+
+def read_trace(path):
+    # Trace format: one JSON object per line with dpid, in_port and hex encoded frame
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                yield rec['dpid'], rec['in_port'], bytes.fromhex(rec['data'])
+
+
+def write_trace(path, records):
+    with open(path, 'w') as f:
+        for dpid, in_port, data in records:
+            f.write(json.dumps({'dpid': dpid, 'in_port': in_port, 'data': data.hex()}) + '\n')
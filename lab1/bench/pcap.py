@@ -0,0 +1,54 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Minimal reader/writer for classic libpcap files with ethernet frames, e.g.
+# captured with "tcpdump -i s1-eth1 -w s1.pcap" inside Mininet.
+
+import struct
+
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+LINKTYPE_ETHERNET = 1
+
+
+def read_pcap(path):
+    with open(path, 'rb') as f:
+        header = f.read(24)
+        magic, = struct.unpack('<I', header[:4])
+        if magic in (PCAP_MAGIC, PCAP_MAGIC_NS):
+            endian = '<'
+        elif struct.unpack('>I', header[:4])[0] in (PCAP_MAGIC, PCAP_MAGIC_NS):
+            endian = '>'
+        else:
+            raise ValueError('%s is not a pcap file' % path)
+        linktype, = struct.unpack(endian + 'I', header[20:24])
+        if linktype != LINKTYPE_ETHERNET:
+            raise ValueError('%s does not contain ethernet frames' % path)
+        record = struct.Struct(endian + 'IIII')
+        while True:
+            rec = f.read(record.size)
+            if len(rec) < record.size:
+                return
+            _, _, caplen, _ = record.unpack(rec)
+            yield f.read(caplen)
+
+
+def write_pcap(path, frames):
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', PCAP_MAGIC, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET))
+        for i, frame in enumerate(frames):
+            f.write(struct.pack('<IIII', i // 1000000, i % 1000000, len(frame), len(frame)))
+            f.write(frame)
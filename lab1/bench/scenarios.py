@@ -0,0 +1,112 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Synthetic packet_in streams for the benchmarks. A scenario is a list of
+# (dpid, in_port, frame) records, the format fake_datapath.read_trace() and
+# write_trace() use. Host i (from 1) sits on switch 1 + (i - 1) % switches, port
+# 1 + (i - 1) // switches, with MAC 00:00:0a:00:xx:xx and IP 10.0.x.x.
+
+import random
+import struct
+
+BROADCAST = b'\xff' * 6
+
+
+def host_mac(i):
+    return struct.pack('!HI', 0x0000, 0x0a000000 + i)
+
+
+def host_ip(i):
+    return struct.pack('!BBH', 10, 0, i)
+
+
+def host_location(i, switches):
+    return 1 + (i - 1) % switches, 1 + (i - 1) // switches
+
+
+def ipv4_frame(src, dst, src_ip=None, dst_ip=None, payload_len=64):
+    # Ethernet + minimal IPv4/UDP header, enough for the controllers to classify it
+    eth = dst + src + struct.pack('!H', 0x0800)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 28 + payload_len, 0, 0, 64, 17, 0,
+                     src_ip or b'\x0a\x00\x01' + src[-1:], dst_ip or b'\x0a\x00\x01' + dst[-1:])
+    udp = struct.pack('!HHHH', 5001, 5001, 8 + payload_len, 0)
+    return eth + ip + udp + bytes(payload_len)
+
+
+def arp_frame(opcode, src_mac, src_ip, dst_mac, dst_ip):
+    eth_dst = BROADCAST if opcode == 1 else dst_mac
+    return (eth_dst + src_mac + struct.pack('!HHHBBH', 0x0806, 1, 0x0800, 6, 4, opcode) +
+            src_mac + src_ip + (dst_mac if opcode == 2 else bytes(6)) + dst_ip)
+
+
+def ipv6_frame(src, payload_len=24):
+    # ICMPv6 neighbour solicitation to the all-nodes group, the usual IPv6 noise
+    eth = b'\x33\x33\x00\x00\x00\x01' + src + struct.pack('!H', 0x86dd)
+    ip6 = struct.pack('!IHBB16s16s', 0x60000000, payload_len, 58, 255,
+                      b'\xfe\x80' + bytes(8) + src, b'\xff\x02' + bytes(13) + b'\x01')
+    return eth + ip6 + bytes(payload_len)
+
+
+def unicast(hosts, frames, switches=1, seed=1):
+    # Many-flow unicast: random host pairs, so up to hosts * (hosts - 1) flows
+    rnd = random.Random(seed)
+    records = []
+    for _ in range(frames):
+        src, dst = rnd.sample(range(1, hosts + 1), 2)
+        dpid, port = host_location(src, switches)
+        records.append((dpid, port, ipv4_frame(host_mac(src), host_mac(dst),
+                                               host_ip(src), host_ip(dst))))
+    return records
+
+
+def arp_storm(hosts, frames, switches=1, seed=1):
+    # Every host keeps asking for random other hosts, one in ten answers
+    rnd = random.Random(seed)
+    records = []
+    for _ in range(frames):
+        src, dst = rnd.sample(range(1, hosts + 1), 2)
+        if rnd.random() < 0.1:
+            src, dst = dst, src
+            dpid, port = host_location(src, switches)
+            records.append((dpid, port, arp_frame(2, host_mac(src), host_ip(src),
+                                                  host_mac(dst), host_ip(dst))))
+        else:
+            dpid, port = host_location(src, switches)
+            records.append((dpid, port, arp_frame(1, host_mac(src), host_ip(src),
+                                                  bytes(6), host_ip(dst))))
+    return records
+
+
+def ipv6_noise(hosts, frames, switches=1, seed=1, ratio=0.8):
+    # Mostly IPv6 neighbour discovery, the rest unicast IPv4
+    rnd = random.Random(seed)
+    records = []
+    for _ in range(frames):
+        src, dst = rnd.sample(range(1, hosts + 1), 2)
+        dpid, port = host_location(src, switches)
+        if rnd.random() < ratio:
+            records.append((dpid, port, ipv6_frame(host_mac(src))))
+        else:
+            records.append((dpid, port, ipv4_frame(host_mac(src), host_mac(dst),
+                                                   host_ip(src), host_ip(dst))))
+    return records
+
+
+SCENARIOS = {
+    'arp_storm': arp_storm,
+    'unicast': unicast,
+    'ipv6_noise': ipv6_noise,
+}
@@ -0,0 +1,136 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Lightweight packet_in classification. Reads the EtherType and the few
+# header fields the controllers need straight from msg.data through a
+# memoryview, instead of decoding every layer with ryu's packet.Packet.
+# The attribute names match ryu's protocol classes (arp.arp, ipv4.ipv4), so
+# handlers work with either. frame.packet() falls back to full parsing.
+
+import socket
+import struct
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_8021Q = 0x8100
+ETH_TYPE_IPV6 = 0x86dd
+ETH_TYPE_LLDP = 0x88cc
+
+ETH_HEADER_LEN = 14
+
+_eth = struct.Struct('!6s6sH')
+_vlan = struct.Struct('!HH')
+_arp = struct.Struct('!HHBBH6s4s6s4s')
+_ipv4 = struct.Struct('!BBHHHBBH4s4s')
+
+
+def mac_to_str(raw):
+    return raw.hex(':')
+
+
+class ArpHeader(object):
+    __slots__ = ('opcode', 'src_mac', 'src_ip', 'dst_mac', 'dst_ip')
+
+    def __init__(self, opcode, src_mac, src_ip, dst_mac, dst_ip):
+        self.opcode = opcode
+        self.src_mac = src_mac
+        self.src_ip = src_ip
+        self.dst_mac = dst_mac
+        self.dst_ip = dst_ip
+
+    def __repr__(self):
+        return 'arp(opcode=%d, src=%s/%s, dst=%s/%s)' % (
+            self.opcode, self.src_mac, self.src_ip, self.dst_mac, self.dst_ip)
+
+
+class IPv4Header(object):
+    __slots__ = ('src', 'dst', 'proto', 'ttl', 'header_length')
+
+    def __init__(self, src, dst, proto, ttl, header_length):
+        self.src = src
+        self.dst = dst
+        self.proto = proto
+        self.ttl = ttl
+        self.header_length = header_length
+
+    def __repr__(self):
+        return 'ipv4(src=%s, dst=%s, proto=%d, ttl=%d)' % (self.src, self.dst, self.proto, self.ttl)
+
+
+class Frame(object):
+    __slots__ = ('data', 'view', 'dst_raw', 'src_raw', 'ethertype', 'offset', 'vlan')
+
+    def __init__(self, data):
+        self.data = data
+        self.view = memoryview(data)
+        self.dst_raw, self.src_raw, ethertype = _eth.unpack_from(self.view, 0)
+        offset = ETH_HEADER_LEN
+        self.vlan = None
+        if ethertype == ETH_TYPE_8021Q and len(self.view) >= offset + 4:
+            tci, ethertype = _vlan.unpack_from(self.view, offset)
+            self.vlan = tci & 0x0fff
+            offset += 4
+        self.ethertype = ethertype
+        self.offset = offset  # start of the L3 header
+
+    @property
+    def dst(self):
+        return self.dst_raw.hex(':')
+
+    @property
+    def src(self):
+        return self.src_raw.hex(':')
+
+    def is_broadcast(self):
+        return self.dst_raw == b'\xff\xff\xff\xff\xff\xff'
+
+    def is_multicast(self):
+        return self.dst_raw[0] & 1 == 1
+
+    def arp(self):
+        # IPv4 over ethernet ARP only, None for anything else
+        if self.ethertype != ETH_TYPE_ARP or len(self.view) < self.offset + _arp.size:
+            return None
+        hwtype, proto, hlen, plen, opcode, sha, spa, tha, tpa = _arp.unpack_from(self.view, self.offset)
+        if hwtype != 1 or proto != ETH_TYPE_IP or hlen != 6 or plen != 4:
+            return None
+        return ArpHeader(opcode, sha.hex(':'), socket.inet_ntoa(spa),
+                         tha.hex(':'), socket.inet_ntoa(tpa))
+
+    def ipv4(self):
+        if self.ethertype != ETH_TYPE_IP or len(self.view) < self.offset + _ipv4.size:
+            return None
+        ver_ihl, _, _, _, _, ttl, proto, _, src, dst = _ipv4.unpack_from(self.view, self.offset)
+        if ver_ihl >> 4 != 4:
+            return None
+        return IPv4Header(socket.inet_ntoa(src), socket.inet_ntoa(dst), proto, ttl,
+                          (ver_ihl & 0xf) * 4)
+
+    def packet(self):
+        # Full ryu decoding for the rare cases that need more than the fields above
+        from ryu.lib.packet import packet
+        return packet.Packet(bytes(self.view))
+
+    def __repr__(self):
+        return 'Frame(%s -> %s, type=0x%04x%s)' % (
+            self.src, self.dst, self.ethertype, '' if self.vlan is None else ', vlan=%d' % self.vlan)
+
+
+def classify(data):
+    # Frame view of a raw ethernet frame, None if it is too short to be one
+    if len(data) < ETH_HEADER_LEN:
+        return None
+    return Frame(data)
@@ -0,0 +1,430 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+#!/bin/env python3
+
+# Cluster mode: several controller processes share the switches.
+#
+# Every switch connects to every controller (run_network.py --controllers N)
+# and every controller process is a node of the cluster. The nodes coordinate
+# through a store: an ordered stream of (namespace, key, value) updates that
+# every node sees in the same order, each with a sequence number. KVServer is
+# a local stand-in for a real key-value service (TCP, one JSON list per
+# line), MemoryStore does the same inside one process. Both hand out clients
+# with put(), subscribe() and close().
+#
+# Mastership: a node announces itself ('node') and every switch it is
+# connected to ('conn') with ephemeral keys, which the store deletes when the
+# node's connection goes away. The owner of a switch is the connected node
+# with the highest rendezvous hash of (dpid, node): all nodes agree without
+# talking, and a node that leaves only moves its own switches. The winner
+# writes ('owner', dpid); the sequence number of that update is the
+# generation_id of its MASTER role request, so a switch refuses a master that
+# lost the race. All other nodes are SLAVE and program nothing. They send their
+# SLAVE request only once they have seen an owner update for the switch, with
+# its generation_id: a node that just connected has no current generation to
+# send, and the switch stays EQUAL towards it until then.
+#
+# Replication: the app hands the state it logs (snapshot(), see state_log.py)
+# to publish() every few seconds and only the changes go out. Updates from
+# other nodes go to the app's restore callback. Deletes are not replicated,
+# stations and ARP entries age out on every node from the replicated times.
+#
+# Messages: send() hands a value to the on_message callback of every other
+# node, for work that has to happen on switches this node does not own (an
+# ARP request flooded on every switch of the fabric). A message is put and
+# deleted at once, so the store does not keep or replay it.
+#
+# Running three nodes of an app and a network attached to all of them:
+#
+#   python3 cluster.py launch --nodes 3 new_approach/ans_controller.py
+#   sudo python3 run_network.py --controllers 3
+
+import argparse
+import collections
+import hashlib
+import json
+import os
+import signal
+import socket
+import socketserver
+import subprocess
+import threading
+import time
+
+from ryu.lib import hub
+
+from state_log import from_json
+
+DEFAULT_PORT = 6700
+
+
+def _line(message):
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode()
+
+
+def rank(dpid, node):
+    # Rendezvous hash, the same in every process (hash() of a str is not). CRC32
+    # would rank the nodes alike for every dpid, it is linear in its input.
+    return hashlib.blake2b(('%s/%s' % (dpid, node)).encode(), digest_size=8).digest()
+
+
+class Bus(object):
+    # The ordered update stream both stores are built on. Subscribers get
+    # deliver((seq, namespace, key, value, origin)) for every update.
+
+    def __init__(self, first_seq=None):
+        # Sequence numbers are role generation ids, they must keep growing
+        # across restarts of the store
+        self.seq = first_seq if first_seq is not None else time.time_ns() // 1000
+        self.entries = {}      # (namespace, key) -> latest update
+        self.subscribers = []
+        self.ephemeral = {}    # subscriber -> set of its (namespace, key) that die with it
+
+    def put(self, client, namespace, key, value, origin=None, ephemeral=False):
+        key = from_json(key)
+        self.seq += 1
+        update = (self.seq, namespace, key, value, origin)
+        entry = (namespace, key)
+        if value is None:
+            self.entries.pop(entry, None)
+        else:
+            self.entries[entry] = update
+        if ephemeral and value is not None:
+            self.ephemeral.setdefault(client, set()).add(entry)
+        for subscriber in list(self.subscribers):
+            subscriber.deliver(update)
+
+    def subscribe(self, client):
+        # Replay what the store holds, then follow
+        for update in sorted(self.entries.values(), key=lambda u: u[0]):
+            client.deliver(update)
+        self.subscribers.append(client)
+
+    def drop(self, client):
+        if client in self.subscribers:
+            self.subscribers.remove(client)
+        for namespace, key in self.ephemeral.pop(client, ()):
+            if (namespace, key) in self.entries:
+                self.put(None, namespace, key, None)
+
+
+class MemoryStore(Bus):
+    # Bus inside one process: several apps in one ryu-manager, benches.
+    # Updates are delivered after the put that caused them returns, in order.
+
+    def __init__(self, first_seq=None):
+        super(MemoryStore, self).__init__(first_seq)
+        self.pending = collections.deque()
+        self.draining = False
+
+    def client(self):
+        return MemoryClient(self)
+
+    def drain(self):
+        if self.draining:
+            return
+        self.draining = True
+        try:
+            while self.pending:
+                client, update = self.pending.popleft()
+                if client.callback is not None:
+                    client.callback(*update)
+        finally:
+            self.draining = False
+
+
+class MemoryClient(object):
+
+    def __init__(self, store):
+        self.store = store
+        self.callback = None
+
+    def put(self, namespace, key, value, origin=None, ephemeral=False):
+        self.store.put(self, namespace, key, value, origin, ephemeral)
+        self.store.drain()
+
+    def subscribe(self, callback):
+        # callback(seq, namespace, key, value, origin) for every update
+        self.callback = callback
+        self.store.subscribe(self)
+        self.store.drain()
+
+    def deliver(self, update):
+        self.store.pending.append((self, update))
+
+    def close(self):
+        self.store.drop(self)
+        self.callback = None
+        self.store.drain()
+
+
+class _Connection(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server
+        try:
+            for line in self.rfile:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                with server.lock:
+                    if message[0] == 'put':
+                        server.bus.put(self, *message[1:])
+                    elif message[0] == 'sub':
+                        server.bus.subscribe(self)
+        finally:
+            with server.lock:
+                server.bus.drop(self)
+
+    def deliver(self, update):
+        # Runs under the server lock, so every connection sees the same order
+        try:
+            self.wfile.write(_line(update))
+        except OSError:
+            pass
+
+
+class KVServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', DEFAULT_PORT)):
+        socketserver.ThreadingTCPServer.__init__(self, address, _Connection)
+        self.lock = threading.Lock()
+        self.bus = Bus()
+
+
+class KVClient(object):
+    # Client of a KVServer, for apps running on ryu's hub
+
+    def __init__(self, address):
+        self.sock = socket.create_connection(address)
+        self.lock = hub.BoundedSemaphore(1)
+        self.callback = None
+        self.thread = None
+
+    def put(self, namespace, key, value, origin=None, ephemeral=False):
+        self._send(['put', namespace, key, value, origin, ephemeral])
+
+    def subscribe(self, callback):
+        # callback(seq, namespace, key, value, origin) for every update
+        self.callback = callback
+        self.thread = hub.spawn(self._read)
+        self._send(['sub'])
+
+    def close(self):
+        if self.thread is not None:
+            hub.kill(self.thread)
+            self.thread = None
+        # The reader's file keeps the socket open, the store has to see it go
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _send(self, message):
+        with self.lock:
+            self.sock.sendall(_line(message))
+
+    def _read(self):
+        for line in self.sock.makefile('rb'):
+            seq, namespace, key, value, origin = json.loads(line)
+            self.callback(seq, namespace, from_json(key), from_json(value), origin)
+
+
+_memory = None
+
+
+def connect(address):
+    # 'memory' for a store shared inside this process, else host:port of a KVServer
+    global _memory
+    if address == 'memory':
+        if _memory is None:
+            _memory = MemoryStore()
+        return _memory.client()
+    host, _, port = address.rpartition(':')
+    return KVClient((host or '127.0.0.1', int(port)))
+
+
+class Cluster(object):
+
+    def __init__(self, store, node, on_role, on_restore, namespaces=(), on_message=None):
+        self.store = store            # client of a store
+        self.node = str(node)
+        self.on_role = on_role        # on_role(dpid, master, generation_id)
+        self.on_restore = on_restore  # on_restore(namespace, key, value) of other nodes' state
+        self.on_message = on_message  # on_message(value) of other nodes' send()
+        self.namespaces = set(namespaces)  # replicated namespaces of the app state
+        self.nodes = set()      # live nodes
+        self.members = {}       # dpid -> nodes connected to it
+        self.owners = {}        # dpid -> node that last claimed it
+        self.generations = {}   # dpid -> seq of its last owner update, the current generation_id
+        self.connected = set()  # switches connected to this node
+        self.masters = set()    # switches this node is master of
+        self.claims = set()     # switches claimed, update not back yet
+        self.state = {}         # namespace -> {key: value} as the store has it
+        self.seq = 0            # last update seen
+        self.sent = 0           # messages sent
+
+    def join(self):
+        self.store.subscribe(self._update)
+        self.store.put('node', self.node, True, self.node, ephemeral=True)
+
+    def close(self):
+        self.store.close()
+
+    def connect(self, dpid):
+        self.connected.add(dpid)
+        owner = self.owners.get(dpid)
+        if owner is not None and owner != self.node:
+            # Owned by another node already, this one is SLAVE of the same generation
+            self.on_role(dpid, False, self.generations[dpid])
+        self.store.put('conn', (dpid, self.node), True, self.node, ephemeral=True)
+
+    def disconnect(self, dpid):
+        self.connected.discard(dpid)
+        self.masters.discard(dpid)
+        self.claims.discard(dpid)
+        self.store.put('conn', (dpid, self.node), None, self.node)
+
+    def is_master(self, dpid):
+        return dpid in self.masters
+
+    def owner(self, dpid):
+        return self.owners.get(dpid)
+
+    def publish(self, state):
+        # Send what changed in {namespace: {key: value}}, returns the number of updates
+        sent = 0
+        for namespace in self.namespaces:
+            new = state.get(namespace, {})
+            old = self.state.setdefault(namespace, {})
+            for key, value in new.items():
+                if old.get(key) != value:
+                    old[key] = value
+                    self.store.put(namespace, key, value, self.node)
+                    sent += 1
+            # Gone here, it ages out on the other nodes as well
+            for key in [k for k in old if k not in new]:
+                del old[key]
+        return sent
+
+    def send(self, value):
+        # A message to the other nodes, value has to survive JSON (tuples come back as lists)
+        self.sent += 1
+        key = (self.node, self.sent)
+        self.store.put('msg', key, value, self.node)
+        self.store.put('msg', key, None, self.node)
+
+    def _update(self, seq, namespace, key, value, origin):
+        self.seq = max(self.seq, seq)
+        if namespace == 'node':
+            if value:
+                self.nodes.add(key)
+            else:
+                self.nodes.discard(key)
+            self._elect(self.connected)
+        elif namespace == 'conn':
+            dpid, node = key
+            members = self.members.setdefault(dpid, set())
+            if value:
+                members.add(node)
+            else:
+                members.discard(node)
+            self._elect((dpid,))
+        elif namespace == 'owner':
+            self.owners[key] = value
+            self.generations[key] = seq
+            self.claims.discard(key)
+            if value == self.node and key in self.connected:
+                self.masters.add(key)
+                self.on_role(key, True, seq)
+            elif key in self.connected:
+                self.masters.discard(key)
+                self.on_role(key, False, seq)
+        elif namespace == 'msg':
+            if value is not None and origin != self.node and self.on_message is not None:
+                self.on_message(value)
+        elif namespace in self.namespaces:
+            entries = self.state.setdefault(namespace, {})
+            if value is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = value
+                if origin != self.node:
+                    self.on_restore(namespace, key, value)
+
+    def _elect(self, dpids):
+        for dpid in list(dpids):
+            candidates = self.members.get(dpid, set()) & self.nodes
+            if self.node not in candidates or dpid in self.masters or dpid in self.claims:
+                continue
+            if max(candidates, key=lambda node: rank(dpid, node)) == self.node:
+                self.claims.add(dpid)
+                self.store.put('owner', dpid, self.node, self.node)
+
+
+def serve(args):
+    host, _, port = args.listen.rpartition(':')
+    server = KVServer((host or '127.0.0.1', int(port)))
+    print('cluster store on %s:%d' % server.server_address)
+    server.serve_forever()
+
+
+def launch(args):
+    # A store and args.nodes ryu-managers with their own OpenFlow and REST ports
+    server = KVServer(('127.0.0.1', args.store_port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    nodes = []
+    for i in range(args.nodes):
+        env = dict(os.environ, ANS_CLUSTER='127.0.0.1:%d' % args.store_port, ANS_NODE='c%d' % (i + 1))
+        if 'ANS_STATE' not in os.environ:
+            env['ANS_STATE'] = '/tmp/ans_c%d.state' % (i + 1)
+        nodes.append(subprocess.Popen(
+            ['ryu-manager', '--ofp-tcp-listen-port', str(args.port + i),
+             '--wsapi-port', str(args.wsapi_port + i)] + args.app, env=env))
+    try:
+        signal.pause()
+    except KeyboardInterrupt:
+        pass
+    for node in nodes:
+        node.terminate()
+    for node in nodes:
+        node.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cluster store and launcher for the controller apps')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('serve', help='run the key-value store')
+    p.add_argument('--listen', default='127.0.0.1:%d' % DEFAULT_PORT)
+    p.set_defaults(func=serve)
+    p = commands.add_parser('launch', help='run a store and several nodes of an app')
+    p.add_argument('--nodes', type=int, default=3)
+    p.add_argument('--port', type=int, default=6653, help='OpenFlow port of the first node')
+    p.add_argument('--wsapi-port', type=int, default=8080, help='REST port of the first node')
+    p.add_argument('--store-port', type=int, default=DEFAULT_PORT)
+    p.add_argument('app', nargs='+', help='ryu-manager arguments, the app first')
+    p.set_defaults(func=launch)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# LLDP link discovery.
+#
+# Every switch port gets an LLDP probe every `interval` seconds, sent as a
+# packet_out. A probe that comes back as a packet_in on another switch is a
+# link from the probed port to the port it arrived on. Links are directed,
+# each direction is confirmed by its own probes.
+#
+# Probing is staggered: the ports sit in one round-robin queue and every
+# tick sends the share of a round that is due, never more than `rate` probes
+# per second in total. With more ports than rate * interval a round just
+# takes longer, period() says how long. A link whose probes stopped arriving
+# for `misses` periods is gone; one whose port went down or whose switch
+# disconnected goes at once. Links are kept ordered by when they were last
+# confirmed, so expiry only looks at the ones that are due.
+#
+# The graph is adjacency[dpid][port] = (peer dpid, peer port). Every change
+# is a LinkEvent ('add' or 'remove') handed to the subscribers, in order. A
+# removal says why: 'timeout', 'port' (port down or rewired) or 'switch' (the
+# switch left the controller, which says nothing about the link itself).
+#
+# A port whose first probe went out `settle` seconds ago is settled, and a
+# 'settled' event (no dst) says so. Settled ports that never had a link since
+# they came up are edge ports, with hosts or nothing behind them. A port
+# whose link timed out stays a switch port until it goes down: lost probes
+# say little about what is plugged in, and flooding into a live switch link
+# would loop.
+#
+# Probe frames are built once per port and reused. They carry the dpid in
+# the chassis id and the port number in the port id TLV, as ryu's own
+# switches app does, and are parsed back without ryu's packet library.
+
+import struct
+import time
+from collections import OrderedDict, deque, namedtuple
+
+from classifier import ETH_TYPE_LLDP
+
+LLDP_MAC = b'\x01\x80\xc2\x00\x00\x0e'  # nearest bridge, not forwarded by 802.1D bridges
+LLDP_TTL = 120
+_CHASSIS_PREFIX = b'dpid:'
+_tlv = struct.Struct('!H')
+
+LinkEvent = namedtuple('LinkEvent', 'kind src src_port dst dst_port reason')
+
+
+def _tlv_header(tlv_type, length):
+    return _tlv.pack(tlv_type << 9 | length)
+
+
+def probe_frame(dpid, port, src_mac):
+    # LLDP frame for a switch port, src_mac as 6 bytes
+    chassis = _CHASSIS_PREFIX + b'%016x' % dpid
+    port_id = struct.pack('!I', port)
+    return b''.join((
+        LLDP_MAC, src_mac, _tlv.pack(ETH_TYPE_LLDP),
+        _tlv_header(1, len(chassis) + 1), b'\x07', chassis,   # chassis id, locally assigned
+        _tlv_header(2, len(port_id) + 1), b'\x02', port_id,   # port id, port component
+        _tlv_header(3, 2), _tlv.pack(LLDP_TTL),
+        _tlv_header(0, 0)))
+
+
+def parse_probe(data):
+    # (dpid, port) of a probe frame, None for anything else
+    if len(data) < 14 or bytes(data[12:14]) != b'\x88\xcc':
+        return None
+    dpid = port = None
+    offset = 14
+    while offset + 2 <= len(data):
+        header = _tlv.unpack_from(data, offset)[0]
+        tlv_type, length = header >> 9, header & 0x1ff
+        value = bytes(data[offset + 2:offset + 2 + length])
+        offset += 2 + length
+        if tlv_type == 0:
+            break
+        if tlv_type == 1 and value[1:6] == _CHASSIS_PREFIX:
+            try:
+                dpid = int(value[6:], 16)
+            except ValueError:
+                return None
+        elif tlv_type == 2 and value[:1] == b'\x02' and length == 5:
+            port = struct.unpack('!I', value[1:])[0]
+    if dpid is None or port is None:
+        return None
+    return dpid, port
+
+
+class Discovery(object):
+
+    def __init__(self, interval=5.0, rate=500, misses=3, settle=1.0, clock=time.monotonic):
+        self.interval = interval  # seconds between probes of one port
+        self.rate = rate          # probes per second, over all switches
+        self.misses = misses      # periods without a probe until a link is gone
+        self.settle = settle      # seconds from the first probe of a port until it is settled
+        self.clock = clock
+        self.frames = {}          # (dpid, port) -> probe frame
+        self.ports = {}           # dpid -> ports being probed
+        self.queue = deque()      # (dpid, port) in probing order, removed ports are skipped
+        self.queued = set()
+        self.links = OrderedDict()  # (dpid, port) -> (peer dpid, peer port), least recently confirmed first
+        self.reverse = {}         # (peer dpid, peer port) -> (dpid, port)
+        self.seen = {}            # (dpid, port) -> when its link was last confirmed
+        self.adjacency = {}       # dpid -> {port: (peer dpid, peer port)}
+        self.probed = deque()     # (first probe, (dpid, port)) of the ports settling
+        self.settling = set()
+        self.settled = {}         # dpid -> settled ports
+        self.trunks = {}          # dpid -> ports that had a link since they came up
+        self.listeners = []
+        self.budget = 0.0
+        self.last_tick = None
+        self.sent = 0
+
+    def subscribe(self, callback):
+        # callback(LinkEvent) for every change of the graph
+        self.listeners.append(callback)
+
+    def _emit(self, kind, src, dst=None, reason=None):
+        dst = dst or (None, None)
+        event = LinkEvent(kind, src[0], src[1], dst[0], dst[1], reason)
+        for callback in self.listeners:
+            callback(event)
+
+    def period(self):
+        # Seconds until every port has been probed once
+        return max(self.interval, len(self.frames) / float(self.rate))
+
+    # Switches and ports
+
+    def add_switch(self, dpid, ports):
+        # ports: {port number: hardware address as bytes}, the switch's physical ports
+        for port, hw_addr in ports.items():
+            self.add_port(dpid, port, hw_addr)
+
+    def add_port(self, dpid, port, hw_addr):
+        key = (dpid, port)
+        if key not in self.queued:
+            self.queue.appendleft(key)  # probed next
+            self.queued.add(key)
+        self.frames[key] = probe_frame(dpid, port, hw_addr)
+        self.ports.setdefault(dpid, set()).add(port)
+
+    def remove_port(self, dpid, port, reason='port'):
+        key = (dpid, port)
+        self.frames.pop(key, None)
+        self.ports.get(dpid, set()).discard(port)
+        self.settling.discard(key)
+        self.settled.get(dpid, set()).discard(port)
+        self.trunks.get(dpid, set()).discard(port)
+        self._remove_link(key, reason)
+        if key in self.reverse:
+            self._remove_link(self.reverse[key], reason)
+
+    def remove_switch(self, dpid):
+        ports = set(port for d, port in self.frames if d == dpid)
+        ports.update(self.adjacency.get(dpid, ()))
+        ports.update(port for d, port in self.reverse if d == dpid)
+        for port in ports:
+            self.remove_port(dpid, port, 'switch')
+        self.adjacency.pop(dpid, None)
+        self.ports.pop(dpid, None)
+        self.settled.pop(dpid, None)
+        self.trunks.pop(dpid, None)
+
+    def port_changed(self, dpid, port, up, hw_addr=None):
+        # A port-status event. Down takes the links on the port away at once.
+        if up and hw_addr is not None:
+            self.add_port(dpid, port, hw_addr)
+        elif not up:
+            self.remove_port(dpid, port)
+
+    # Probing
+
+    def due(self, now=None):
+        # [(dpid, port, frame)] to send now, the share of the round since the last call
+        now = self.clock() if now is None else now
+        if self.last_tick is None:
+            self.last_tick = now
+        elapsed, self.last_tick = now - self.last_tick, now
+        ports = len(self.frames)
+        if not ports:
+            self.budget = 0.0
+            return []
+        self.budget = min(self.budget + elapsed * ports / self.period(), ports)
+        probes = []
+        while len(probes) < int(self.budget) and self.queue:
+            key = self.queue.popleft()
+            frame = self.frames.get(key)
+            if frame is None:
+                self.queued.discard(key)
+                continue
+            self.queue.append(key)
+            if key not in self.settling and key[1] not in self.settled.get(key[0], ()):
+                self.settling.add(key)
+                self.probed.append((now, key))
+            probes.append(key + (frame,))
+        self.budget -= len(probes)
+        self.sent += len(probes)
+        return probes
+
+    def received(self, dpid, port, data, now=None):
+        # A packet_in. Returns False if it was not a probe.
+        src = parse_probe(data)
+        if src is None:
+            return False
+        dst = (dpid, port)
+        if src == dst:
+            return True
+        now = self.clock() if now is None else now
+        old = self.links.get(src)
+        if old != dst:
+            if old is not None:
+                self._remove_link(src, 'port')
+            if dst in self.reverse:
+                # A port has one peer, the other end was rewired
+                self._remove_link(self.reverse[dst], 'port')
+            self.links[src] = dst
+            self.reverse[dst] = src
+            self.adjacency.setdefault(src[0], {})[src[1]] = dst
+            self.trunks.setdefault(src[0], set()).add(src[1])
+            self.trunks.setdefault(dst[0], set()).add(dst[1])
+            self._emit('add', src, dst)
+        else:
+            self.links.move_to_end(src)
+        self.seen[src] = now
+        return True
+
+    def expire(self, now=None):
+        # Drop links not confirmed for `misses` periods and settle ports, returns
+        # how many links went
+        now = self.clock() if now is None else now
+        while self.probed and self.probed[0][0] <= now - self.settle:
+            key = self.probed.popleft()[1]
+            if key in self.settling:
+                self.settling.discard(key)
+                self.settled.setdefault(key[0], set()).add(key[1])
+                self._emit('settled', key)
+        deadline = now - self.misses * self.period()
+        expired = 0
+        while self.links:
+            src = next(iter(self.links))
+            if self.seen[src] >= deadline:
+                break
+            self._remove_link(src, 'timeout')
+            expired += 1
+        return expired
+
+    def _remove_link(self, src, reason):
+        dst = self.links.pop(src, None)
+        if dst is None:
+            return
+        del self.seen[src]
+        del self.reverse[dst]
+        ports = self.adjacency.get(src[0])
+        if ports is not None:
+            ports.pop(src[1], None)
+        self._emit('remove', src, dst, reason)
+
+    # Queries
+
+    def link(self, dpid, port):
+        # (peer dpid, peer port) at the other end of a port, None if no switch is there
+        return self.links.get((dpid, port))
+
+    def neighbors(self, dpid):
+        # {port: (peer dpid, peer port)} of a switch
+        return self.adjacency.get(dpid, {})
+
+    def switch_ports(self, dpid):
+        # Ports of a switch that lead to another switch
+        return set(self.adjacency.get(dpid, ()))
+
+    def edge_ports(self, dpid):
+        # Settled ports of a switch without a switch behind them
+        return self.settled.get(dpid, set()) - self.trunks.get(dpid, set())
+
+    def all_settled(self, dpid):
+        # Whether every port of a switch is settled, i.e. its edge ports are all known
+        ports = self.ports.get(dpid)
+        return bool(ports) and ports <= self.settled.get(dpid, set())
+
+    def __len__(self):
+        return len(self.links)
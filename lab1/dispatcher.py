@@ -0,0 +1,71 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Packet_in dispatch sharded by datapath. Events are queued to one of a fixed
+# set of hub workers by dpid, so every switch is always served by the same
+# worker and its packet_ins are handled in arrival order, while a burst on one
+# switch no longer holds up the others: workers take turns after every event.
+#
+# Workers are green threads on ryu's hub, so they share one core. Handler state
+# needs no locks as long as handlers do not block halfway through an update,
+# and anything sent goes through the datapath's own send queue as before.
+# Spreading switches over cores takes several controller processes.
+
+import logging
+
+from ryu.lib import hub
+
+LOG = logging.getLogger(__name__)
+
+
+class ShardedDispatcher(object):
+
+    def __init__(self, handler, workers=4, queue_size=1024, on_drop=None):
+        self.handler = handler
+        self.on_drop = on_drop
+        self.queues = [hub.Queue(queue_size) for _ in range(workers)]
+        self.dropped = 0
+        self.threads = [hub.spawn(self._worker, q) for q in self.queues]
+
+    def shard(self, dpid):
+        return dpid % len(self.queues)
+
+    def dispatch(self, ev):
+        # Never blocks ryu's event loop: a full shard drops the packet_in, the
+        # switch sends the next packet of that flow again
+        dpid = ev.msg.datapath.id
+        queue = self.queues[self.shard(dpid)]
+        if queue.full():
+            self.dropped += 1
+            if self.on_drop is not None:
+                self.on_drop(dpid)
+            return
+        queue.put(ev)
+
+    def depths(self):
+        return [q.qsize() for q in self.queues]
+
+    def _worker(self, queue):
+        while True:
+            ev = queue.get()
+            # Events queued before the switch went away are of no use anymore
+            if getattr(ev.msg.datapath, 'is_active', True):
+                try:
+                    self.handler(ev)
+                except Exception:
+                    LOG.exception('packet_in handler failed for dpid %s', ev.msg.datapath.id)
+            hub.sleep(0)
+
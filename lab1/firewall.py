@@ -0,0 +1,336 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Stateless IPv4 firewall of the router.
+#
+# A rule list is read top down and the first rule a packet matches decides,
+# packets no rule matches get the default:
+#
+#   default allow
+#   allow tcp from ext to ser port 80
+#   deny ip from ext to ser
+#   deny icmp from ext to any
+#
+# <allow|deny> <proto> from <addr> [port P[-Q]] to <addr> [port P[-Q]], where
+# proto is ip, icmp, tcp, udp or a number and addr a host name, a.b.c.d[/len]
+# or any. Ports need tcp or udp.
+#
+# compile() turns the list into prioritized OpenFlow matches for the switch.
+# Every rule is a box of intervals over (ipv4_src, ipv4_dst, ip_proto, source
+# port, destination port), and the boxes are compared:
+#
+#   shadowed    covered by an earlier rule with the other action, never matches
+#   redundant   covered by an earlier rule with the same action, or by a later
+#               one (the default counts as a last rule covering everything)
+#               with no overlapping rule of the other action in between
+#   correlated  overlaps a rule with the other action, neither covers the other
+#
+# Shadowed and redundant rules are dropped. The rest need priorities, but a
+# rule only has to beat the later rules of the other action it overlaps: it
+# gets one level above the highest of them, and rules that do not conflict
+# share levels. Allow rules that are left over with default allow are the
+# exceptions of deny rules, a default allow itself needs no flow. Port ranges
+# become masked matches, one per aligned block.
+#
+# The box tests run per rule with NumPy over the other rules, narrowing the
+# candidates down one dimension at a time.
+
+import argparse
+import json
+import sys
+from collections import namedtuple
+from ipaddress import IPv4Network
+
+import numpy as np
+
+ALLOW = 'allow'
+DENY = 'deny'
+ETH_TYPE_IP = 0x0800
+PROTOCOLS = {'ip': None, 'icmp': 1, 'tcp': 6, 'udp': 17}
+ANY_PORT = (0, 0xffff)
+
+Rule = namedtuple('Rule', 'action proto src dst sport dport line')
+
+
+def _port_range(text, line):
+    lo, _, hi = text.partition('-')
+    try:
+        lo, hi = int(lo), int(hi or lo)
+    except ValueError:
+        raise ValueError('line %d: bad port %s' % (line, text))
+    if not 0 <= lo <= hi <= 0xffff:
+        raise ValueError('line %d: bad port range %s' % (line, text))
+    return lo, hi
+
+
+def _address(text, hosts, line):
+    if text == 'any':
+        return IPv4Network('0.0.0.0/0')
+    if text in hosts:
+        return IPv4Network(hosts[text])
+    try:
+        return IPv4Network(text, strict=False)
+    except ValueError:
+        raise ValueError('line %d: unknown host or address %s' % (line, text))
+
+
+def parse_rule(text, hosts=None, line=0):
+    # One rule line -> Rule, hosts maps names to addresses
+    hosts = hosts or {}
+    words = text.split()
+    if len(words) < 6 or words[0] not in (ALLOW, DENY) or words[2] != 'from':
+        raise ValueError('line %d: expected <allow|deny> <proto> from <addr> [port P] to <addr> [port P]'
+                         % line)
+    action, proto = words[0], words[1]
+    if proto in PROTOCOLS:
+        proto = PROTOCOLS[proto]
+    else:
+        try:
+            proto = int(proto)
+        except ValueError:
+            raise ValueError('line %d: unknown protocol %s' % (line, proto))
+    src = _address(words[3], hosts, line)
+    rest = words[4:]
+    sport = dport = ANY_PORT
+    if rest[:1] == ['port']:
+        if len(rest) < 2:
+            raise ValueError('line %d: port without a number' % line)
+        sport, rest = _port_range(rest[1], line), rest[2:]
+    if rest[:1] != ['to'] or len(rest) < 2:
+        raise ValueError('line %d: expected to <addr>' % line)
+    dst, rest = _address(rest[1], hosts, line), rest[2:]
+    if rest[:1] == ['port'] and len(rest) == 2:
+        dport, rest = _port_range(rest[1], line), []
+    if rest:
+        raise ValueError('line %d: unexpected %s' % (line, ' '.join(rest)))
+    if (sport, dport) != (ANY_PORT, ANY_PORT) and proto not in (6, 17):
+        raise ValueError('line %d: ports need tcp or udp' % line)
+    return Rule(action, proto, src, dst, sport, dport, line)
+
+
+def parse(lines, hosts=None):
+    # A rule list -> (rules, default action). Blank lines and # comments are skipped.
+    rules = []
+    default = ALLOW
+    for number, text in enumerate(lines, 1):
+        text = text.split('#', 1)[0].strip()
+        if not text:
+            continue
+        words = text.split()
+        if words[0] == 'default':
+            if len(words) != 2 or words[1] not in (ALLOW, DENY):
+                raise ValueError('line %d: expected default allow or default deny' % number)
+            default = words[1]
+        else:
+            rules.append(parse_rule(text, hosts, number))
+    return rules, default
+
+
+def load(path, hosts=None):
+    with open(path) as f:
+        return parse(f, hosts)
+
+
+def topology_hosts(path):
+    # Host name -> address of a topology description (topology.json)
+    with open(path) as f:
+        return dict((host['name'], host['ip'].split('/')[0]) for host in json.load(f).get('hosts', []))
+
+
+def _box(rule):
+    # ((lo, hi) per dimension) of a rule
+    proto = (0, 0xff) if rule.proto is None else (rule.proto, rule.proto)
+    return tuple((int(lo), int(hi)) for lo, hi in (
+        (rule.src.network_address, rule.src.broadcast_address),
+        (rule.dst.network_address, rule.dst.broadcast_address),
+        proto, rule.sport, rule.dport))
+
+
+def port_blocks(lo, hi):
+    # [lo, hi] as aligned (value, mask) blocks
+    blocks = []
+    while lo <= hi:
+        size = lo & -lo if lo else 0x10000
+        while size > hi - lo + 1:
+            size >>= 1
+        blocks.append((lo, 0xffff & ~(size - 1)))
+        lo += size
+    return blocks
+
+
+def rule_matches(rule):
+    # OpenFlow matches of a rule as ((field, value), ...) tuples, masked values as (value, mask)
+    base = [('eth_type', ETH_TYPE_IP)]
+    for field, net in (('ipv4_src', rule.src), ('ipv4_dst', rule.dst)):
+        if net.prefixlen == 32:
+            base.append((field, str(net.network_address)))
+        elif net.prefixlen:
+            base.append((field, (str(net.network_address), str(net.netmask))))
+    if rule.proto is not None:
+        base.append(('ip_proto', rule.proto))
+    if rule.proto not in (6, 17):
+        return [tuple(base)]
+    prefix = 'tcp' if rule.proto == 6 else 'udp'
+    sports = [None] if rule.sport == ANY_PORT else port_blocks(*rule.sport)
+    dports = [None] if rule.dport == ANY_PORT else port_blocks(*rule.dport)
+    matches = []
+    for sport in sports:
+        for dport in dports:
+            match = list(base)
+            for field, block in ((prefix + '_src', sport), (prefix + '_dst', dport)):
+                if block is not None:
+                    match.append((field, block[0] if block[1] == 0xffff else block))
+            matches.append(tuple(match))
+    return matches
+
+
+class Compiled(object):
+
+    def __init__(self, rules, default):
+        self.rules = rules
+        self.default = default
+        self.kept = []        # rules left, in list order
+        self.levels = []      # priority level of every kept rule, 0 is the lowest
+        self.shadowed = []    # (rule, earlier rule with the other action covering it)
+        self.redundant = []   # (rule, rule covering it, None for the default)
+        self.correlated = []  # (rule, later rule with the other action), partly overlapping
+        self.flows = []       # (level, match, action), highest level first
+
+    @property
+    def n_levels(self):
+        return max(self.levels) + 1 if self.levels else 0
+
+    def summary(self):
+        return ('%d rules, %d kept, %d shadowed, %d redundant, %d correlated, '
+                '%d flows, %d priority levels, default %s' %
+                (len(self.rules), len(self.kept), len(self.shadowed), len(self.redundant),
+                 len(self.correlated), len(self.flows), self.n_levels, self.default))
+
+
+def _overlapping(lo, hi, i, index):
+    # The rules of index whose box overlaps the one of rule i, one dimension at a time
+    for d in range(len(lo)):
+        index = index[(lo[d][index] <= hi[d][i]) & (hi[d][index] >= lo[d][i])]
+    return index
+
+
+def _covering(lo, hi, i, index):
+    # The rules of index whose box covers the one of rule i
+    for d in range(len(lo)):
+        index = index[(lo[d][index] <= lo[d][i]) & (hi[d][index] >= hi[d][i])]
+    return index
+
+
+def _covered(lo, hi, i, index):
+    # The rules of index whose box lies in the one of rule i
+    for d in range(len(lo)):
+        index = index[(lo[d][index] >= lo[d][i]) & (hi[d][index] <= hi[d][i])]
+    return index
+
+
+def compile(rules, default=ALLOW, max_levels=None):
+    # Rule list -> Compiled. Raises ValueError if it needs more than max_levels priorities.
+    result = Compiled(rules, default)
+    n = len(rules)
+    # The default is rule n, a box over everything. lo[d], hi[d]: bounds in dimension d.
+    boxes = np.array([_box(rule) for rule in rules] +
+                     [((0, 0xffffffff), (0, 0xffffffff), (0, 0xff), ANY_PORT, ANY_PORT)],
+                     np.int64).reshape(n + 1, 5, 2)
+    lo, hi = boxes[:, :, 0].T.copy(), boxes[:, :, 1].T.copy()
+    allow = np.array([rule.action == ALLOW for rule in rules] + [default == ALLOW])
+    kept = np.ones(n + 1, bool)
+
+    # Covered by one earlier rule
+    for i in range(1, n):
+        covers = _covering(lo, hi, i, np.flatnonzero(kept[:i]))
+        if len(covers):
+            j = covers[0]
+            kept[i] = False
+            if allow[j] == allow[i]:
+                result.redundant.append((rules[i], rules[j]))
+            else:
+                result.shadowed.append((rules[i], rules[j]))
+
+    # Covered by a later rule of the same action before anything of the other
+    # action gets in the way
+    for i in range(n - 1, -1, -1):
+        if not kept[i]:
+            continue
+        overlaps = _overlapping(lo, hi, i, i + 1 + np.flatnonzero(kept[i + 1:]))
+        same = allow[overlaps] == allow[i]
+        if not same.all():
+            same &= overlaps < overlaps[~same][0]
+        covers = _covering(lo, hi, i, overlaps[same])
+        if len(covers):
+            kept[i] = False
+            result.redundant.append((rules[i], rules[covers[0]] if covers[0] < n else None))
+
+    # Levels, from the last rule up: one above every later conflicting rule. A
+    # default allow is the table-miss entry, below every flow.
+    levels = np.full(n + 1, -1, np.int64)
+    if default == DENY:
+        levels[n] = 0
+    for i in range(n - 1, -1, -1):
+        if not kept[i]:
+            continue
+        later = i + 1 + np.flatnonzero(kept[i + 1:] & (allow[i + 1:] != allow[i]))
+        conflicts = _overlapping(lo, hi, i, later)
+        levels[i] = levels[conflicts].max() + 1 if len(conflicts) else 0
+        # Partial overlaps: the later rule does not cover this one and this one not the later
+        conflicts = conflicts[conflicts < n]
+        partial = np.setdiff1d(conflicts, np.union1d(_covering(lo, hi, i, conflicts),
+                                                     _covered(lo, hi, i, conflicts)))
+        result.correlated.extend((rules[i], rules[k]) for k in partial)
+
+    n_levels = int(levels.max()) + 1
+    if max_levels is not None and n_levels > max_levels:
+        raise ValueError('the rules need %d priority levels, %d are available' % (n_levels, max_levels))
+
+    for i in np.flatnonzero(kept[:n]):
+        rule = rules[i]
+        result.kept.append(rule)
+        result.levels.append(int(levels[i]))
+        result.flows.extend((int(levels[i]), match, rule.action) for match in rule_matches(rule))
+    if default == DENY:
+        result.flows.append((0, (('eth_type', ETH_TYPE_IP),), DENY))
+    result.flows.sort(key=lambda flow: -flow[0])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and compile a firewall rule list')
+    parser.add_argument('rules')
+    parser.add_argument('--topology', help='topology.json with the host names')
+    parser.add_argument('--flows', action='store_true', help='print the compiled flows')
+    args = parser.parse_args()
+
+    hosts = topology_hosts(args.topology) if args.topology else {}
+    rules, default = load(args.rules, hosts)
+    result = compile(rules, default)
+    for rule, other in result.shadowed:
+        print('line %d shadowed by line %d' % (rule.line, other.line))
+    for rule, other in result.redundant:
+        print('line %d redundant with %s' % (rule.line, 'line %d' % other.line if other else 'the default'))
+    for rule, other in result.correlated:
+        print('line %d correlated with line %d' % (rule.line, other.line))
+    if args.flows:
+        for level, match, action in result.flows:
+            print('%4d %-5s %s' % (level, action, ', '.join('%s=%s' % field for field in match)))
+    print(result.summary())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,333 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Compiles per-destination forwarding state into the smallest equivalent set
+# of prefix rules. Destinations are eth_dst MACs on the L2 switches and
+# ipv4_dst addresses or routes on the router. Rules match masked prefixes and
+# a longer prefix gets a higher priority, so a wide rule can carry the most
+# common out port and longer ones carve out the exceptions.
+#
+# Minimization is ORTC (Draves et al., "Constructing optimal IP routing
+# tables") on a binary trie kept per switch: leaves get the set of actions
+# that would work there, inner nodes the intersection of their children's sets
+# (the union if that is empty), and top down a rule is only placed where the
+# inherited action is not in a node's set. Updates only revisit the nodes
+# whose set or inherited action changed.
+#
+# Addresses nobody announced are either don't-care (exact=False, anything
+# the rules happen to do with them is fine, e.g. with a static topology) or
+# must keep missing the table and reach the controller (exact=True), which
+# can cost rules sending to the controller inside a wider prefix.
+#
+# Rules use the ProactivePlanner format: match tuples of (OXM field, value)
+# with (value, mask) for masked fields, and action tuples.
+
+from ipaddress import IPv4Address
+
+ETH_TYPE_IP = 0x0800
+OFPP_CONTROLLER = 0xfffffffd
+
+# Action of addresses that have to miss the table, as a rule inside a prefix
+MISS = (('output', OFPP_CONTROLLER),)
+
+_NONE = object()  # no entry / no rule at a node
+_ANY = None       # action set of a don't-care leaf
+
+
+def _combine(left, right):
+    if left is _ANY:
+        return right
+    if right is _ANY:
+        return left
+    both = left & right
+    return both if both else left | right
+
+
+def _pick(actions):
+    # Any member keeps the table minimal, this one keeps the output stable
+    return min(actions, key=repr)
+
+
+class _Node(object):
+    __slots__ = ('children', 'entry', 'actions', 'rule', 'inherited', 'dirty')
+
+    def __init__(self):
+        self.children = None  # [left, right] or None for a leaf
+        self.entry = _NONE    # action announced for exactly this prefix
+        self.actions = _ANY   # ORTC candidate set, frozenset or _ANY
+        self.rule = _NONE     # action of the rule placed here
+        self.inherited = _NONE  # action inherited from above at the last selection
+        self.dirty = True
+
+
+class PrefixTrie(object):
+    # Forwarding state of one match field of one switch: prefix -> action, and
+    # the compiled rules, (value, length) -> action
+
+    def __init__(self, bits, exact=False):
+        self.bits = bits
+        self.exact = exact
+        self.root = _Node()
+        self.entries = 0
+        self.rules = 0
+
+    def _path(self, value, length, create):
+        # Nodes from the root down to the prefix, and the siblings created on the way
+        nodes = [self.root]
+        created = []
+        node = self.root
+        for i in range(length):
+            bit = (value >> (self.bits - 1 - i)) & 1
+            if node.children is None:
+                if not create:
+                    return None, None
+                # Keep every inner node with two children, the sibling is where an
+                # exception for the rest of the prefix can go
+                node.children = [_Node(), _Node()]
+                created.append((i, node.children[1 - bit]))
+            node = node.children[bit]
+            nodes.append(node)
+        return nodes, created
+
+    def set(self, value, length, action, count=True):
+        # Announce (action) or withdraw (None) a prefix. Returns the rule changes
+        # as lists of ((value, length), action) adds and removes.
+        nodes, created = self._path(value, length, action is not None)
+        if nodes is None:
+            return [], []
+        node = nodes[-1]
+        if action is None:
+            if node.entry is _NONE:
+                return [], []
+            node.entry = _NONE
+            self.entries -= count
+        else:
+            if node.entry is _NONE:
+                self.entries += count
+            node.entry = action
+
+        # Entry inherited by the children of every node on the path
+        inherited = []
+        entry = _NONE
+        for n in nodes:
+            if n.entry is not _NONE:
+                entry = n.entry
+            inherited.append(entry)
+        # The subtree below inherits a different entry now and new siblings have
+        # no sets yet, both are done from scratch. The path above only needs its
+        # sets combined again.
+        self._candidates(node, inherited[-2] if len(nodes) > 1 else _NONE)
+        for depth, sibling in created:
+            self._candidates(sibling, inherited[depth])
+        for depth in range(len(nodes) - 2, -1, -1):
+            n = nodes[depth]
+            left, right = n.children
+            n.actions = _combine(left.actions, right.actions)
+            n.dirty = True
+
+        # Whatever is not matched misses the table, the root inherits that
+        adds, removes = [], []
+        self._select(self.root, 0, 0, MISS, adds, removes)
+        if action is None:
+            self._prune(nodes)
+        return adds, removes
+
+    def _candidates(self, node, inherited):
+        if node.entry is not _NONE:
+            inherited = node.entry
+        node.dirty = True
+        if node.children is None:
+            if inherited is not _NONE:
+                node.actions = frozenset((inherited,))
+            else:
+                node.actions = frozenset((MISS,)) if self.exact else _ANY
+            return
+        left, right = node.children
+        self._candidates(left, inherited)
+        self._candidates(right, inherited)
+        node.actions = _combine(left.actions, right.actions)
+
+    def _select(self, node, value, length, inherited, adds, removes):
+        if not node.dirty and node.inherited == inherited:
+            return
+        if node.actions is _ANY or inherited in node.actions:
+            rule = _NONE
+            chosen = inherited
+        else:
+            chosen = rule = _pick(node.actions)
+        if rule != node.rule:
+            prefix = (value, length)
+            if node.rule is not _NONE:
+                removes.append((prefix, node.rule))
+                self.rules -= 1
+            if rule is not _NONE:
+                adds.append((prefix, rule))
+                self.rules += 1
+            node.rule = rule
+        node.inherited = inherited
+        node.dirty = False
+        if node.children is not None:
+            shift = self.bits - 1 - length
+            self._select(node.children[0], value, length + 1, chosen, adds, removes)
+            self._select(node.children[1], value | (1 << shift), length + 1, chosen, adds, removes)
+
+    def _prune(self, nodes):
+        # Collapse leaf pairs left without entries. Their sets equal the parent's
+        # then, so they never hold a rule.
+        for node in reversed(nodes[:-1]):
+            left, right = node.children
+            for child in (left, right):
+                if child.children is not None or child.entry is not _NONE or child.rule is not _NONE:
+                    return
+            node.children = None
+
+    def items(self):
+        # Compiled rules as ((value, length), action), shortest prefixes first
+        stack = [(self.root, 0, 0)]
+        while stack:
+            node, value, length = stack.pop()
+            if node.rule is not _NONE:
+                yield (value, length), node.rule
+            if node.children is not None:
+                stack.append((node.children[1], value | (1 << (self.bits - 1 - length)), length + 1))
+                stack.append((node.children[0], value, length + 1))
+
+
+def _mask(bits, length):
+    return ((1 << bits) - 1) ^ ((1 << (bits - length)) - 1)
+
+
+def _mac(value):
+    return ':'.join('%02x' % b for b in value.to_bytes(6, 'big'))
+
+
+class FlowCompiler(object):
+    # Sits between the planner and the switches. Planner rules that match a
+    # single eth_dst, or eth_type IPv4 and a single ipv4_dst, go into the trie
+    # of their switch; the compiled rules come out in their place. Everything
+    # else passes through unchanged.
+
+    def __init__(self, exact=False):
+        self.exact = exact
+        self.tries = {}     # (dpid, 'eth_dst' | 'ipv4_dst') -> PrefixTrie
+        self.priority = {}  # (dpid, field) -> base priority of the compiled rules
+        self.passed = {}    # dpid -> rules passed through unchanged
+
+    def _key(self, match):
+        # (field, value, length) of a compilable match, or None
+        if len(match) == 1 and match[0][0] == 'eth_dst' and isinstance(match[0][1], str):
+            return 'eth_dst', int(match[0][1].replace(':', ''), 16), 48
+        if len(match) == 2 and match[0] == ('eth_type', ETH_TYPE_IP) and match[1][0] == 'ipv4_dst':
+            value = match[1][1]
+            if isinstance(value, tuple):
+                mask = int(IPv4Address(value[1]))
+                return 'ipv4_dst', int(IPv4Address(value[0])) & mask, bin(mask).count('1')
+            return 'ipv4_dst', int(IPv4Address(value)), 32
+        return None
+
+    def _trie(self, dpid, field, priority):
+        trie = self.tries.get((dpid, field))
+        if trie is None:
+            trie = self.tries[(dpid, field)] = PrefixTrie(48 if field == 'eth_dst' else 32, self.exact)
+            # Group addresses always go to the controller, even where the rest of
+            # the address space is don't-care: odd first octets for MACs, class D
+            # and up for IPv4
+            if field == 'eth_dst':
+                for octet in range(1, 256, 2):
+                    trie.set(octet << 40, 8, MISS, count=False)
+            else:
+                trie.set(224 << 24, 3, MISS, count=False)
+        if priority is not None:
+            self.priority.setdefault((dpid, field), priority)
+        return trie
+
+    def _rule(self, field, prefix, priority, actions):
+        value, length = prefix
+        if field == 'eth_dst':
+            bits = 48
+            if length == bits:
+                match = (('eth_dst', _mac(value)),)
+            else:
+                match = (('eth_dst', (_mac(value), _mac(_mask(bits, length)))),)
+        else:
+            bits = 32
+            if length == bits:
+                match = (('eth_type', ETH_TYPE_IP), ('ipv4_dst', str(IPv4Address(value))))
+            else:
+                match = (('eth_type', ETH_TYPE_IP),
+                         ('ipv4_dst', (str(IPv4Address(value)), str(IPv4Address(_mask(bits, length))))))
+        # Longer prefixes win, the base keeps all of them above what they replace
+        return match, priority + length, actions
+
+    def reserve(self, dpid, match, priority=None):
+        # Keep a destination missing the table (e.g. the router's own addresses)
+        # in the don't-care space. Returns the rule changes like compile().
+        return self._apply(dpid, [(match, priority, MISS, False, False)])
+
+    def compile(self, dpid, adds, removes):
+        # Planner (adds, removes) in, compiled (adds, removes) out
+        return self._apply(dpid, [(match, priority, actions, True, True) for match, priority, actions in removes] +
+                           [(match, priority, actions, False, True) for match, priority, actions in adds])
+
+    def _apply(self, dpid, updates):
+        out_adds, out_removes = [], []
+        changes = []
+        for match, priority, actions, withdraw, count in updates:
+            key = self._key(match)
+            if key is None:
+                passed = self.passed.setdefault(dpid, set())
+                if withdraw:
+                    out_removes.append((match, priority, actions))
+                    passed.discard(match)
+                else:
+                    out_adds.append((match, priority, actions))
+                    passed.add(match)
+                continue
+            field, value, length = key
+            trie = self._trie(dpid, field, priority)
+            changes.append((field, trie.set(value, length, None if withdraw else actions, count)))
+
+        # One update can replace a rule another one added, net out the changes
+        net = {}
+        for field, (trie_adds, trie_removes) in changes:
+            for prefix, action in trie_removes:
+                net[(field, prefix)] = net.get((field, prefix), ()) + (('-', action),)
+            for prefix, action in trie_adds:
+                net[(field, prefix)] = net.get((field, prefix), ()) + (('+', action),)
+        for (field, prefix), ops in net.items():
+            base = self.priority.get((dpid, field), 0)
+            first, last = ops[0], ops[-1]
+            if first[0] == '-' and last[0] == '+':
+                if first[1] != last[1]:
+                    # Same match and priority, the add replaces the old rule
+                    out_adds.append(self._rule(field, prefix, base, last[1]))
+            elif first[0] == '-':
+                out_removes.append(self._rule(field, prefix, base, first[1]))
+            elif last[0] == '+':
+                out_adds.append(self._rule(field, prefix, base, last[1]))
+        return out_adds, out_removes
+
+    def disconnect(self, dpid):
+        for key in [k for k in self.tries if k[0] == dpid]:
+            del self.tries[key]
+            self.priority.pop(key, None)
+        self.passed.pop(dpid, None)
+
+    def occupancy(self, dpid):
+        # (compiled rules, destinations behind them, rules passed through)
+        tries = [t for k, t in self.tries.items() if k[0] == dpid]
+        return (sum(t.rules for t in tries), sum(t.entries for t in tries),
+                len(self.passed.get(dpid, ())))
@@ -0,0 +1,163 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Batched flow programming. Messages for a datapath are queued and written
+# to the switch connection as one serialized buffer on flush(). A flush can
+# end with a barrier request, or wrap the flow_mods in an ONF bundle (the
+# OpenFlow 1.3 bundle extension OVS implements) so they are applied
+# atomically and in order. The returned BatchResult resolves once the switch
+# confirms the batch, with any error messages it sent for it.
+#
+# The app has to forward EventOFPBarrierReply to barrier_reply() and
+# EventOFPErrorMsg to error().
+
+from ryu.lib import hub
+
+
+class BatchResult(object):
+
+    def __init__(self, dpid, xids, confirmed):
+        self.dpid = dpid
+        self.xids = xids
+        self.confirmed = confirmed  # False if nothing will confirm the batch
+        self.errors = []            # (xid, type, code) reported by the switch
+        self.done = not confirmed
+        self._callbacks = []
+        self._event = hub.Event()
+        if self.done:
+            self._event.set()
+
+    @property
+    def ok(self):
+        return self.done and not self.errors
+
+    def add_done_callback(self, callback):
+        # callback(result), called right away if the batch is already done
+        if self.done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def wait(self, timeout=None):
+        # Blocks the calling green thread, never call this from an event handler
+        self._event.wait(timeout)
+        return self.done
+
+    def _resolve(self, error=None):
+        if self.done:
+            return
+        if error is not None:
+            self.errors.append(error)
+        self.done = True
+        self._event.set()
+        for callback in self._callbacks:
+            callback(self)
+        self._callbacks = []
+
+
+class FlowProgrammer(object):
+
+    def __init__(self):
+        self.queues = {}    # dpid -> (datapath, [msg])
+        self.pending = {}   # (dpid, xid) -> BatchResult, for every message of an unconfirmed batch
+        self.barriers = {}  # (dpid, barrier xid) -> BatchResult
+        self._bundle_id = 0
+
+    def add(self, datapath, msg):
+        queue = self.queues.get(datapath.id)
+        if queue is None or queue[0] is not datapath:
+            queue = self.queues[datapath.id] = (datapath, [])
+        queue[1].append(msg)
+
+    def flush(self, datapath, barrier=False, bundle=False, callback=None):
+        # Send everything queued for datapath in one write. Returns a BatchResult,
+        # or None if nothing was queued.
+        queue = self.queues.pop(datapath.id, None)
+        if queue is None or not queue[1]:
+            return None
+        msgs = queue[1]
+        parser = datapath.ofproto_parser
+
+        if bundle:
+            msgs = self._bundle(datapath, msgs)
+        if barrier or bundle:
+            msgs.append(parser.OFPBarrierRequest(datapath))
+
+        buf = bytearray()
+        xids = []
+        for msg in msgs:
+            datapath.set_xid(msg)
+            msg.serialize()
+            buf += msg.buf
+            xids.append(msg.xid)
+        datapath.send(bytes(buf))
+
+        result = BatchResult(datapath.id, xids, barrier or bundle)
+        if callback is not None:
+            result.add_done_callback(callback)
+        if not result.done:
+            for xid in xids:
+                self.pending[(datapath.id, xid)] = result
+            self.barriers[(datapath.id, xids[-1])] = result
+            result.add_done_callback(self._forget)
+        return result
+
+    def flush_all(self, barrier=False, bundle=False):
+        return [self.flush(datapath, barrier, bundle) for datapath, _ in list(self.queues.values())]
+
+    def _bundle(self, datapath, msgs):
+        parser = datapath.ofproto_parser
+        ofproto = datapath.ofproto
+        self._bundle_id = (self._bundle_id + 1) & 0xffffffff
+        flags = ofproto.ONF_BF_ATOMIC | ofproto.ONF_BF_ORDERED
+        bundled = [parser.ONFBundleCtrlMsg(datapath, self._bundle_id,
+                                           ofproto.ONF_BCT_OPEN_REQUEST, flags, [])]
+        rest = []
+        for msg in msgs:
+            if isinstance(msg, parser.OFPFlowMod):
+                bundled.append(parser.ONFBundleAddMsg(datapath, self._bundle_id, flags, msg, []))
+            else:
+                # Only flow_mods go into the bundle, everything else (packet_outs)
+                # follows the commit so it already sees the new flows
+                rest.append(msg)
+        bundled.append(parser.ONFBundleCtrlMsg(datapath, self._bundle_id,
+                                               ofproto.ONF_BCT_COMMIT_REQUEST, flags, []))
+        return bundled + rest
+
+    def _forget(self, result):
+        for xid in result.xids:
+            self.pending.pop((result.dpid, xid), None)
+        self.barriers.pop((result.dpid, result.xids[-1]), None)
+
+    def barrier_reply(self, msg):
+        result = self.barriers.get((msg.datapath.id, msg.xid))
+        if result is not None:
+            result._resolve()
+        return result
+
+    def error(self, msg):
+        # Attribute a switch error to its batch, returns the BatchResult or None
+        result = self.pending.get((msg.datapath.id, msg.xid))
+        if result is not None:
+            result.errors.append((msg.xid, msg.type, msg.code))
+        return result
+
+    def disconnect(self, dpid):
+        # Fail every unconfirmed batch of a switch that went away
+        self.queues.pop(dpid, None)
+        for (barrier_dpid, _), result in list(self.barriers.items()):
+            if barrier_dpid == dpid:
+                result._resolve((None, None, 'disconnected'))
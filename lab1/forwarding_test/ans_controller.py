@@ -14,26 +14,173 @@
  limitations under the License.
  """
 
+import os
+import sys
+import time
+from ipaddress import IPv4Address, IPv4Network
+
+from ryu.app.wsgi import WSGIApplication
 from ryu.base import app_manager
 from ryu.controller import ofp_event, dpset
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
-from ryu.lib.packet import packet, ethernet, ipv6, arp
+from ryu.lib import hub
+from ryu.lib.packet import arp
 from ryu.ofproto import ofproto_v1_3, ether
 
+# The shared controller modules live in lab1/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from router import Router
+import admission
+import arp_frames
+import classifier
+import cluster
+import discovery
+import dispatcher
+import firewall
+import flow_programmer
+import mac_table
+import pipeline
+import reconcile
+import shadow_table
+import spanning_tree
+import state_log
+import stats
+import tracing
+import metrics
+import metrics_api
+
 
 class LearningSwitch(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
+    # Priority and cookie of the learned L2 flows on s1 and s2
+    FLOW_PRIORITY = 10
+    LEARNED_COOKIE = 0x1
+
+    # MAC learning: stations per switch and seconds until an unseen station is forgotten.
+    # The learned flows idle out after as long, they do not outlive their station.
+    MAC_TABLE_CAPACITY = 8192
+    MAC_MAX_AGE = 300
+
+    # s3 acts as the router. Routed flows get ROUTE_PRIORITY + prefix length so the
+    # switch keeps longest prefix match semantics.
+    ROUTER_DPID = 3
+    ROUTE_PRIORITY = 100
+    ROUTE_IDLE_TIMEOUT = 60
+    ROUTE_COOKIE = 0x3
+    # An ARP request for a next hop is sent again after ROUTER_ARP_RETRY seconds
+    # without an answer, ROUTER_ARP_RETRIES times in all, then the packets waiting
+    # for it are dropped
+    ROUTER_ARP_RETRY = 1
+    ROUTER_ARP_RETRIES = 3
+
+    # Seconds between sweeps of the aging controller state
+    EXPIRE_INTERVAL = 10
+
+    # Packet_ins are handled by this many workers, sharded by dpid so a busy switch
+    # does not hold up the others. 0 handles them inline on ryu's event loop. The
+    # workers are hub threads, they share one core, see dispatcher.py.
+    PACKET_IN_WORKERS = 0
+    PACKET_IN_QUEUE = 1024
+
+    # Admission control: packet_ins per second (and burst) taken from one switch port.
+    # A source rejected OFFENDER_REJECTS times within OFFENDER_WINDOW seconds is dropped
+    # at the switch for BLOCK_TIMEOUT seconds. PACKET_IN_RATE = 0 turns it off.
+    PACKET_IN_RATE = 200
+    PACKET_IN_BURST = 400
+    OFFENDER_REJECTS = 100
+    OFFENDER_WINDOW = 1.0
+    BLOCK_PRIORITY = 1000
+    BLOCK_TIMEOUT = 10
+    BLOCK_COOKIE = 0x2
+
+    # Meter on the table-miss entry and the flows that punt broadcasts, in packets
+    # per second, used if the switch has meters
+    TABLE_MISS_METER_ID = 1
+    TABLE_MISS_METER_RATE = 1000
+    TABLE_MISS_METER_BURST = 200
+
+    # Let the switch buffer table-miss packets and send only the first
+    # BUFFER_MISS_LEN bytes, packet_outs then refer to the buffer_id. Switches
+    # without buffers (OVS) keep sending whole packets.
+    BUFFER_PACKETS = False
+    BUFFER_MISS_LEN = 128
+
+    # Prebuilt ARP frames kept for packet_outs, see arp_frames.py
+    ARP_FRAME_CACHE = 4096
+
+    # Learned stations, next hop ARP entries and known switches are logged to
+    # STATE_FILE every STATE_SYNC_INTERVAL seconds and loaded again on start, see
+    # state_log.py. Set by ANS_STATE (e.g. /tmp/ans_router.state), None keeps nothing
+    # across restarts.
+    STATE_FILE = os.environ.get('ANS_STATE')
+    STATE_SYNC_INTERVAL = 5
+
+    # A connecting switch keeps the flows that agree with the controller state
+    # instead of being reprogrammed from scratch, see reconcile.py
+    RECONCILE_FLOWS = True
+
+    # Program switches with the multi-table pipeline of pipeline.py if their table
+    # features allow it, else everything goes to table 0
+    MULTI_TABLE = True
+
+    # Cluster mode: several controller processes share the switches, one programs
+    # each switch and the others take over when it goes away, see cluster.py.
+    # ANS_CLUSTER is 'memory' or host:port of the cluster store, ANS_NODE names this
+    # process. The state_log state is replicated every CLUSTER_SYNC_INTERVAL seconds.
+    CLUSTER = os.environ.get('ANS_CLUSTER')
+    NODE_ID = os.environ.get('ANS_NODE', str(os.getpid()))
+    CLUSTER_SYNC_INTERVAL = 2
+
+    # Port stats of every switch are polled every STATS_INTERVAL seconds, flow stats
+    # every STATS_FLOWS_EVERY rounds; the interval adapts between STATS_MIN_INTERVAL
+    # and STATS_MAX_INTERVAL, see stats.py. 0 polls nothing.
+    STATS_INTERVAL = 5
+    STATS_MIN_INTERVAL = 1
+    STATS_MAX_INTERVAL = 30
+    STATS_FLOWS_EVERY = 3
+
+    # LLDP link discovery: every switch port is probed every DISCOVERY_INTERVAL
+    # seconds, at most DISCOVERY_RATE probes per second in total, and a link is down
+    # once DISCOVERY_MISSES rounds of probes got lost, see discovery.py. Probes come
+    # back to the controller through an LLDP_PRIORITY flow.
+    DISCOVERY = True
+    DISCOVERY_INTERVAL = 5
+    DISCOVERY_RATE = 500
+    DISCOVERY_MISSES = 3
+    DISCOVERY_TICK = 0.1
+    LLDP_PRIORITY = 0xffff
+
+    # Broadcasts follow a spanning tree of the discovered links: every switch copies
+    # them to its tree and edge ports with an OFPGT_ALL group instead of OFPP_FLOOD,
+    # see spanning_tree.py. The router does not bridge, it gets
+    # no group. Needs DISCOVERY.
+    BROADCAST_TREE = True
+    BROADCAST_PRIORITY = 5
+    BROADCAST_COOKIE = 0x4
+
+    # Stateless firewall of the router: the rule list in FIREWALL_RULES (ANS_FIREWALL,
+    # e.g. ../firewall.rules) with the host names of FIREWALL_HOSTS is compiled into
+    # flows of the router's ACL table, from FIREWALL_PRIORITY up to BLOCK_PRIORITY
+    # with two priorities per level, see firewall.py. Denied packets are dropped
+    # there, allowed ones go on to the routes. None turns it off.
+    FIREWALL_RULES = os.environ.get('ANS_FIREWALL')
+    FIREWALL_HOSTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'topology.json')
+    FIREWALL_PRIORITY = 200
+    FIREWALL_COOKIE = 0x5
+
     _CONTEXTS = {
         'dpset': dpset.DPSet,
+        'wsgi': WSGIApplication,
     }
 
     def __init__(self, *args, **kwargs):
         super(LearningSwitch, self).__init__(*args, **kwargs)
 
         # Here you can initialize the data structures you want to keep at the controller
-        self.mac_to_port = {}
+        self.mac_table = mac_table.MacTable(self.MAC_TABLE_CAPACITY, self.MAC_MAX_AGE)
         self.datapaths = {}
 
         # Router port MACs assumed by the controller
@@ -48,88 +195,721 @@ class LearningSwitch(app_manager.RyuApp):
             2: "10.0.2.1",
             3: "192.168.1.1"
         }
+        # Networks directly attached to the router ports
+        self.port_to_subnet = {
+            1: "10.0.1.0/24",
+            2: "10.0.2.0/24",
+            3: "192.168.1.0/24"
+        }
+        self.router = Router(self.port_to_own_mac, self.port_to_own_ip, self.port_to_subnet,
+                             arp_retry=self.ROUTER_ARP_RETRY, arp_retries=self.ROUTER_ARP_RETRIES)
+        self.firewall = None
+        if self.FIREWALL_RULES:
+            rules, default = firewall.load(self.FIREWALL_RULES,
+                                           firewall.topology_hosts(self.FIREWALL_HOSTS))
+            self.firewall = firewall.compile(rules, default,
+                                             (self.BLOCK_PRIORITY - self.FIREWALL_PRIORITY) // 2)
+            self.logger.info('firewall %s: %s', self.FIREWALL_RULES, self.firewall.summary())
+
+        # EtherType -> packet_in handler, for the L2 switches and for the router
+        self.switch_handlers = {
+            classifier.ETH_TYPE_IPV6: self.ipv6_handler,
+        }
+        self.router_handlers = {
+            classifier.ETH_TYPE_IPV6: self.ipv6_handler,
+            classifier.ETH_TYPE_ARP: self.router_arp_packet_handler,
+            classifier.ETH_TYPE_IP: self.router_ip_handler,
+        }
         self.dpset = kwargs['dpset']
-        print(self.dpset)
+        self.trace = tracing.EventLog.from_env()
+        # Prometheus metrics on http://<controller>:8080/metrics
+        self.metrics = metrics.ControllerMetrics(self)
+        metrics_api.register(kwargs['wsgi'], self.metrics.registry)
+        # Messages are queued per datapath and written out in one buffer, see send_msg
+        self.flows = flow_programmer.FlowProgrammer()
+        # What is installed on every switch, identical flow_mods are not sent twice
+        self.shadow = shadow_table.ShadowTable()
+        self.arp_frames = arp_frames.ArpFrames(self.ARP_FRAME_CACHE)
+        self.admission = None
+        if self.PACKET_IN_RATE:
+            self.admission = admission.AdmissionControl(
+                self.PACKET_IN_RATE, self.PACKET_IN_BURST,
+                self.OFFENDER_REJECTS, self.OFFENDER_WINDOW)
+        self.threads.append(hub.spawn(self._expire_loop))
+        self.dispatcher = None
+        if self.PACKET_IN_WORKERS:
+            self.dispatcher = dispatcher.ShardedDispatcher(
+                self.handle_packet_in, self.PACKET_IN_WORKERS, self.PACKET_IN_QUEUE,
+                on_drop=self.metrics.packet_in_dropped.inc)
+            self.threads.extend(self.dispatcher.threads)
+        self.dumps = reconcile.FlowDump()
+        self.features = pipeline.TableFeatures()
+        self.tables = {}  # dpid -> pipeline.TABLES or pipeline.FLAT
+        self.metered = set()  # dpids with the table-miss meter installed
+        self.switches = {}  # dpid -> when it last connected (wall clock)
+        self.state_log = None
+        if self.STATE_FILE:
+            self.state_log = state_log.StateLog(self.STATE_FILE)
+            self.rehydrate(self.state_log.load())
+            self.threads.append(hub.spawn(self._state_loop))
+        self.cluster = None
+        if self.CLUSTER:
+            self.cluster = cluster.Cluster(cluster.connect(self.CLUSTER), self.NODE_ID,
+                                           self.role_changed, self.restore, ('mac', 'arp'))
+            self.cluster.join()
+            self.threads.append(hub.spawn(self._cluster_loop))
+        self.stats = None
+        if self.STATS_INTERVAL:
+            self.stats = stats.StatsPoller(
+                self.send_msg, self.flows.flush_all, self.programmed,
+                capacity=self.port_capacity, interval=self.STATS_INTERVAL,
+                min_interval=self.STATS_MIN_INTERVAL, max_interval=self.STATS_MAX_INTERVAL,
+                flows_every=self.STATS_FLOWS_EVERY)
+            self.threads.append(hub.spawn(self.stats.run))
+        self.discovery = None
+        if self.DISCOVERY:
+            self.discovery = discovery.Discovery(self.DISCOVERY_INTERVAL, self.DISCOVERY_RATE,
+                                                 self.DISCOVERY_MISSES)
+            self.discovery.subscribe(self.link_event)
+            for handlers in (self.switch_handlers, self.router_handlers):
+                handlers[classifier.ETH_TYPE_LLDP] = self.lldp_handler
+            self.threads.append(hub.spawn(self._discovery_loop))
+        self.broadcast = None
+        if self.discovery is not None and self.BROADCAST_TREE:
+            self.broadcast = spanning_tree.BroadcastTree(self.discovery, routers=(self.ROUTER_DPID,))
+            self.discovery.subscribe(self.broadcast.update)
+
+    def close(self):
+        if self.state_log is not None:
+            self.state_log.sync(self.snapshot())
+            self.state_log.close()
+        if self.cluster is not None:
+            self.cluster.close()
+        self.trace.close()
+        super(LearningSwitch, self).close()
+
+    # Controller state as logged by state_log, times on the wall clock
+    def snapshot(self):
+        return {
+            'mac': dict(((dpid, mac), (port, state_log.wall_time(seen)))
+                        for dpid, mac, port, seen in self.mac_table.items()),
+            'arp': dict((str(ip), (mac, state_log.wall_time(expiry)))
+                        for ip, mac, expiry in self.router.arp.items()),
+            'switch': dict(self.switches),
+        }
+
+    def rehydrate(self, state):
+        stations = sum(self.restore('mac', key, value) for key, value in state.get('mac', {}).items())
+        next_hops = sum(self.restore('arp', key, value) for key, value in state.get('arp', {}).items())
+        self.switches.update(state.get('switch', {}))
+        self.logger.info('restored %d stations, %d next hops and %d switches from %s',
+                         stations, next_hops, len(self.switches), self.STATE_FILE)
+
+    # Put back one record of snapshot(), from the state log or another cluster node
+    def restore(self, namespace, key, value):
+        if namespace == 'mac':
+            (dpid, mac), (port, seen) = key, value
+            return self.mac_table.restore(dpid, mac, port, state_log.monotonic_time(seen))
+        if namespace == 'arp':
+            mac, expiry = value
+            return self.router.arp.restore(key, mac, state_log.monotonic_time(expiry))
+        return False
+
+    def _cluster_loop(self):
+        while True:
+            hub.sleep(self.CLUSTER_SYNC_INTERVAL)
+            self.cluster.publish(self.snapshot())
+
+    def _state_loop(self):
+        while True:
+            hub.sleep(self.STATE_SYNC_INTERVAL)
+            try:
+                self.state_log.sync(self.snapshot())
+            except OSError as e:
+                self.logger.warning('cannot write %s: %s', self.STATE_FILE, e)
+
+    def _expire_loop(self):
+        while True:
+            hub.sleep(self.EXPIRE_INTERVAL)
+            self.shadow.expire()
+            self.mac_table.expire()
+            if self.admission is not None:
+                self.admission.expire()
+            self.retry_router_arp()
+
+    # Next hops that did not answer and had no packet since get their request again
+    def retry_router_arp(self):
+        resend = self.router.arp.expire()
+        datapath = self.datapaths.get(self.ROUTER_DPID)
+        if not resend or datapath not in self.programmed():
+            return
+        for next_hop in resend:
+            route = self.router.routes.lookup(int(next_hop))
+            if route is not None:
+                self.send_router_arp_request(datapath, route.port, next_hop)
+        self.flows.flush(datapath)
 
     def _get_hwaddr(self, dpid, port_no):
         return self.dpset.get_port(dpid, port_no).hw_addr
 
+    # Link capacity of a switch port in bit/s, from the speed the port reports (kbit/s)
+    def port_capacity(self, dpid, port_no):
+        port = self.dpset.port_state.get(dpid, {}).get(port_no)
+        return port.curr_speed * 1000 if port is not None and port.curr_speed else None
+
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
 
 
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
+        self.mac_table.add_switch(datapath.id)
+        self.datapaths[datapath.id] = datapath
+        self.switches[datapath.id] = int(time.time())
+
+        if self.cluster is not None:
+            # Programmed once the cluster makes this node master. The role request
+            # waits for the switch's owner to be known, see role_changed.
+            self.cluster.connect(datapath.id)
+        else:
+            self.take_over(datapath)
+
+    # Start programming a switch, once its table features are known
+    def take_over(self, datapath):
+        if self.MULTI_TABLE:
+            # Nothing is installed until the switch told which pipeline it can run
+            self.send_msg(datapath, self.features.request(datapath))
+            self.flows.flush(datapath)
+        else:
+            self.program(datapath)
+
+    @set_ev_cls(ofp_event.EventOFPTableFeaturesStatsReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def table_features_handler(self, ev):
+        datapath = ev.msg.datapath
+        features = self.features.reply(ev.msg)
+        if features is None or self.datapaths.get(datapath.id) is not datapath:
+            return
+        problems = pipeline.validate(datapath.ofproto, features)
+        if problems:
+            self.logger.warning('dpid %s: single table, the pipeline does not fit: %s',
+                                datapath.id, '; '.join(problems))
+        self.tables[datapath.id] = pipeline.FLAT if problems else pipeline.TABLES
+        self.program(datapath)
+
+    # Table of a switch a kind of flow goes to, see pipeline.py
+    def table(self, datapath, name):
+        return self.tables.get(datapath.id, pipeline.FLAT)[name]
+
+    # Reconcile a switch with what it has or install from scratch
+    def program(self, datapath):
+        if self.RECONCILE_FLOWS:
+            # Nothing is installed until the dump of what the switch already has is back
+            self.send_msg(datapath, self.dumps.request(datapath))
+            self.flows.flush(datapath)
+        else:
+            self.install(datapath)
+
+    # Program a switch: table-miss entry and its meter. Returns the flow_key()s of
+    # the rules it installs.
+    def install(self, datapath):
+        parser = datapath.ofproto_parser
+
+        # Initial flow entry for matching misses. It gets a meter once the switch
+        # reports meter support, until then (or without meters) it is unlimited.
+        self.add_table_miss(datapath)
+        if self.TABLE_MISS_METER_RATE:
+            self.send_msg(datapath, parser.OFPMeterFeaturesStatsRequest(datapath, 0))
+        installed = set(self.add_pipeline(datapath))
+        if self.discovery is not None:
+            installed.add(self.add_discovery_flow(datapath))
+        if self.broadcast is not None and datapath.id != self.ROUTER_DPID:
+            installed.update(self.add_broadcast(datapath))
+        if self.firewall is not None and datapath.id == self.ROUTER_DPID:
+            installed.update(self.add_firewall(datapath))
+        self.flows.flush(datapath, barrier=True, callback=self._batch_done)
+        return installed
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def flow_stats_handler(self, ev):
+        if self.stats is not None and self.stats.flow_reply(ev.msg):
+            return
+        stats = self.dumps.reply(ev.msg)
+        if stats is not None and self.datapaths.get(ev.msg.datapath.id) is ev.msg.datapath:
+            self.reconcile(ev.msg.datapath, stats)
+
+    # Take over the flows a switch already has: the shadow table starts from the
+    # dump, so rules that are already there are not sent again, and only the
+    # flows that contradict the controller state are deleted
+    def reconcile(self, datapath, stats):
+        if self.broadcast is not None:
+            # install() deletes the broadcast group, and the switch every flow pointing to it
+            stats = [stat for stat in stats if not reconcile.uses_group(datapath, stat)]
+        self.shadow.seed(datapath.id, stats)
+        installed = self.install(datapath)
+        stale = [stat for stat in stats if not self.flow_valid(datapath, stat, installed)]
+        for stat in stale:
+            self.send_msg(datapath, reconcile.delete_strict(datapath, stat))
+        self.flows.flush(datapath, barrier=True, callback=self._batch_done)
+
+        self.metrics.flows_reconciled.inc(datapath.id, 'kept', n=len(stats) - len(stale))
+        self.metrics.flows_reconciled.inc(datapath.id, 'deleted', n=len(stale))
+        self.logger.info('dpid %s: kept %d of %d installed flows', datapath.id,
+                         len(stats) - len(stale), len(stats))
+        if self.trace.enabled:
+            self.trace.emit('reconcile', dpid=datapath.id, flows=len(stats), deleted=len(stale))
+
+    def flow_valid(self, datapath, stat, installed):
+        if shadow_table.flow_key(stat) in installed:
+            return True
+        if stat.cookie == self.LEARNED_COOKIE:
+            return reconcile.learned_flow_valid(datapath, stat, self.mac_table)
+        if stat.cookie == self.ROUTE_COOKIE:
+            return datapath.id == self.ROUTER_DPID and self.route_flow_valid(datapath, stat)
+        if stat.cookie == self.BLOCK_COOKIE:
+            # Gone with its hard timeout
+            return True
+        # The IPv6 drop holds on every switch, any other rule is from some older state
+        return dict(stat.match.items()) == {'eth_type': classifier.ETH_TYPE_IPV6}
+
+    # A route flow is kept if its destination still takes the same route to the
+    # same next hop MAC, i.e. install_route() would install exactly this flow
+    def route_flow_valid(self, datapath, stat):
+        prefix = dict(stat.match.items()).get('ipv4_dst')
+        if prefix is None:
+            return False
+        if not isinstance(prefix, tuple):
+            prefix = (prefix, '255.255.255.255')
+        resolved = self.router.resolve(prefix[0])
+        if resolved is None or resolved[2] is None:
+            return False
+        route, _, next_hop_mac = resolved
+        prefix_len = bin(int(IPv4Address(prefix[1]))).count("1")
+        return (stat.table_id == self.table(datapath, pipeline.L3) and
+                self.router.flow_prefix(route, prefix[0]) == prefix and
+                stat.priority == self.ROUTE_PRIORITY + prefix_len and
+                reconcile.same_actions(datapath, stat, self.route_actions(
+                    datapath.ofproto_parser, route, next_hop_mac)))
+
+    # Table-miss entries passing packets down the pipeline, and the IPv6 drop of the
+    # classifier. Returns their flow_key()s and the one of the table-miss entry.
+    def add_pipeline(self, datapath):
+        parser = datapath.ofproto_parser
+        installed = [(self.table(datapath, pipeline.L2), 0, ())]
+        for table_id, next_id in pipeline.gotos(self.tables.get(datapath.id, pipeline.FLAT)):
+            self.send_msg(datapath, parser.OFPFlowMod(
+                datapath=datapath, table_id=table_id, priority=0, match=parser.OFPMatch(),
+                instructions=[parser.OFPInstructionGotoTable(next_id)]))
+            installed.append((table_id, 0, ()))
+        table_id = self.table(datapath, pipeline.CLASSIFIER)
+        match = parser.OFPMatch(eth_type=classifier.ETH_TYPE_IPV6)
+        self.add_flow(datapath, 1, match, [], table_id=table_id)
+        installed.append((table_id, 1, shadow_table.match_key(match)))
+        return installed
+
+    # Discovery probes go to the controller past the metered table-miss entry, and
+    # the switch is asked for its ports to probe. Returns the flow_key() of the flow.
+    def add_discovery_flow(self, datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        table_id = self.table(datapath, pipeline.CLASSIFIER)
+        match = parser.OFPMatch(eth_type=classifier.ETH_TYPE_LLDP)
+        self.add_flow(datapath, self.LLDP_PRIORITY, match,
+                      [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)],
+                      table_id=table_id)
+        self.send_msg(datapath, parser.OFPPortDescStatsRequest(datapath, 0))
+        return table_id, self.LLDP_PRIORITY, shadow_table.match_key(match)
+
+    # The broadcast group of a switch and the flows that hand it the broadcasts.
+    # Groups and flows left by an earlier run go first. Returns the flow_key()s of
+    # the flows.
+    def add_broadcast(self, datapath):
+        ofproto = datapath.ofproto
+        ports = self.broadcast.installed(datapath.id)
+        self.send_msg(datapath, spanning_tree.group_mod(datapath, ofproto.OFPGC_DELETE))
+        self.send_msg(datapath, spanning_tree.group_mod(datapath, ofproto.OFPGC_ADD, ports))
+        return self.add_broadcast_flows(datapath)
+
+    # The controller gets a copy of every broadcast to learn the sender from. Once
+    # the switch has the table-miss meter these copies count against it too, or a
+    # broadcast storm would reach the controller unlimited.
+    def add_broadcast_flows(self, datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        table_id = self.table(datapath, pipeline.L2)
+        meter_id = self.TABLE_MISS_METER_ID if datapath.id in self.metered else None
+        match = parser.OFPMatch(eth_dst=spanning_tree.BROADCAST_MAC)
+        self.add_flow(datapath, self.BROADCAST_PRIORITY, match,
+                      [parser.OFPActionGroup(spanning_tree.BROADCAST_GROUP),
+                       parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)],
+                      cookie=self.BROADCAST_COOKIE, meter_id=meter_id, table_id=table_id)
+        installed = [(table_id, self.BROADCAST_PRIORITY, shadow_table.match_key(match))]
+        return installed
+
+    # Priority of a firewall level, the odd one above it is for install_firewall_routes()
+    def firewall_priority(self, level):
+        return self.FIREWALL_PRIORITY + 2 * level
+
+    # The compiled firewall in the ACL table of the router, allowed packets go on to
+    # the routes. A router on a single table has no routes behind the firewall: an
+    # allow punts to the controller there, metered like the table-miss entry, and
+    # install_route() offloads what it allows. Returns the flow_key()s of the flows.
+    def add_firewall(self, datapath):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
+        table_id = self.table(datapath, pipeline.ACL)
+        next_id = self.table(datapath, pipeline.L3)
+        if next_id == table_id:
+            allow = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, [
+                parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)])]
+            if datapath.id in self.metered:
+                allow.insert(0, parser.OFPInstructionMeter(self.TABLE_MISS_METER_ID))
+        else:
+            allow = [parser.OFPInstructionGotoTable(next_id)]
+        installed = []
+        for level, fields, action in self.firewall.flows:
+            match = parser.OFPMatch(**dict(fields))
+            priority = self.firewall_priority(level)
+            self.send_msg(datapath, parser.OFPFlowMod(
+                datapath=datapath, table_id=table_id, priority=priority,
+                cookie=self.FIREWALL_COOKIE, match=match,
+                instructions=allow if action == firewall.ALLOW else []))
+            installed.append((table_id, priority, shadow_table.match_key(match)))
+        return installed
 
-        # Initial flow entry for matching misses
+    def add_table_miss(self, datapath, meter_id=None):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
         match = parser.OFPMatch()
-        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
-                                          ofproto.OFPCML_NO_BUFFER)]
-        self.add_flow(datapath, 0, match, actions)
+        max_len = self.BUFFER_MISS_LEN if self.BUFFER_PACKETS else ofproto.OFPCML_NO_BUFFER
+        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, max_len)]
+        self.add_flow(datapath, 0, match, actions, meter_id=meter_id,
+                      table_id=self.table(datapath, pipeline.L2))
+
+    @set_ev_cls(ofp_event.EventOFPMeterFeaturesStatsReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def meter_features_handler(self, ev):
+        datapath = ev.msg.datapath
+        if not admission.meters_supported(datapath, ev.msg.body, self.TABLE_MISS_METER_ID):
+            self.logger.info('dpid %s: no meters, the table-miss entry is not rate limited',
+                             datapath.id)
+            return
+        for mod in admission.meter_mods(datapath, self.TABLE_MISS_METER_ID,
+                                        self.TABLE_MISS_METER_RATE, self.TABLE_MISS_METER_BURST):
+            self.send_msg(datapath, mod)
+        self.metered.add(datapath.id)
+        self.add_table_miss(datapath, self.TABLE_MISS_METER_ID)
+        if self.broadcast is not None and datapath.id != self.ROUTER_DPID:
+            self.add_broadcast_flows(datapath)
+        if self.firewall is not None and datapath.id == self.ROUTER_DPID:
+            self.add_firewall(datapath)
+        self.flows.flush(datapath, barrier=True, callback=self._batch_done)
+
+    # Drop everything from src on this port for a while, see admission.py
+    def block_source(self, datapath, in_port, src):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        src = src.hex(':')
+        self.logger.info('dpid %s: blocking %s on port %s for %ds',
+                         datapath.id, src, in_port, self.BLOCK_TIMEOUT)
+        if self.trace.enabled:
+            self.trace.emit('block', dpid=datapath.id, in_port=in_port, src=src)
+        self.send_msg(datapath, parser.OFPFlowMod(
+            datapath=datapath, table_id=self.table(datapath, pipeline.ACL),
+            priority=self.BLOCK_PRIORITY, cookie=self.BLOCK_COOKIE,
+            match=parser.OFPMatch(in_port=in_port, eth_src=src), instructions=[],
+            hard_timeout=self.BLOCK_TIMEOUT, flags=ofproto.OFPFF_SEND_FLOW_REM))
+        self.flows.flush(datapath)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def state_change_handler(self, ev):
+        datapath = ev.datapath
+        if datapath.id is None or self.datapaths.get(datapath.id) is not datapath:
+            return
+        del self.datapaths[datapath.id]
+        self.switches.pop(datapath.id, None)
+        self.release(datapath.id)
+        self.flows.disconnect(datapath.id)
+        self.mac_table.remove_switch(datapath.id)
+        if self.admission is not None:
+            self.admission.forget(datapath.id)
+        if self.cluster is not None:
+            self.cluster.disconnect(datapath.id)
+
+    # Forget what this controller programmed on a switch, it is unknown once the
+    # switch comes back or this controller becomes its master again
+    def release(self, dpid):
+        self.dumps.disconnect(dpid)
+        self.features.disconnect(dpid)
+        self.tables.pop(dpid, None)
+        self.metered.discard(dpid)
+        self.shadow.forget(dpid)
+        if self.stats is not None:
+            self.stats.disconnect(dpid)
+        if self.discovery is not None:
+            self.discovery.remove_switch(dpid)
+        if self.broadcast is not None:
+            self.broadcast.forget(dpid)
+
+    # Switches this controller programs: all of them, or those it is master of
+    def programmed(self):
+        if self.cluster is None:
+            return list(self.datapaths.values())
+        return [datapath for dpid, datapath in self.datapaths.items() if self.cluster.is_master(dpid)]
 
-        self.mac_to_port[datapath.id] = {}
-        self.datapaths[datapath.id] = {datapath}
+    # Called by the cluster when this node became master or slave of a switch
+    def role_changed(self, dpid, master, generation):
+        datapath = self.datapaths.get(dpid)
+        if datapath is None:
+            return
+        self.logger.info('dpid %s: %s, generation %d', dpid, 'master' if master else 'slave', generation)
+        self.send_role(datapath, master, generation)
+        if not master:
+            self.release(dpid)
+
+    def send_role(self, datapath, master, generation):
+        ofproto = datapath.ofproto
+        role = ofproto.OFPCR_ROLE_MASTER if master else ofproto.OFPCR_ROLE_SLAVE
+        self.send_msg(datapath, datapath.ofproto_parser.OFPRoleRequest(datapath, role, generation))
+        self.flows.flush(datapath)
+
+    # The switch accepted this controller as master, from now on it programs it
+    @set_ev_cls(ofp_event.EventOFPRoleReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def role_reply_handler(self, ev):
+        msg = ev.msg
+        datapath = msg.datapath
+        if self.cluster is None or self.datapaths.get(datapath.id) is not datapath:
+            return
+        if msg.role == datapath.ofproto.OFPCR_ROLE_MASTER and self.cluster.is_master(datapath.id):
+            self.take_over(datapath)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def port_stats_handler(self, ev):
+        if self.stats is not None:
+            self.stats.port_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def port_desc_handler(self, ev):
+        datapath = ev.msg.datapath
+        ofproto = datapath.ofproto
+        if self.discovery is None or self.datapaths.get(datapath.id) is not datapath:
+            return
+        self.discovery.add_switch(datapath.id, dict(
+            (port.port_no, arp_frames.mac_bytes(port.hw_addr)) for port in ev.msg.body
+            if port.port_no <= ofproto.OFPP_MAX and not port.state & ofproto.OFPPS_LINK_DOWN))
+
+    def _discovery_loop(self):
+        while True:
+            hub.sleep(self.DISCOVERY_TICK)
+            # A slave switch refuses packet_outs, its probes are up to its master
+            programmed = dict((datapath.id, datapath) for datapath in self.programmed())
+            for dpid, port, frame in self.discovery.due():
+                datapath = programmed.get(dpid)
+                if datapath is not None:
+                    self.send_probe(datapath, port, frame)
+            self.discovery.expire()
+            if self.broadcast is not None:
+                self.update_broadcast()
+            self.flows.flush_all()
+
+    def send_probe(self, datapath, port, frame):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        self.send_msg(datapath, parser.OFPPacketOut(
+            datapath=datapath, buffer_id=ofproto.OFP_NO_BUFFER, in_port=ofproto.OFPP_CONTROLLER,
+            actions=[parser.OFPActionOutput(port)], data=frame))
+
+    # Only the switches whose flood ports changed get a group_mod
+    def update_broadcast(self):
+        programmed = dict((datapath.id, datapath) for datapath in self.programmed())
+        for dpid, ports in self.broadcast.changed().items():
+            datapath = programmed.get(dpid)
+            if datapath is None:
+                continue
+            self.send_msg(datapath, spanning_tree.group_mod(datapath, datapath.ofproto.OFPGC_MODIFY,
+                                                            ports))
+            if self.trace.enabled:
+                self.trace.emit('broadcast_ports', dpid=dpid, ports=sorted(ports))
+
+    # Flooding out of a packet_out: the switch's broadcast group, which skips the
+    # in_port, or OFPP_FLOOD without a spanning tree or before discovery settled
+    # the switch's ports (its group lacks edge ports until then)
+    def flood_actions(self, datapath):
+        parser = datapath.ofproto_parser
+        if self.broadcast is not None and datapath.id in self.broadcast.flood and \
+                self.discovery.all_settled(datapath.id):
+            return [parser.OFPActionGroup(spanning_tree.BROADCAST_GROUP)]
+        return [parser.OFPActionOutput(datapath.ofproto.OFPP_FLOOD)]
+
+    # A discovery probe that came back through a neighbour
+    def lldp_handler(self, ev, frame):
+        self.discovery.received(ev.msg.datapath.id, ev.msg.match['in_port'], ev.msg.data)
+
+    # Called by discovery for every link that appeared or went away
+    def link_event(self, event):
+        if event.kind == 'settled':
+            return
+        self.logger.info('link %s %s:%s -> %s:%s %s', event.kind, event.src, event.src_port,
+                         event.dst, event.dst_port, event.reason or '')
+        if self.trace.enabled:
+            self.trace.emit('link', kind=event.kind, src=event.src, src_port=event.src_port,
+                            dst=event.dst, dst_port=event.dst_port, reason=event.reason)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
+    def port_status_handler(self, ev):
+        msg = ev.msg
+        ofproto = msg.datapath.ofproto
+        if self.discovery is None or msg.datapath not in self.programmed():
+            return
+        up = msg.reason != ofproto.OFPPR_DELETE and \
+            not msg.desc.state & ofproto.OFPPS_LINK_DOWN
+        self.discovery.port_changed(msg.datapath.id, msg.desc.port_no, up,
+                                    arp_frames.mac_bytes(msg.desc.hw_addr))
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def barrier_reply_handler(self, ev):
+        self.flows.barrier_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPErrorMsg, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def error_msg_handler(self, ev):
+        msg = ev.msg
+        if msg.type == msg.datapath.ofproto.OFPET_FLOW_MOD_FAILED:
+            # Some flow_mod did not make it, the shadow copy of this switch is unreliable now
+            self.shadow.forget(msg.datapath.id)
+        if self.features.error(msg):
+            # No table features, no pipeline
+            self.logger.warning('dpid %s: no table features, single table', msg.datapath.id)
+            self.tables[msg.datapath.id] = pipeline.FLAT
+            self.program(msg.datapath)
+            return
+        if self.stats is not None and self.stats.error(msg):
+            self.logger.warning('dpid %s: stats request failed, type %s code %s',
+                                msg.datapath.id, msg.type, msg.code)
+            return
+        if self.flows.error(msg) is None:
+            self.logger.warning('dpid %s: error type %s code %s for xid %s',
+                                msg.datapath.id, msg.type, msg.code, msg.xid)
+
+    def _batch_done(self, result):
+        if result.errors:
+            self.logger.warning('dpid %s: %d of %d messages failed: %s', result.dpid,
+                                len(result.errors), len(result.xids), result.errors)
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        self.shadow.removed(ev.msg.datapath.id, ev.msg)
+
+    # Every message to a switch goes through here so it gets counted. It is only
+    # queued, handlers flush the queues when they are done. Returns False if the
+    # message was a redundant flow_mod and got dropped.
+    def send_msg(self, datapath, msg):
+        if isinstance(msg, datapath.ofproto_parser.OFPFlowMod) and \
+                not self.shadow.flow_mod(datapath.id, msg):
+            self.metrics.flow_mod_suppressed.inc(datapath.id)
+            return False
+        self.metrics.count_sent(datapath, msg)
+        self.flows.add(datapath, msg)
+        return True
 
     # Add a flow entry to the flow-table
-    def add_flow(self, datapath, priority, match, actions):
+    @metrics.timed('add_flow')
+    def add_flow(self, datapath, priority, match, actions, idle_timeout=0, cookie=0,
+                 meter_id=None, table_id=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
         # Construct flow_mod message and send it
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
-        flow_mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                     match=match, instructions=inst)
-        datapath.send_msg(flow_mod)
+        if meter_id is not None:
+            inst.insert(0, parser.OFPInstructionMeter(meter_id))
+        # Flows that time out report their removal, that keeps the shadow table in sync
+        flags = ofproto.OFPFF_SEND_FLOW_REM if idle_timeout else 0
+        flow_mod = parser.OFPFlowMod(datapath=datapath, table_id=table_id, priority=priority,
+                                     match=match, instructions=inst,
+                                     idle_timeout=idle_timeout, flags=flags, cookie=cookie)
+        if self.send_msg(datapath, flow_mod) and self.trace.enabled:
+            self.trace.emit('flow_mod', dpid=datapath.id, priority=priority)
 
     # Handle the packet_in event
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
+        msg = ev.msg
+        if self.cluster is not None and not self.cluster.is_master(msg.datapath.id):
+            # Sent before the switch got the role request, its master handles it
+            return
+        self.metrics.packet_in.inc(msg.datapath.id)
+        if self.admission is not None and not admission.exempt(msg.data):
+            in_port = msg.match['in_port']
+            verdict = self.admission.check(msg.datapath.id, in_port, msg.data[6:12])
+            if verdict != admission.ADMIT:
+                self.metrics.packet_in_rejected.inc(msg.datapath.id)
+                if verdict == admission.BLOCK:
+                    self.block_source(msg.datapath, in_port, msg.data[6:12])
+                return
+        if self.dispatcher is not None:
+            self.dispatcher.dispatch(ev)
+        else:
+            self.handle_packet_in(ev)
+
+    @metrics.timed('packet_in')
+    def handle_packet_in(self, ev):
+        # Only the ethernet header is read here, no full decode of every layer
+        frame = classifier.classify(ev.msg.data)
+        if frame is None:
+            return
+        try:
+            if ev.msg.datapath.id == self.ROUTER_DPID:
+                self.router_handlers.get(frame.ethertype, self.ignore_handler)(ev, frame)
+            else:
+                self.switch_handlers.get(frame.ethertype, self.l2_handler)(ev, frame)
+        finally:
+            # Route flow, packet_out and ARP request leave in one write. The other
+            # switches' queues belong to their own shards.
+            self.flows.flush(ev.msg.datapath)
+
+    def ignore_handler(self, ev, frame):
+        pass
+
+    # Drop IPv6 packets (we use only ipv4 packages)
+    def ipv6_handler(self, ev, frame):
+        datapath = ev.msg.datapath
+        match = datapath.ofproto_parser.OFPMatch(eth_type=frame.ethertype)
+        actions = []
+        self.add_flow(datapath, 1, match, actions)
+        if self.trace.enabled:
+            self.trace.emit('ipv6_drop', dpid=datapath.id)
+
+    def l2_handler(self, ev, frame):
         msg = ev.msg  # openflow message between controller and switch
         datapath = msg.datapath  # datapath of openflow message
         ofproto = msg.datapath.ofproto  # Openflow protocol for the switch
         parser = msg.datapath.ofproto_parser  # Parser for the openflow protocol message
         in_port = msg.match['in_port']  # input port from the packet message
-        pkt = packet.Packet(msg.data)  # parse packet data from openflow message
-        ether_frame = pkt.get_protocol(ethernet.ethernet)  # ethernet protocol header
-        src_mac = ether_frame.src  # source MAC
-        dst_mac = ether_frame.dst  # Destination MAC
-        arp_pkt = pkt.get_protocol(arp.arp)
-        print("ARP: ", arp_pkt)
-
-        # Drop IPv6 packets (we use only ipv4 packages)
-        if pkt.get_protocol(ipv6.ipv6):
-            match = parser.OFPMatch(eth_type=ether_frame.ethertype)
-            actions = []
-            self.add_flow(datapath, 1, match, actions)
-            print("Dropped IPv6 Packet")
-            return
-
-        print("Source: ", src_mac)
-        print("Destination: ", dst_mac)
-        print("__________")
-        print("SwitchID: ", datapath.id)
-        print(self.mac_to_port)
-        print("__________")
-
-        print("************************************************")
-        print(pkt)
-        print("************************************************")
-
-        self.mac_to_port[datapath.id][src_mac] = in_port
-
-        if dst_mac == 'ff:ff:ff:ff:ff:ff':
-            out_port = ofproto.OFPP_FLOOD
-        elif dst_mac in self.mac_to_port[datapath.id]:
-            out_port = self.mac_to_port[datapath.id][datapath.id]
-        else:
-            out_port = ofproto.OFPP_FLOOD
+        src_mac = frame.src  # source MAC
+        dst_mac = frame.dst  # Destination MAC
+
+        if self.trace.enabled:
+            self.trace.emit('packet_in', dpid=datapath.id, in_port=in_port,
+                            src=src_mac, dst=dst_mac, type=frame.ethertype)
 
-        actions = [datapath.ofproto_parser.OFPActionOutput(out_port)]
+        moved_from = self.mac_table.learn(datapath.id, mac_table.mac_to_int(frame.src_raw), in_port)
+        if moved_from is not None:
+            self.station_moved(datapath, src_mac, moved_from, in_port)
 
-        # install a flow to avoid packet_in next time
-        if out_port != ofproto.OFPP_FLOOD:
-            self.add_flow(datapath, dst_mac, src_mac, actions)
+        if msg.cookie == self.BROADCAST_COOKIE:
+            # The switch copied it along the spanning tree, this copy was for learning
+            return
+
+        out_port = None
+        if not frame.is_broadcast():
+            out_port = self.mac_table.lookup(datapath.id, mac_table.mac_to_int(frame.dst_raw))
+        if out_port is None:
+            actions = self.flood_actions(datapath)
+        else:
+            actions = [datapath.ofproto_parser.OFPActionOutput(out_port)]
+
+            # install a flow to avoid packet_in next time
+            match = parser.OFPMatch(in_port=in_port, eth_src=src_mac, eth_dst=dst_mac)
+            self.add_flow(datapath, self.FLOW_PRIORITY, match, actions,
+                          idle_timeout=self.MAC_MAX_AGE, cookie=self.LEARNED_COOKIE,
+                          table_id=self.table(datapath, pipeline.L2))
 
         data = None
         if msg.buffer_id == ofproto.OFP_NO_BUFFER:
@@ -138,4 +918,136 @@ class LearningSwitch(app_manager.RyuApp):
         out = datapath.ofproto_parser.OFPPacketOut(
             datapath=datapath, buffer_id=msg.buffer_id, in_port=in_port,
             actions=actions, data=data)
-        datapath.send_msg(out)
+        self.send_msg(datapath, out)
+
+    # A station showed up on another port, the learned flows towards and from it are stale
+    def station_moved(self, datapath, mac, old_port, new_port):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        if self.trace.enabled:
+            self.trace.emit('station_move', dpid=datapath.id, mac=mac, old=old_port, new=new_port)
+        for match in (parser.OFPMatch(eth_dst=mac), parser.OFPMatch(eth_src=mac)):
+            self.send_msg(datapath, parser.OFPFlowMod(
+                datapath=datapath, table_id=self.table(datapath, pipeline.L2),
+                command=ofproto.OFPFC_DELETE,
+                cookie=self.LEARNED_COOKIE, cookie_mask=0xffffffffffffffff,
+                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY, match=match))
+
+    # Router packet_ins: answer ARP for the gateway addresses and route IPv4 by
+    # longest prefix match
+    def router_arp_packet_handler(self, ev, frame):
+        arp_pkt = frame.arp()
+        if arp_pkt is not None:
+            if self.trace.enabled:
+                self.trace.emit('arp', dpid=ev.msg.datapath.id, op=arp_pkt.opcode,
+                                src=arp_pkt.src_mac, src_ip=arp_pkt.src_ip, dst_ip=arp_pkt.dst_ip)
+            self.router_arp_handler(ev.msg.datapath, ev.msg.match['in_port'], arp_pkt)
+
+    def router_ip_handler(self, ev, frame):
+        msg = ev.msg
+        datapath = msg.datapath
+        ip_pkt = frame.ipv4()
+        if ip_pkt is None or ip_pkt.ttl <= 1:
+            return
+        if IPv4Address(ip_pkt.dst) in self.router.own_ips:
+            return
+
+        resolved = self.router.resolve(ip_pkt.dst)
+        if resolved is None:
+            if self.trace.enabled:
+                self.trace.emit('no_route', dpid=datapath.id, src_ip=ip_pkt.src, dst_ip=ip_pkt.dst)
+            return
+        route, next_hop, next_hop_mac = resolved
+
+        # A buffered packet stays on the switch, only its buffer_id is passed on
+        data = msg.data if msg.buffer_id == datapath.ofproto.OFP_NO_BUFFER else None
+        if next_hop_mac is None:
+            # Hold the packet until the next hop answers our ARP request
+            if self.router.arp.queue(next_hop, (route, ip_pkt.dst, data, msg.buffer_id)):
+                self.send_router_arp_request(datapath, route.port, next_hop)
+            return
+
+        self.install_route(datapath, route, ip_pkt.dst, next_hop_mac)
+        self.send_routed(datapath, route, next_hop_mac, data, msg.buffer_id)
+
+    @metrics.timed('arp')
+    def router_arp_handler(self, datapath, in_port, arp_pkt):
+        # Every ARP packet tells us the sender's MAC, release what was waiting for it
+        waiting = self.router.arp.learn(IPv4Address(arp_pkt.src_ip), arp_pkt.src_mac)
+        for route, dst_ip, data, buffer_id in waiting:
+            self.install_route(datapath, route, dst_ip, arp_pkt.src_mac)
+            self.send_routed(datapath, route, arp_pkt.src_mac, data, buffer_id)
+
+        target = IPv4Address(arp_pkt.dst_ip)
+        if arp_pkt.opcode == arp.ARP_REQUEST and target in self.router.own_ips:
+            own_mac = self.router.interface(self.router.own_ips[target])[0]
+            self.send_router_arp(datapath, in_port, arp.ARP_REPLY, own_mac, arp_pkt.dst_ip,
+                                 arp_pkt.src_mac, arp_pkt.src_ip)
+
+    def route_actions(self, parser, route, next_hop_mac):
+        own_mac = self.router.interface(route.port)[0]
+        return [parser.OFPActionSetField(eth_src=own_mac),
+                parser.OFPActionSetField(eth_dst=next_hop_mac),
+                parser.OFPActionDecNwTtl(),
+                parser.OFPActionOutput(route.port)]
+
+    # Offload the route to the switch, later packets never reach the controller
+    def install_route(self, datapath, route, dst_ip, next_hop_mac):
+        parser = datapath.ofproto_parser
+        prefix = self.router.flow_prefix(route, dst_ip)
+        match = parser.OFPMatch(eth_type=ether.ETH_TYPE_IP, ipv4_dst=prefix)
+        prefix_len = bin(int(IPv4Address(prefix[1]))).count("1")
+        actions = self.route_actions(parser, route, next_hop_mac)
+        table_id = self.table(datapath, pipeline.L3)
+        self.add_flow(datapath, self.ROUTE_PRIORITY + prefix_len, match, actions,
+                      idle_timeout=self.ROUTE_IDLE_TIMEOUT, cookie=self.ROUTE_COOKIE,
+                      table_id=table_id)
+        if self.firewall is not None and table_id == self.table(datapath, pipeline.ACL):
+            self.install_firewall_routes(datapath, prefix, actions)
+
+    # A single-table router routes the firewall's exceptions where they are allowed:
+    # every allow that reaches into the prefix gets the route, narrowed to it, one
+    # priority above the allow, so the levels above still override it. These flows
+    # are not rebuilt by reconcile, the next allowed packet puts them back.
+    def install_firewall_routes(self, datapath, prefix, actions):
+        parser = datapath.ofproto_parser
+        routed = IPv4Network('%s/%s' % prefix)
+        for level, fields, action in self.firewall.flows:
+            if action != firewall.ALLOW:
+                continue
+            fields = dict(fields)
+            allowed = fields.get('ipv4_dst', '0.0.0.0/0')
+            allowed = IPv4Network('%s/%s' % allowed if isinstance(allowed, tuple) else allowed)
+            if not routed.overlaps(allowed):
+                continue
+            dst = max(routed, allowed, key=lambda net: net.prefixlen)
+            fields['ipv4_dst'] = (str(dst.network_address), str(dst.netmask))
+            self.add_flow(datapath, self.firewall_priority(level) + 1, parser.OFPMatch(**fields),
+                          actions, idle_timeout=self.ROUTE_IDLE_TIMEOUT,
+                          cookie=self.ROUTE_COOKIE, table_id=self.table(datapath, pipeline.ACL))
+
+    def send_routed(self, datapath, route, next_hop_mac, data, buffer_id=None):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        if buffer_id is None:
+            buffer_id = ofproto.OFP_NO_BUFFER
+        out = parser.OFPPacketOut(datapath=datapath, buffer_id=buffer_id,
+                                  in_port=ofproto.OFPP_CONTROLLER,
+                                  actions=self.route_actions(parser, route, next_hop_mac),
+                                  data=data)
+        self.send_msg(datapath, out)
+
+    def send_router_arp_request(self, datapath, port, target_ip):
+        own_mac, own_iface = self.router.interface(port)
+        self.send_router_arp(datapath, port, arp.ARP_REQUEST, own_mac, str(own_iface.ip),
+                             '00:00:00:00:00:00', str(target_ip))
+
+    def send_router_arp(self, datapath, port, opcode, src_mac, src_ip, dst_mac, dst_ip):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        # The frame comes from the cache, nothing is built or serialized per packet
+        out = parser.OFPPacketOut(datapath=datapath, buffer_id=ofproto.OFP_NO_BUFFER,
+                                  in_port=ofproto.OFPP_CONTROLLER,
+                                  actions=[parser.OFPActionOutput(port)],
+                                  data=self.arp_frames.frame(opcode, src_mac, src_ip, dst_mac, dst_ip))
+        self.send_msg(datapath, out)
@@ -0,0 +1,231 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Bounded MAC learning table.
+#
+# Every switch keeps its stations in a few generations, plain dicts from the
+# MAC as a 48-bit int to the port, one per `max_age / GENERATIONS` seconds of
+# last-seen time. A generation stores no timestamps, its start stands in for
+# the time its stations were last seen. Learning a station puts it into the
+# newest generation and takes it out of the older one it was in. This keeps
+# the table at about the size of a single dict keyed by MAC. A dict with a
+# (port, seen) tuple per station, or an OrderedDict, costs twice as much.
+#
+# A table holds up to `capacity` stations. After that, stations of the oldest
+# generation are evicted, approximately LRU. A generation whose newest
+# possible station is older than `max_age` goes as a whole, so stations age
+# out after max_age plus at most one generation.
+#
+# learn() reports station moves so the caller can invalidate the flows that
+# still point at the old port.
+
+import time
+from collections import deque
+from itertools import islice
+
+
+def mac_to_int(mac):
+    # 'aa:bb:cc:dd:ee:ff' or the raw 6 bytes -> int
+    if isinstance(mac, str):
+        return int(mac.replace(':', ''), 16)
+    return int.from_bytes(mac, 'big')
+
+
+def int_to_mac(value):
+    return value.to_bytes(6, 'big').hex(':')
+
+
+GENERATIONS = 4  # per max_age
+EVICT_BATCH = 64  # a full table evicts 1/EVICT_BATCH of its stations at once
+
+
+class SwitchMacTable(object):
+    __slots__ = ('capacity', 'generations', 'count')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.generations = deque()  # [start, {mac: port}, size when last compacted], oldest first
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def generation(self, start):
+        # The stations of the generation starting at start, added in place if missing
+        if not self.generations or self.generations[-1][0] < start:
+            self.compact()
+        generations = self.generations
+        if not generations or generations[-1][0] < start:
+            generations.append([start, {}, 0])
+            return generations[-1][1]
+        for i, generation in enumerate(generations):
+            if generation[0] == start:
+                return generation[1]
+            if generation[0] > start:
+                generations.insert(i, [start, {}, 0])
+                return generations[i][1]
+
+    def compact(self):
+        # A dict keeps its size when stations leave it for a newer generation.
+        # Copying one that lost half its stations gives the memory back, empty
+        # ones go.
+        generations = deque(generation for generation in self.generations if generation[1])
+        for generation in generations:
+            if len(generation[1]) * 2 < generation[2]:
+                generation[1] = dict(generation[1])
+            generation[2] = len(generation[1])
+        self.generations = generations
+
+    def pop(self, mac):
+        # Takes mac out of the generation it is in, returns its port or None
+        for generation in self.generations:
+            port = generation[1].pop(mac, None)
+            if port is not None:
+                return port
+        return None
+
+    def evict(self):
+        # Drops the stations learned first into the oldest generation, the
+        # approximate LRU ones, and returns how many. A dict is scanned from the
+        # front past the stations deleted before, so a batch goes at once and
+        # the dict is compacted once it lost half of them.
+        generations = self.generations
+        while not generations[0][1]:
+            generations.popleft()
+        generation = generations[0]
+        stations = generation[1]
+        generation[2] = max(generation[2], len(stations))
+        victims = list(islice(stations, max(1, self.count // EVICT_BATCH)))
+        for mac in victims:
+            del stations[mac]
+        if len(stations) * 2 < generation[2]:
+            generation[1] = dict(stations)
+            generation[2] = len(stations)
+        self.count -= len(victims)
+        return len(victims)
+
+    def sweep(self, expired_before):
+        # Drops the generations that started before expired_before, returns how
+        # many stations they held
+        expired = 0
+        generations = self.generations
+        while generations and generations[0][0] < expired_before:
+            expired += len(generations.popleft()[1])
+        self.count -= expired
+        return expired
+
+
+class MacTable(object):
+
+    def __init__(self, capacity=8192, max_age=300, clock=time.monotonic):
+        self.capacity = capacity
+        self.max_age = max_age
+        self.clock = clock
+        self.span = float(max_age) / GENERATIONS  # seconds of last-seen time per generation
+        self.horizon = max_age + self.span  # a generation older than this is aged out
+        self.tables = {}  # dpid -> SwitchMacTable
+        self.moves = 0
+        self.evicted = 0
+
+    def add_switch(self, dpid):
+        # Stations restored before the switch connected are kept
+        if dpid not in self.tables:
+            self.tables[dpid] = SwitchMacTable(self.capacity)
+
+    def remove_switch(self, dpid):
+        self.tables.pop(dpid, None)
+
+    def _start(self, seen):
+        return seen - seen % self.span
+
+    def learn(self, dpid, mac, port):
+        # Returns the previous port if the station moved, else None
+        table = self.tables.get(dpid)
+        if table is None:
+            table = self.tables[dpid] = SwitchMacTable(self.capacity)
+        now = self.clock()
+        generations = table.generations
+        if not generations or now - generations[-1][0] >= self.span:
+            table.generation(self._start(now))
+            generations = table.generations
+        newest = generations[-1][1]
+        old = newest.get(mac)
+        if old is None:
+            if len(generations) > 1:
+                old = table.pop(mac)
+            if old is None:
+                if table.count >= table.capacity:
+                    self.evicted += table.evict()
+                    newest = table.generations[-1][1]
+                table.count += 1
+        newest[mac] = port
+        if old is None or old == port:
+            return None
+        self.moves += 1
+        return old
+
+    def lookup(self, dpid, mac):
+        # Port of mac on switch dpid, or None if unknown or aged out
+        table = self.tables.get(dpid)
+        if table is None:
+            return None
+        for generation in reversed(table.generations):
+            port = generation[1].get(mac)
+            if port is not None:
+                if self.clock() - generation[0] > self.horizon:
+                    self.expire_table(table)
+                    return None
+                return port
+        return None
+
+    def items(self):
+        # (dpid, mac, port, last seen) of every station, aged out ones included.
+        # Last seen is the start of the station's generation.
+        for dpid, table in self.tables.items():
+            for start, stations, _ in table.generations:
+                for mac, port in stations.items():
+                    yield dpid, mac, port, start
+
+    def restore(self, dpid, mac, port, seen):
+        # Put back a station from items(), unless it is too old by now
+        now = self.clock()
+        if seen < 0 or now - seen > self.horizon:
+            return False
+        table = self.tables.get(dpid)
+        if table is None:
+            table = self.tables[dpid] = SwitchMacTable(self.capacity)
+        if table.pop(mac) is None:
+            if table.count >= table.capacity:
+                self.evicted += table.evict()
+            table.count += 1
+        table.generation(self._start(min(seen, now)))[mac] = port
+        return True
+
+    def ports(self, dpid):
+        # Ports with at least one station behind them
+        table = self.tables.get(dpid)
+        if table is None:
+            return set()
+        return set(port for _, stations, _ in table.generations for port in stations.values())
+
+    def expire_table(self, table):
+        return table.sweep(self.clock() - self.horizon)
+
+    def expire(self):
+        return sum(self.expire_table(table) for table in self.tables.values())
+
+    def __len__(self):
+        return sum(len(table) for table in self.tables.values())
@@ -0,0 +1,228 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# In-process controller metrics rendered in the Prometheus text format:
+# labelled counters, gauges (set directly or read from a callback at scrape
+# time) and HDR-style latency histograms.
+
+import functools
+import time
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, v) for k, v in pairs)
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # label values -> count
+
+    def inc(self, *label_values, **kwargs):
+        key = label_values
+        self.values[key] = self.values.get(key, 0) + kwargs.get('n', 1)
+
+    def get(self, *label_values):
+        return self.values.get(label_values, 0)
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield self.name + _labels(self.labels, key), value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), callback=None):
+        super(Gauge, self).__init__(name, help, labels)
+        # callback() -> {label values: value}, evaluated on every scrape
+        self.callback = callback
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+    def samples(self):
+        values = self.callback() if self.callback is not None else self.values
+        for key, value in sorted(values.items()):
+            yield self.name + _labels(self.labels, key), value
+
+
+class Histogram(object):
+    # Log-linear buckets as in HdrHistogram: values below 2**SUB_BITS are exact,
+    # above that every power of two is split into 2**SUB_BITS linear buckets, which
+    # bounds the relative error of every bucket to 1 / 2**SUB_BITS (about 6%).
+    # Recording is one bit_length() and a dict update. Values are kept in
+    # microseconds and exported in seconds as a Prometheus summary.
+
+    kind = 'summary'
+    SUB_BITS = 4
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self, name, help, labels=(), scale=1e6):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.scale = scale
+        self.series = {}  # label values -> [count, sum, {bucket index: count}]
+
+    def _index(self, v):
+        sub = 1 << self.SUB_BITS
+        if v < sub:
+            return v
+        shift = v.bit_length() - self.SUB_BITS - 1
+        return sub + shift * sub + ((v >> shift) - sub)
+
+    def _bounds(self, index):
+        sub = 1 << self.SUB_BITS
+        if index < sub:
+            return index, index + 1
+        shift, m = divmod(index - sub, sub)
+        return (sub + m) << shift, (sub + m + 1) << shift
+
+    def observe(self, seconds, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0, 0.0, {}]
+        series[0] += 1
+        series[1] += seconds
+        index = self._index(max(0, int(seconds * self.scale)))
+        buckets = series[2]
+        buckets[index] = buckets.get(index, 0) + 1
+
+    def quantile(self, q, *label_values):
+        series = self.series.get(label_values)
+        if not series or not series[0]:
+            return 0.0
+        rank = q * series[0]
+        seen = 0
+        for index in sorted(series[2]):
+            seen += series[2][index]
+            if seen >= rank:
+                low, high = self._bounds(index)
+                return (low + high) / 2.0 / self.scale
+        return 0.0
+
+    def count(self, *label_values):
+        series = self.series.get(label_values)
+        return series[0] if series else 0
+
+    def samples(self):
+        for key, (count, total, _) in sorted(self.series.items()):
+            for q in self.QUANTILES:
+                yield self.name + _labels(self.labels, key, ('quantile', q)), self.quantile(q, *key)
+            yield self.name + '_sum' + _labels(self.labels, key), total
+            yield self.name + '_count' + _labels(self.labels, key), count
+
+
+class Registry(object):
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(self.prefix + name, help, labels))
+
+    def gauge(self, name, help, labels=(), callback=None):
+        return self._add(Gauge(self.prefix + name, help, labels, callback))
+
+    def histogram(self, name, help, labels=()):
+        return self._add(Histogram(self.prefix + name, help, labels))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, value in metric.samples():
+                lines.append('%s %s' % (name, repr(float(value)) if isinstance(value, float) else value))
+        return '\n'.join(lines) + '\n'
+
+
+class ControllerMetrics(object):
+    # The metric set shared by the LearningSwitch apps. The app needs the usual
+    # events queue and a datapaths dict of dpid -> Datapath.
+
+    def __init__(self, app):
+        self.registry = Registry('ans_')
+        self.packet_in = self.registry.counter(
+            'packet_in_total', 'Packet-ins received', ('dpid',))
+        self.flow_mod = self.registry.counter(
+            'flow_mod_total', 'Flow-mods sent', ('dpid',))
+        self.flow_mod_suppressed = self.registry.counter(
+            'flow_mod_suppressed_total', 'Redundant flow-mods not sent', ('dpid',))
+        self.packet_in_rejected = self.registry.counter(
+            'packet_in_rejected_total', 'Packet-ins over the rate limit of their switch port', ('dpid',))
+        self.packet_in_dropped = self.registry.counter(
+            'packet_in_dropped_total', 'Packet-ins dropped because their worker queue was full', ('dpid',))
+        self.flows_reconciled = self.registry.counter(
+            'flows_reconciled_total', 'Flows found on a connecting switch, kept or deleted',
+            ('dpid', 'result'))
+        self.packet_out = self.registry.counter(
+            'packet_out_total', 'Packet-outs sent', ('dpid',))
+        self.handler_seconds = self.registry.histogram(
+            'handler_seconds', 'Time spent in controller handlers', ('handler',))
+        self.registry.gauge(
+            'event_queue_depth', 'OpenFlow events waiting in the app queue',
+            callback=lambda: {(): app.events.qsize()})
+        self.registry.gauge(
+            'send_queue_depth', 'Messages waiting to be written to the switch', ('dpid',),
+            callback=lambda: dict(((dpid,), dp.send_q.qsize()) for dpid, dp in app.datapaths.items()
+                                  if hasattr(dp, 'send_q')))
+        self.registry.gauge(
+            'worker_queue_depth', 'Packet-ins waiting for their dispatch worker', ('worker',),
+            callback=lambda: dict(((i,), depth) for i, depth in enumerate(
+                app.dispatcher.depths() if getattr(app, 'dispatcher', None) else ())))
+        self.registry.gauge(
+            'stats_interval_seconds', 'Current interval of the port and flow stats poller',
+            callback=lambda: {(): app.stats.interval} if getattr(app, 'stats', None) else {})
+        self.registry.gauge(
+            'port_tx_bits_per_second', 'Transmit rate of switch ports from port stats', ('dpid', 'port'),
+            callback=lambda: app.stats.ports.latest() if getattr(app, 'stats', None) else {})
+
+    def count_sent(self, datapath, msg):
+        parser = datapath.ofproto_parser
+        if isinstance(msg, parser.OFPFlowMod):
+            self.flow_mod.inc(datapath.id)
+        elif isinstance(msg, parser.OFPPacketOut):
+            self.packet_out.inc(datapath.id)
+
+
+def timed(handler):
+    # Method decorator recording the call duration in self.metrics.handler_seconds
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self.metrics.handler_seconds.observe(time.perf_counter() - start, handler)
+        return wrapper
+    return decorator
@@ -0,0 +1,42 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Serves an app's metrics.Registry on ryu's built-in WSGI server:
+#
+#   curl http://127.0.0.1:8080/metrics
+#
+# The port is ryu-manager's --wsapi-port.
+
+from ryu.app.wsgi import ControllerBase, route
+from webob import Response
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+class MetricsController(ControllerBase):
+
+    def __init__(self, req, link, data, **config):
+        super(MetricsController, self).__init__(req, link, data, **config)
+        self.registry = data['registry']
+
+    @route('metrics', '/metrics', methods=['GET'])
+    def metrics(self, req, **kwargs):
+        return Response(content_type=CONTENT_TYPE, charset='utf-8',
+                        text=self.registry.render())
+
+
+def register(wsgi, registry):
+    wsgi.register(MetricsController, {'registry': registry})
@@ -0,0 +1,156 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# OpenFlow select groups for the ('select', ports) actions of the planner.
+#
+# Every switch gets one group per distinct set of equal-cost ports, shared by
+# all rules that use that set, so a fabric needs a handful of groups however
+# many destinations it has. The switch hashes every flow onto one bucket, a
+# bucket per port with a weight from the link bandwidth (TCLink bw, Mbit/s).
+# Group ids stay fixed while a port set is in use: rebalancing only modifies
+# the buckets, the flows pointing at the group are never touched.
+#
+# Rebalancing weighs a bucket by the headroom of its link, capacity minus the
+# transmit rate the stats poller measured (stats.py), and only sends a modify
+# once some weight moved by more than a threshold.
+#
+# A group in use must be added before the flows that point to it and deleted
+# only after them, since deleting a group also deletes its flows. push order:
+# group adds, flow_mods, group deletes.
+
+WEIGHT_UNIT = 0.1  # Mbit/s per unit of bucket weight
+MIN_SHARE = 0.05   # a loaded link keeps at least this share of its capacity as weight
+DEFAULT_WEIGHT = 1
+
+
+class Group(object):
+    __slots__ = ('group_id', 'ports', 'weights', 'users')
+
+    def __init__(self, group_id, ports, weights):
+        self.group_id = group_id
+        self.ports = ports
+        self.weights = weights
+        self.users = 0  # rules pointing to the group
+
+
+def select_ports(actions):
+    # Port set of a ('select', ports) action, None for other actions
+    for action in actions:
+        if action[0] == 'select':
+            return action[1]
+    return None
+
+
+def bucket_weights(capacities, rates=None):
+    # Weights for links of capacities (Mbit/s, None if unknown) carrying rates
+    # (bit/s, None if not measured). Without every capacity all buckets weigh the same.
+    if any(c is None for c in capacities):
+        return (DEFAULT_WEIGHT,) * len(capacities)
+    weights = []
+    for i, capacity in enumerate(capacities):
+        load = (rates[i] or 0) / 1e6 if rates is not None else 0
+        headroom = max(capacity * MIN_SHARE, capacity - load)
+        weights.append(max(1, min(0xffff, int(round(headroom / WEIGHT_UNIT)))))
+    return tuple(weights)
+
+
+class GroupTable(object):
+
+    def __init__(self, weights, threshold=0.2):
+        self.weights = weights      # weights(dpid, ports) -> tuple, one per port
+        self.threshold = threshold  # relative weight change that triggers a modify
+        self.groups = {}  # dpid -> {ports: Group}
+        self.users = {}   # dpid -> {(match, priority): ports}
+        self.next_id = {}
+
+    def update(self, dpid, adds, removes):
+        # Track the planner rules going to a switch. Returns the groups to add
+        # before and to delete after the rules are sent.
+        groups = self.groups.setdefault(dpid, {})
+        users = self.users.setdefault(dpid, {})
+        created, released = [], []
+        for rules, remove in ((removes, True), (adds, False)):
+            for match, priority, actions in rules:
+                key = (match, priority)
+                ports = None if remove else select_ports(actions)
+                old = users.pop(key, None)
+                if ports is not None:
+                    users[key] = ports
+                    group = groups.get(ports)
+                    if group is None:
+                        group = groups[ports] = Group(self._allocate(dpid), ports,
+                                                      self.weights(dpid, ports))
+                        created.append(group)
+                    group.users += 1
+                if old is not None:
+                    group = groups[old]
+                    group.users -= 1
+                    if not group.users:
+                        released.append(group)
+        unused = [g for g in dict.fromkeys(released) if not g.users]
+        for group in unused:
+            del groups[group.ports]
+        return created, unused
+
+    def resolve(self, dpid, actions):
+        # Planner actions with ('select', ports) replaced by ('group', group_id)
+        return tuple(('group', self.groups[dpid][a[1]].group_id) if a[0] == 'select' else a
+                     for a in actions)
+
+    def rebalance(self, dpid):
+        # Groups of a switch whose weights changed enough, with the new weights set
+        changed = []
+        for group in self.groups.get(dpid, {}).values():
+            weights = self.weights(dpid, group.ports)
+            top = max(max(group.weights), 1)
+            if any(abs(new - old) > self.threshold * top for new, old in zip(weights, group.weights)):
+                group.weights = weights
+                changed.append(group)
+        return changed
+
+    def disconnect(self, dpid):
+        self.groups.pop(dpid, None)
+        self.users.pop(dpid, None)
+        self.next_id.pop(dpid, None)
+
+    def _allocate(self, dpid):
+        # Ids are not reused while the switch is connected, so an add never meets
+        # a group the same batch still has to delete
+        group_id = self.next_id.get(dpid, 1)
+        self.next_id[dpid] = group_id + 1
+        return group_id
+
+    def __len__(self):
+        return sum(len(groups) for groups in self.groups.values())
+
+
+def group_mod(datapath, command, group):
+    # OFPGroupMod adding, modifying (command) or deleting a select group
+    ofproto = datapath.ofproto
+    parser = datapath.ofproto_parser
+    buckets = []
+    if command != ofproto.OFPGC_DELETE:
+        # watch_port lets the switch skip the bucket of a port that is down
+        buckets = [parser.OFPBucket(weight=weight, watch_port=port, watch_group=ofproto.OFPG_ANY,
+                                    actions=[parser.OFPActionOutput(port)])
+                   for port, weight in zip(group.ports, group.weights)]
+    return parser.OFPGroupMod(datapath, command, ofproto.OFPGT_SELECT, group.group_id, buckets)
+
+
+def delete_all(datapath):
+    # Removes every group of a switch, and with them every flow pointing to one
+    ofproto = datapath.ofproto
+    return datapath.ofproto_parser.OFPGroupMod(datapath, ofproto.OFPGC_DELETE, 0, ofproto.OFPG_ALL)
@@ -14,144 +14,1048 @@
  limitations under the License.
  """
 
+import os
+import sys
+import time
+
+from ryu.app.wsgi import WSGIApplication
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
-from ryu.lib.packet import packet, ethernet, ipv6, arp
+from ryu.lib import hub
+from ryu.lib.packet import arp
 from ryu.ofproto import ofproto_v1_3, ether
 
+# The shared controller modules live in lab1/
+LAB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, LAB_DIR)
+
+from topology import Topology
+from proactive import ProactivePlanner
+import arp_proxy
+import admission
+import arp_frames
+import classifier
+import cluster
+import discovery
+import dispatcher
+import flow_compiler
+import flow_programmer
+import mac_table
+import multipath
+import pipeline
+import reconcile
+import shadow_table
+import spanning_tree
+import state_log
+import stats
+import tracing
+import metrics
+import metrics_api
+
 
 class LearningSwitch(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
+    _CONTEXTS = {
+        'wsgi': WSGIApplication,
+    }
+
+    # Priority, timeouts (in seconds, 0 = never) and cookie of the learned L2 flows
+    FLOW_PRIORITY = 10
+    FLOW_IDLE_TIMEOUT = 30
+    FLOW_HARD_TIMEOUT = 300
+    LEARNED_COOKIE = 0x1
+
+    # MAC learning: stations per switch and seconds until an unseen station is forgotten
+    MAC_TABLE_CAPACITY = 8192
+    MAC_MAX_AGE = 300
+
+    # Proactive mode pushes shortest path flows computed from the topology description
+    # as soon as a switch connects, instead of waiting for packet_ins
+    PROACTIVE = False
+    TOPOLOGY_FILE = os.path.join(LAB_DIR, 'topology.json')
+    # Aggregate the per-destination proactive rules into prefix rules, see flow_compiler.py
+    COMPILE_FLOWS = True
+    # Spread proactive traffic over all equal-cost paths with select groups weighted
+    # by link bandwidth, and rebalance the weights whenever new port stats are in,
+    # see multipath.py
+    MULTIPATH = True
+    REBALANCE_THRESHOLD = 0.2
+
+    # Port stats of every switch are polled every STATS_INTERVAL seconds, flow stats
+    # every STATS_FLOWS_EVERY rounds; the interval adapts between STATS_MIN_INTERVAL
+    # and STATS_MAX_INTERVAL, see stats.py. 0 polls nothing.
+    STATS_INTERVAL = 5
+    STATS_MIN_INTERVAL = 1
+    STATS_MAX_INTERVAL = 30
+    STATS_FLOWS_EVERY = 3
+
+    # LLDP link discovery: every switch port is probed every DISCOVERY_INTERVAL
+    # seconds, at most DISCOVERY_RATE probes per second in total, and a link is down
+    # once DISCOVERY_MISSES rounds of probes got lost, see discovery.py. Probes come
+    # back to the controller through an LLDP_PRIORITY flow.
+    DISCOVERY = True
+    DISCOVERY_INTERVAL = 5
+    DISCOVERY_RATE = 500
+    DISCOVERY_MISSES = 3
+    DISCOVERY_TICK = 0.1
+    LLDP_PRIORITY = 0xffff
+
+    # Broadcasts follow a spanning tree of the discovered links: every switch copies
+    # them to its tree and edge ports with an OFPGT_ALL group instead of OFPP_FLOOD,
+    # see spanning_tree.py. Needs DISCOVERY.
+    BROADCAST_TREE = True
+    BROADCAST_PRIORITY = 5
+    BROADCAST_COOKIE = 0x4
+
+    # ARP proxy: cache lifetime and size, and how often one target may be flooded
+    ARP_TTL = 300
+    ARP_CAPACITY = 4096
+    ARP_FLOOD_INTERVAL = 1.0
+    ARP_EXPIRE_INTERVAL = 10
+
+    # Wrap rule batches (switch connect, topology changes) in an ONF bundle so the
+    # switch applies them atomically. Needs OVS, plain batches end with a barrier.
+    BUNDLE_RULES = False
+
+    # Packet_ins are handled by this many workers, sharded by dpid so a busy switch
+    # does not hold up the others. 0 handles them inline on ryu's event loop. The
+    # workers are hub threads, they share one core, see dispatcher.py.
+    PACKET_IN_WORKERS = 0
+    PACKET_IN_QUEUE = 1024
+
+    # Admission control: packet_ins per second (and burst) taken from one switch port.
+    # A source rejected OFFENDER_REJECTS times within OFFENDER_WINDOW seconds is dropped
+    # at the switch for BLOCK_TIMEOUT seconds. PACKET_IN_RATE = 0 turns it off.
+    PACKET_IN_RATE = 200
+    PACKET_IN_BURST = 400
+    OFFENDER_REJECTS = 100
+    OFFENDER_WINDOW = 1.0
+    BLOCK_PRIORITY = 1000
+    BLOCK_TIMEOUT = 10
+    BLOCK_COOKIE = 0x2
+
+    # Meter on the table-miss entry and the flows that punt broadcasts, in packets
+    # per second, used if the switch has meters
+    TABLE_MISS_METER_ID = 1
+    TABLE_MISS_METER_RATE = 1000
+    TABLE_MISS_METER_BURST = 200
+
+    # Let the switch buffer table-miss packets and send only the first
+    # BUFFER_MISS_LEN bytes, packet_outs then refer to the buffer_id. Switches
+    # without buffers (OVS) keep sending whole packets.
+    BUFFER_PACKETS = False
+    BUFFER_MISS_LEN = 128
+
+    # Prebuilt ARP frames kept for packet_outs, see arp_frames.py
+    ARP_FRAME_CACHE = 4096
+
+    # Learned stations, ARP bindings and known switches are logged to STATE_FILE
+    # every STATE_SYNC_INTERVAL seconds and loaded again on start, see state_log.py.
+    # Set by ANS_STATE (e.g. /tmp/ans_controller.state), None keeps nothing across restarts.
+    STATE_FILE = os.environ.get('ANS_STATE')
+    STATE_SYNC_INTERVAL = 5
+
+    # A connecting switch keeps the flows that agree with the controller state
+    # instead of being reprogrammed from scratch, see reconcile.py
+    RECONCILE_FLOWS = True
+
+    # Program switches with the multi-table pipeline of pipeline.py if their table
+    # features allow it, else everything goes to table 0
+    MULTI_TABLE = True
+
+    # Cluster mode: several controller processes share the switches, one programs
+    # each switch and the others take over when it goes away, see cluster.py.
+    # ANS_CLUSTER is 'memory' or host:port of the cluster store, ANS_NODE names this
+    # process. The state_log state is replicated every CLUSTER_SYNC_INTERVAL seconds.
+    CLUSTER = os.environ.get('ANS_CLUSTER')
+    NODE_ID = os.environ.get('ANS_NODE', str(os.getpid()))
+    CLUSTER_SYNC_INTERVAL = 2
+
     def __init__(self, *args, **kwargs):
         super(LearningSwitch, self).__init__(*args, **kwargs)
-        self.mac_to_port = {}
-        self.arp_table = {}
+        self.mac_table = mac_table.MacTable(self.MAC_TABLE_CAPACITY, self.MAC_MAX_AGE)
         self.datapaths = {}
 
+        # Router port MACs and gateway IP addresses, ARP for them is answered by the controller
+        self.port_to_own_mac = {
+            1: "00:00:00:00:01:01",
+            2: "00:00:00:00:01:02",
+            3: "00:00:00:00:01:03"
+        }
+        self.port_to_own_ip = {
+            1: "10.0.1.1",
+            2: "10.0.2.1",
+            3: "192.168.1.1"
+        }
+        self.arp_proxy = arp_proxy.ArpProxy(
+            ttl=self.ARP_TTL, capacity=self.ARP_CAPACITY,
+            flood_interval=self.ARP_FLOOD_INTERVAL,
+            gateways=dict((self.port_to_own_ip[port], mac)
+                          for port, mac in self.port_to_own_mac.items()))
+        self.threads.append(hub.spawn(self._expire_loop))
+
+        # EtherType -> packet_in handler, everything else is switched at L2
+        self.ethertype_handlers = {
+            classifier.ETH_TYPE_IPV6: self.ipv6_handler,
+            classifier.ETH_TYPE_ARP: self.arp_packet_handler,
+        }
+
         # Here you can initialize the data structures you want to keep at the controller
+        self.trace = tracing.EventLog.from_env()
+        # Prometheus metrics on http://<controller>:8080/metrics
+        self.metrics = metrics.ControllerMetrics(self)
+        if 'wsgi' in kwargs:
+            metrics_api.register(kwargs['wsgi'], self.metrics.registry)
+        # Messages are queued per datapath and written out in one buffer, see send_msg
+        self.flows = flow_programmer.FlowProgrammer()
+        # What is installed on every switch, identical flow_mods are not sent twice
+        self.shadow = shadow_table.ShadowTable()
+        self.dispatcher = None
+        if self.PACKET_IN_WORKERS:
+            self.dispatcher = dispatcher.ShardedDispatcher(
+                self.handle_packet_in, self.PACKET_IN_WORKERS, self.PACKET_IN_QUEUE,
+                on_drop=self.metrics.packet_in_dropped.inc)
+            self.threads.extend(self.dispatcher.threads)
+        self.arp_frames = arp_frames.ArpFrames(self.ARP_FRAME_CACHE)
+        self.admission = None
+        if self.PACKET_IN_RATE:
+            self.admission = admission.AdmissionControl(
+                self.PACKET_IN_RATE, self.PACKET_IN_BURST,
+                self.OFFENDER_REJECTS, self.OFFENDER_WINDOW)
+        self.planner = None
+        self.compiler = None
+        self.groups = None
+        if self.PROACTIVE:
+            self.planner = ProactivePlanner(Topology.load(self.TOPOLOGY_FILE), self.MULTIPATH)
+            if self.COMPILE_FLOWS:
+                self.compiler = flow_compiler.FlowCompiler()
+            if self.MULTIPATH:
+                self.groups = multipath.GroupTable(self.bucket_weights, self.REBALANCE_THRESHOLD)
+        self.stats = None
+        if self.STATS_INTERVAL:
+            self.stats = stats.StatsPoller(
+                self.send_msg, self.flows.flush_all, self.programmed,
+                capacity=self.port_capacity, interval=self.STATS_INTERVAL,
+                min_interval=self.STATS_MIN_INTERVAL, max_interval=self.STATS_MAX_INTERVAL,
+                flows_every=self.STATS_FLOWS_EVERY, on_ports=self.rebalance)
+            self.threads.append(hub.spawn(self.stats.run))
+        self.discovery = None
+        if self.DISCOVERY:
+            self.discovery = discovery.Discovery(self.DISCOVERY_INTERVAL, self.DISCOVERY_RATE,
+                                                 self.DISCOVERY_MISSES)
+            self.discovery.subscribe(self.link_event)
+            self.ethertype_handlers[classifier.ETH_TYPE_LLDP] = self.lldp_handler
+            self.threads.append(hub.spawn(self._discovery_loop))
+        self.broadcast = None
+        if self.discovery is not None and self.BROADCAST_TREE:
+            self.broadcast = spanning_tree.BroadcastTree(self.discovery)
+            self.discovery.subscribe(self.broadcast.update)
+        self.dumps = reconcile.FlowDump()
+        self.features = pipeline.TableFeatures()
+        self.tables = {}  # dpid -> pipeline.TABLES or pipeline.FLAT
+        self.metered = set()  # dpids with the table-miss meter installed
+        self.switches = {}  # dpid -> when it last connected (wall clock)
+        self.state_log = None
+        if self.STATE_FILE:
+            self.state_log = state_log.StateLog(self.STATE_FILE)
+            self.rehydrate(self.state_log.load())
+            self.threads.append(hub.spawn(self._state_loop))
+        self.cluster = None
+        if self.CLUSTER:
+            self.cluster = cluster.Cluster(cluster.connect(self.CLUSTER), self.NODE_ID,
+                                           self.role_changed, self.restore, ('mac', 'arp'),
+                                           on_message=self.cluster_message)
+            self.cluster.join()
+            self.threads.append(hub.spawn(self._cluster_loop))
+
+    def close(self):
+        if self.state_log is not None:
+            self.state_log.sync(self.snapshot())
+            self.state_log.close()
+        if self.cluster is not None:
+            self.cluster.close()
+        self.trace.close()
+        super(LearningSwitch, self).close()
+
+    # Controller state as logged by state_log, times on the wall clock
+    def snapshot(self):
+        return {
+            'mac': dict(((dpid, mac), (port, state_log.wall_time(seen)))
+                        for dpid, mac, port, seen in self.mac_table.items()),
+            'arp': dict((ip, (mac, state_log.wall_time(expiry)))
+                        for ip, mac, expiry in self.arp_proxy.items()),
+            'switch': dict(self.switches),
+        }
+
+    def rehydrate(self, state):
+        stations = sum(self.restore('mac', key, value) for key, value in state.get('mac', {}).items())
+        bindings = sum(self.restore('arp', key, value) for key, value in state.get('arp', {}).items())
+        self.switches.update(state.get('switch', {}))
+        self.logger.info('restored %d stations, %d ARP bindings and %d switches from %s',
+                         stations, bindings, len(self.switches), self.STATE_FILE)
+
+    # Put back one record of snapshot(), from the state log or another cluster node
+    def restore(self, namespace, key, value):
+        if namespace == 'mac':
+            (dpid, mac), (port, seen) = key, value
+            return self.mac_table.restore(dpid, mac, port, state_log.monotonic_time(seen))
+        if namespace == 'arp':
+            mac, expiry = value
+            return self.arp_proxy.restore(key, mac, state_log.monotonic_time(expiry))
+        return False
+
+    def _state_loop(self):
+        while True:
+            hub.sleep(self.STATE_SYNC_INTERVAL)
+            try:
+                self.state_log.sync(self.snapshot())
+            except OSError as e:
+                self.logger.warning('cannot write %s: %s', self.STATE_FILE, e)
+
+    def _cluster_loop(self):
+        while True:
+            hub.sleep(self.CLUSTER_SYNC_INTERVAL)
+            self.cluster.publish(self.snapshot())
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
+        self.mac_table.add_switch(datapath.id)
+        self.datapaths[datapath.id] = datapath
+        self.switches[datapath.id] = int(time.time())
+
+        if self.cluster is not None:
+            # Programmed once the cluster makes this node master. The role request
+            # waits for the switch's owner to be known, see role_changed.
+            self.cluster.connect(datapath.id)
+        else:
+            self.take_over(datapath)
+
+    # Start programming a switch, once its table features are known
+    def take_over(self, datapath):
+        if self.MULTI_TABLE:
+            # Nothing is installed until the switch told which pipeline it can run
+            self.send_msg(datapath, self.features.request(datapath))
+            self.flows.flush(datapath)
+        else:
+            self.program(datapath)
+
+    @set_ev_cls(ofp_event.EventOFPTableFeaturesStatsReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def table_features_handler(self, ev):
+        datapath = ev.msg.datapath
+        features = self.features.reply(ev.msg)
+        if features is None or self.datapaths.get(datapath.id) is not datapath:
+            return
+        problems = pipeline.validate(datapath.ofproto, features)
+        if problems:
+            self.logger.warning('dpid %s: single table, the pipeline does not fit: %s',
+                                datapath.id, '; '.join(problems))
+        self.tables[datapath.id] = pipeline.FLAT if problems else pipeline.TABLES
+        self.program(datapath)
+
+    # Table of a switch a kind of flow goes to, see pipeline.py
+    def table(self, datapath, name):
+        return self.tables.get(datapath.id, pipeline.FLAT)[name]
+
+    # Reconcile a switch with what it has or install from scratch
+    def program(self, datapath):
+        if self.RECONCILE_FLOWS:
+            # Nothing is installed until the dump of what the switch already has is back
+            self.send_msg(datapath, self.dumps.request(datapath))
+            self.flows.flush(datapath)
+        else:
+            self.install(datapath)
+
+    # Program a switch: table-miss entry, its meter and the proactive rules. Returns
+    # the flow_key()s of the rules it installs.
+    def install(self, datapath):
+        parser = datapath.ofproto_parser
+
+        # Initial flow entry for matching misses. It gets a meter once the switch
+        # reports meter support, until then (or without meters) it is unlimited.
+        self.add_table_miss(datapath)
+        if self.TABLE_MISS_METER_RATE:
+            self.send_msg(datapath, parser.OFPMeterFeaturesStatsRequest(datapath, 0))
+        installed = set(self.add_pipeline(datapath))
+        if self.discovery is not None:
+            installed.add(self.add_discovery_flow(datapath))
+        if self.groups is not None:
+            # Groups left by an earlier run are unknown here, they go (with their
+            # flows) and the rules below create them again
+            self.groups.disconnect(datapath.id)
+            self.send_msg(datapath, multipath.delete_all(datapath))
+        if self.broadcast is not None:
+            installed.update(self.add_broadcast(datapath))
+
+        # The table-miss entry and all proactive rules go out in one batch
+        if self.planner is not None:
+            adds, removes = self.compiled(datapath.id, *self.planner.install_all(datapath.id),
+                                          connected=True)
+            tables = self.tables.get(datapath.id, pipeline.FLAT)
+            installed.update((pipeline.rule_table(tables, match), priority,
+                              shadow_table.match_key(parser.OFPMatch(**dict(match))))
+                             for match, priority, _ in adds)
+            self.push_rules(datapath, adds, removes)
+        else:
+            self.flows.flush(datapath, barrier=True, callback=self._batch_done)
+        return installed
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def flow_stats_handler(self, ev):
+        if self.stats is not None and self.stats.flow_reply(ev.msg):
+            return
+        stats = self.dumps.reply(ev.msg)
+        if stats is not None and self.datapaths.get(ev.msg.datapath.id) is ev.msg.datapath:
+            self.reconcile(ev.msg.datapath, stats)
+
+    # Take over the flows a switch already has: the shadow table starts from the
+    # dump, so rules that are already there are not sent again, and only the
+    # flows that contradict the controller state are deleted
+    def reconcile(self, datapath, stats):
+        if self.groups is not None or self.broadcast is not None:
+            # install() deletes the groups, and the switch every flow pointing to one
+            stats = [stat for stat in stats if not reconcile.uses_group(datapath, stat)]
+        self.shadow.seed(datapath.id, stats)
+        installed = self.install(datapath)
+        stale = [stat for stat in stats if not self.flow_valid(datapath, stat, installed)]
+        for stat in stale:
+            self.send_msg(datapath, reconcile.delete_strict(datapath, stat))
+        self.flows.flush(datapath, barrier=True, callback=self._batch_done)
+
+        self.metrics.flows_reconciled.inc(datapath.id, 'kept', n=len(stats) - len(stale))
+        self.metrics.flows_reconciled.inc(datapath.id, 'deleted', n=len(stale))
+        self.logger.info('dpid %s: kept %d of %d installed flows', datapath.id,
+                         len(stats) - len(stale), len(stats))
+        if self.trace.enabled:
+            self.trace.emit('reconcile', dpid=datapath.id, flows=len(stats), deleted=len(stale))
+
+    def flow_valid(self, datapath, stat, installed):
+        if shadow_table.flow_key(stat) in installed:
+            return True
+        if stat.cookie == self.LEARNED_COOKIE:
+            return reconcile.learned_flow_valid(datapath, stat, self.mac_table)
+        if stat.cookie == self.BLOCK_COOKIE:
+            # Gone with its hard timeout
+            return True
+        # The IPv6 drop holds on every switch, any other rule is from some older state
+        return dict(stat.match.items()) == {'eth_type': classifier.ETH_TYPE_IPV6}
+
+    # Table-miss entries passing packets down the pipeline, and the IPv6 drop of the
+    # classifier. Returns their flow_key()s and the one of the table-miss entry.
+    def add_pipeline(self, datapath):
+        parser = datapath.ofproto_parser
+        installed = [(self.table(datapath, pipeline.L2), 0, ())]
+        for table_id, next_id in pipeline.gotos(self.tables.get(datapath.id, pipeline.FLAT)):
+            self.send_msg(datapath, parser.OFPFlowMod(
+                datapath=datapath, table_id=table_id, priority=0, match=parser.OFPMatch(),
+                instructions=[parser.OFPInstructionGotoTable(next_id)]))
+            installed.append((table_id, 0, ()))
+        table_id = self.table(datapath, pipeline.CLASSIFIER)
+        match = parser.OFPMatch(eth_type=classifier.ETH_TYPE_IPV6)
+        self.add_flow(datapath, 1, match, [], table_id=table_id)
+        installed.append((table_id, 1, shadow_table.match_key(match)))
+        return installed
+
+    # Discovery probes go to the controller past the metered table-miss entry, and
+    # the switch is asked for its ports to probe. Returns the flow_key() of the flow.
+    def add_discovery_flow(self, datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        table_id = self.table(datapath, pipeline.CLASSIFIER)
+        match = parser.OFPMatch(eth_type=classifier.ETH_TYPE_LLDP)
+        self.add_flow(datapath, self.LLDP_PRIORITY, match,
+                      [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)],
+                      table_id=table_id)
+        self.send_msg(datapath, parser.OFPPortDescStatsRequest(datapath, 0))
+        return table_id, self.LLDP_PRIORITY, shadow_table.match_key(match)
+
+    # The broadcast group of a switch and the flows that hand it the broadcasts.
+    # Groups and flows left by an earlier run go first. Returns the flow_key()s of
+    # the flows.
+    def add_broadcast(self, datapath):
+        ofproto = datapath.ofproto
+        ports = self.broadcast.installed(datapath.id)
+        self.send_msg(datapath, spanning_tree.group_mod(datapath, ofproto.OFPGC_DELETE))
+        self.send_msg(datapath, spanning_tree.group_mod(datapath, ofproto.OFPGC_ADD, ports))
+        return self.add_broadcast_flows(datapath)
+
+    # The controller gets a copy of every broadcast to learn the sender from. Once
+    # the switch has the table-miss meter these copies count against it too, or a
+    # broadcast storm would reach the controller unlimited.
+    def add_broadcast_flows(self, datapath):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
+        table_id = self.table(datapath, pipeline.L2)
+        meter_id = self.TABLE_MISS_METER_ID if datapath.id in self.metered else None
+        match = parser.OFPMatch(eth_dst=spanning_tree.BROADCAST_MAC)
+        self.add_flow(datapath, self.BROADCAST_PRIORITY, match,
+                      [parser.OFPActionGroup(spanning_tree.BROADCAST_GROUP),
+                       parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)],
+                      cookie=self.BROADCAST_COOKIE, meter_id=meter_id, table_id=table_id)
+        installed = [(table_id, self.BROADCAST_PRIORITY, shadow_table.match_key(match))]
+        # ARP requests stay with the proxy, which answers them or probes the hosts itself
+        match = parser.OFPMatch(eth_type=classifier.ETH_TYPE_ARP, eth_dst=spanning_tree.BROADCAST_MAC)
+        self.add_flow(datapath, self.BROADCAST_PRIORITY + 1, match,
+                      [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)],
+                      meter_id=meter_id, table_id=table_id)
+        installed.append((table_id, self.BROADCAST_PRIORITY + 1, shadow_table.match_key(match)))
+        return installed
 
-        # Initial flow entry for matching misses
+    def add_table_miss(self, datapath, meter_id=None):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
         match = parser.OFPMatch()
-        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
-                                          ofproto.OFPCML_NO_BUFFER)]
-        self.add_flow(datapath, 0, match, actions)
+        max_len = self.BUFFER_MISS_LEN if self.BUFFER_PACKETS else ofproto.OFPCML_NO_BUFFER
+        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, max_len)]
+        self.add_flow(datapath, 0, match, actions, meter_id=meter_id,
+                      table_id=self.table(datapath, pipeline.L2))
+
+    @set_ev_cls(ofp_event.EventOFPMeterFeaturesStatsReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def meter_features_handler(self, ev):
+        datapath = ev.msg.datapath
+        if not admission.meters_supported(datapath, ev.msg.body, self.TABLE_MISS_METER_ID):
+            self.logger.info('dpid %s: no meters, the table-miss entry is not rate limited',
+                             datapath.id)
+            return
+        for mod in admission.meter_mods(datapath, self.TABLE_MISS_METER_ID,
+                                        self.TABLE_MISS_METER_RATE, self.TABLE_MISS_METER_BURST):
+            self.send_msg(datapath, mod)
+        self.metered.add(datapath.id)
+        self.add_table_miss(datapath, self.TABLE_MISS_METER_ID)
+        if self.broadcast is not None:
+            self.add_broadcast_flows(datapath)
+        self.flows.flush(datapath, barrier=True, callback=self._batch_done)
+
+    # Drop everything from src on this port for a while, see admission.py
+    def block_source(self, datapath, in_port, src):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        src = src.hex(':')
+        self.logger.info('dpid %s: blocking %s on port %s for %ds',
+                         datapath.id, src, in_port, self.BLOCK_TIMEOUT)
+        if self.trace.enabled:
+            self.trace.emit('block', dpid=datapath.id, in_port=in_port, src=src)
+        self.send_msg(datapath, parser.OFPFlowMod(
+            datapath=datapath, table_id=self.table(datapath, pipeline.ACL),
+            priority=self.BLOCK_PRIORITY, cookie=self.BLOCK_COOKIE,
+            match=parser.OFPMatch(in_port=in_port, eth_src=src), instructions=[],
+            hard_timeout=self.BLOCK_TIMEOUT, flags=ofproto.OFPFF_SEND_FLOW_REM))
+        self.flows.flush(datapath)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def state_change_handler(self, ev):
+        datapath = ev.datapath
+        if datapath.id is None or self.datapaths.get(datapath.id) is not datapath:
+            return
+        del self.datapaths[datapath.id]
+        self.switches.pop(datapath.id, None)
+        self.release(datapath.id)
+        self.flows.disconnect(datapath.id)
+        self.mac_table.remove_switch(datapath.id)
+        if self.admission is not None:
+            self.admission.forget(datapath.id)
+        if self.cluster is not None:
+            self.cluster.disconnect(datapath.id)
+
+    # Forget what this controller programmed on a switch, it is unknown once the
+    # switch comes back or this controller becomes its master again
+    def release(self, dpid):
+        self.dumps.disconnect(dpid)
+        self.features.disconnect(dpid)
+        self.tables.pop(dpid, None)
+        self.metered.discard(dpid)
+        self.shadow.forget(dpid)
+        if self.planner is not None:
+            self.planner.disconnect(dpid)
+        if self.compiler is not None:
+            self.compiler.disconnect(dpid)
+        if self.groups is not None:
+            self.groups.disconnect(dpid)
+        if self.stats is not None:
+            self.stats.disconnect(dpid)
+        if self.discovery is not None:
+            self.discovery.remove_switch(dpid)
+        if self.broadcast is not None:
+            self.broadcast.forget(dpid)
+
+    # Switches this controller programs: all of them, or those it is master of
+    def programmed(self):
+        if self.cluster is None:
+            return list(self.datapaths.values())
+        return [datapath for dpid, datapath in self.datapaths.items() if self.cluster.is_master(dpid)]
+
+    # Called by the cluster when this node became master or slave of a switch
+    def role_changed(self, dpid, master, generation):
+        datapath = self.datapaths.get(dpid)
+        if datapath is None:
+            return
+        self.logger.info('dpid %s: %s, generation %d', dpid, 'master' if master else 'slave', generation)
+        self.send_role(datapath, master, generation)
+        if not master:
+            self.release(dpid)
+
+    def send_role(self, datapath, master, generation):
+        ofproto = datapath.ofproto
+        role = ofproto.OFPCR_ROLE_MASTER if master else ofproto.OFPCR_ROLE_SLAVE
+        self.send_msg(datapath, datapath.ofproto_parser.OFPRoleRequest(datapath, role, generation))
+        self.flows.flush(datapath)
+
+    # The switch accepted this controller as master, from now on it programs it
+    @set_ev_cls(ofp_event.EventOFPRoleReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def role_reply_handler(self, ev):
+        msg = ev.msg
+        datapath = msg.datapath
+        if self.cluster is None or self.datapaths.get(datapath.id) is not datapath:
+            return
+        if msg.role == datapath.ofproto.OFPCR_ROLE_MASTER and self.cluster.is_master(datapath.id):
+            self.take_over(datapath)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
+    def port_status_handler(self, ev):
+        msg = ev.msg
+        ofproto = msg.datapath.ofproto
+        up = msg.reason != ofproto.OFPPR_DELETE and \
+            not msg.desc.state & ofproto.OFPPS_LINK_DOWN
+        if self.discovery is not None and msg.datapath in self.programmed():
+            self.discovery.port_changed(msg.datapath.id, msg.desc.port_no, up,
+                                        arp_frames.mac_bytes(msg.desc.hw_addr))
+        if self.planner is None:
+            return
+        # Only the flows whose shortest path used (or can now use) this link change
+        changes = self.planner.link_changed(msg.datapath.id, msg.desc.port_no, up)
+        for dpid, (adds, removes) in changes.items():
+            self.push_rules(self.datapaths[dpid], *self.compiled(dpid, adds, removes))
+
+    @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def port_desc_handler(self, ev):
+        datapath = ev.msg.datapath
+        ofproto = datapath.ofproto
+        if self.discovery is None or self.datapaths.get(datapath.id) is not datapath:
+            return
+        self.discovery.add_switch(datapath.id, dict(
+            (port.port_no, arp_frames.mac_bytes(port.hw_addr)) for port in ev.msg.body
+            if port.port_no <= ofproto.OFPP_MAX and not port.state & ofproto.OFPPS_LINK_DOWN))
+
+    def _discovery_loop(self):
+        while True:
+            hub.sleep(self.DISCOVERY_TICK)
+            # A slave switch refuses packet_outs, its probes are up to its master
+            programmed = dict((datapath.id, datapath) for datapath in self.programmed())
+            for dpid, port, frame in self.discovery.due():
+                datapath = programmed.get(dpid)
+                if datapath is not None:
+                    self.send_probe(datapath, port, frame)
+            self.discovery.expire()
+            if self.broadcast is not None:
+                self.update_broadcast()
+            self.flows.flush_all()
+
+    def send_probe(self, datapath, port, frame):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        self.send_msg(datapath, parser.OFPPacketOut(
+            datapath=datapath, buffer_id=ofproto.OFP_NO_BUFFER, in_port=ofproto.OFPP_CONTROLLER,
+            actions=[parser.OFPActionOutput(port)], data=frame))
+
+    # Only the switches whose flood ports changed get a group_mod
+    def update_broadcast(self):
+        programmed = dict((datapath.id, datapath) for datapath in self.programmed())
+        for dpid, ports in self.broadcast.changed().items():
+            datapath = programmed.get(dpid)
+            if datapath is None:
+                continue
+            self.send_msg(datapath, spanning_tree.group_mod(datapath, datapath.ofproto.OFPGC_MODIFY,
+                                                            ports))
+            if self.trace.enabled:
+                self.trace.emit('broadcast_ports', dpid=dpid, ports=sorted(ports))
+
+    # Flooding out of a packet_out: the switch's broadcast group, which skips the
+    # in_port, or OFPP_FLOOD without a spanning tree or before discovery settled
+    # the switch's ports (its group lacks edge ports until then)
+    def flood_actions(self, datapath):
+        parser = datapath.ofproto_parser
+        if self.broadcast is not None and datapath.id in self.broadcast.flood and \
+                self.discovery.all_settled(datapath.id):
+            return [parser.OFPActionGroup(spanning_tree.BROADCAST_GROUP)]
+        return [parser.OFPActionOutput(datapath.ofproto.OFPP_FLOOD)]
+
+    # A discovery probe that came back through a neighbour
+    def lldp_handler(self, ev, frame):
+        self.discovery.received(ev.msg.datapath.id, ev.msg.match['in_port'], ev.msg.data)
+
+    # Called by discovery for every link that appeared or went away. A link that
+    # stopped answering probes is taken out of the paths like one whose port went
+    # down; a switch leaving the controller says nothing about its links.
+    def link_event(self, event):
+        if event.kind == 'settled':
+            return
+        self.logger.info('link %s %s:%s -> %s:%s %s', event.kind, event.src, event.src_port,
+                         event.dst, event.dst_port, event.reason or '')
+        if self.trace.enabled:
+            self.trace.emit('link', kind=event.kind, src=event.src, src_port=event.src_port,
+                            dst=event.dst, dst_port=event.dst_port, reason=event.reason)
+        if self.planner is None or event.reason == 'switch':
+            return
+        changes = self.planner.link_changed(event.src, event.src_port, event.kind == 'add')
+        for dpid, (adds, removes) in changes.items():
+            self.push_rules(self.datapaths[dpid], *self.compiled(dpid, adds, removes))
+
+    # Planner rules of a switch as they are installed: aggregated if the flow
+    # compiler is enabled, else unchanged
+    def compiled(self, dpid, adds, removes, connected=False):
+        if self.compiler is None:
+            return adds, removes
+        switch = self.planner.topology.switches.get(dpid)
+        if connected and switch is not None:
+            # The router's own addresses have to keep reaching the controller
+            for _, iface in switch.interfaces.values():
+                self.compiler.reserve(dpid, (('eth_type', flow_compiler.ETH_TYPE_IP),
+                                             ('ipv4_dst', str(iface.ip))))
+        return self.compiler.compile(dpid, adds, removes)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def barrier_reply_handler(self, ev):
+        self.flows.barrier_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPErrorMsg, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def error_msg_handler(self, ev):
+        msg = ev.msg
+        if msg.type == msg.datapath.ofproto.OFPET_FLOW_MOD_FAILED:
+            # Some flow_mod did not make it, the shadow copy of this switch is unreliable now
+            self.shadow.forget(msg.datapath.id)
+        if self.features.error(msg):
+            # No table features, no pipeline
+            self.logger.warning('dpid %s: no table features, single table', msg.datapath.id)
+            self.tables[msg.datapath.id] = pipeline.FLAT
+            self.program(msg.datapath)
+            return
+        if self.stats is not None and self.stats.error(msg):
+            self.logger.warning('dpid %s: stats request failed, type %s code %s',
+                                msg.datapath.id, msg.type, msg.code)
+            return
+        if self.flows.error(msg) is None:
+            self.logger.warning('dpid %s: error type %s code %s for xid %s',
+                                msg.datapath.id, msg.type, msg.code, msg.xid)
+
+    def _batch_done(self, result):
+        if result.errors:
+            self.logger.warning('dpid %s: %d of %d messages failed: %s', result.dpid,
+                                len(result.errors), len(result.xids), result.errors)
+        if self.trace.enabled:
+            self.trace.emit('batch', dpid=result.dpid, msgs=len(result.xids),
+                            errors=len(result.errors))
+
+    # Translate planner rules into flow_mods and send them to the switch in one go
+    def push_rules(self, datapath, adds, removes):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        unused = ()
+        if self.groups is not None:
+            # The groups new rules point to go first, the ones no rule uses any more last
+            created, unused = self.groups.update(datapath.id, adds, removes)
+            for group in created:
+                self.send_msg(datapath, multipath.group_mod(datapath, ofproto.OFPGC_ADD, group))
+            adds = [(match, priority, self.groups.resolve(datapath.id, actions))
+                    for match, priority, actions in adds]
+
+        tables = self.tables.get(datapath.id, pipeline.FLAT)
+        for match, priority, _ in removes:
+            mod = parser.OFPFlowMod(datapath=datapath, table_id=pipeline.rule_table(tables, match),
+                                    priority=priority,
+                                    command=ofproto.OFPFC_DELETE_STRICT,
+                                    out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                    match=parser.OFPMatch(**dict(match)))
+            self.send_msg(datapath, mod)
+        for match, priority, actions in adds:
+            self.add_flow(datapath, priority, parser.OFPMatch(**dict(match)),
+                          self.to_actions(parser, actions), table_id=pipeline.rule_table(tables, match))
+        for group in unused:
+            self.send_msg(datapath, multipath.group_mod(datapath, ofproto.OFPGC_DELETE, group))
+        # One write and one barrier (or bundle commit) per batch
+        return self.flows.flush(datapath, barrier=True, bundle=self.BUNDLE_RULES,
+                                callback=self._batch_done)
+
+    @staticmethod
+    def to_actions(parser, actions):
+        result = []
+        for action in actions:
+            if action[0] == 'output':
+                result.append(parser.OFPActionOutput(action[1]))
+            elif action[0] == 'set_field':
+                result.append(parser.OFPActionSetField(**{action[1]: action[2]}))
+            elif action[0] == 'dec_ttl':
+                result.append(parser.OFPActionDecNwTtl())
+            elif action[0] == 'group':
+                result.append(parser.OFPActionGroup(action[1]))
+        return result
+
+    # Bucket weights of a select group: link bandwidth from the topology, less
+    # what the last port stats measured on the link
+    def bucket_weights(self, dpid, ports):
+        params = self.planner.topology.link_params
+        rates = [self.stats.rate(dpid, port) for port in ports] if self.stats is not None else None
+        return multipath.bucket_weights([params.get((dpid, port), {}).get('bw') for port in ports],
+                                        rates)
+
+    # Link capacity of a switch port in bit/s, from the topology if it has one
+    def port_capacity(self, dpid, port):
+        if self.planner is None:
+            return None
+        bw = self.planner.topology.link_params.get((dpid, port), {}).get('bw')
+        return bw * 1e6 if bw else None
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def port_stats_handler(self, ev):
+        if self.stats is not None:
+            self.stats.port_reply(ev.msg)
+
+    # Called by the stats poller with fresh port stats of a switch. Only the
+    # buckets change, the flows keep pointing to the same groups.
+    def rebalance(self, dpid):
+        datapath = self.datapaths.get(dpid)
+        if self.groups is None or datapath is None:
+            return
+        changed = self.groups.rebalance(dpid)
+        for group in changed:
+            self.send_msg(datapath, multipath.group_mod(datapath, datapath.ofproto.OFPGC_MODIFY, group))
+        if changed:
+            self.flows.flush(datapath, barrier=True, callback=self._batch_done)
 
-        self.mac_to_port[datapath.id] = {}
-        self.datapaths[datapath.id] = {datapath}
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        self.shadow.removed(ev.msg.datapath.id, ev.msg)
 
+    # Every message to a switch goes through here so it gets counted. It is only
+    # queued, handlers flush the queues when they are done. Returns False if the
+    # message was a redundant flow_mod and got dropped.
+    def send_msg(self, datapath, msg):
+        if isinstance(msg, datapath.ofproto_parser.OFPFlowMod) and \
+                not self.shadow.flow_mod(datapath.id, msg):
+            self.metrics.flow_mod_suppressed.inc(datapath.id)
+            return False
+        self.metrics.count_sent(datapath, msg)
+        self.flows.add(datapath, msg)
+        return True
 
     # Add a flow entry to the flow-table
-    def add_flow(self, datapath, priority, match, actions):
+    @metrics.timed('add_flow')
+    def add_flow(self, datapath, priority, match, actions,
+                 idle_timeout=0, hard_timeout=0, buffer_id=None, cookie=0, meter_id=None,
+                 table_id=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
         # Construct flow_mod message and send it
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        if meter_id is not None:
+            inst.insert(0, parser.OFPInstructionMeter(meter_id))
+
+        # A valid buffer_id makes the switch run the buffered packet through the new flow
+        if buffer_id is None:
+            buffer_id = ofproto.OFP_NO_BUFFER
+
+        # Flows that time out report their removal, that keeps the shadow table in sync
+        flags = 0
+        if idle_timeout or hard_timeout:
+            flags = ofproto.OFPFF_SEND_FLOW_REM
 
-        mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                match=match, instructions=inst)
-        datapath.send_msg(mod)
+        mod = parser.OFPFlowMod(datapath=datapath, table_id=table_id, priority=priority,
+                                match=match, instructions=inst,
+                                idle_timeout=idle_timeout, hard_timeout=hard_timeout,
+                                buffer_id=buffer_id, flags=flags, cookie=cookie)
+        if self.send_msg(datapath, mod) and self.trace.enabled:
+            self.trace.emit('flow_mod', dpid=datapath.id, priority=priority)
 
     # Handle the packet_in event
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
+        msg = ev.msg
+        if self.cluster is not None and not self.cluster.is_master(msg.datapath.id):
+            # Sent before the switch got the role request, its master handles it
+            return
+        self.metrics.packet_in.inc(msg.datapath.id)
+        if self.admission is not None and not admission.exempt(msg.data):
+            in_port = msg.match['in_port']
+            verdict = self.admission.check(msg.datapath.id, in_port, msg.data[6:12])
+            if verdict != admission.ADMIT:
+                self.metrics.packet_in_rejected.inc(msg.datapath.id)
+                if verdict == admission.BLOCK:
+                    self.block_source(msg.datapath, in_port, msg.data[6:12])
+                return
+        if self.dispatcher is not None:
+            self.dispatcher.dispatch(ev)
+        else:
+            self.handle_packet_in(ev)
+
+    @metrics.timed('packet_in')
+    def handle_packet_in(self, ev):
+        # Only the ethernet header is read here, no full decode of every layer
+        frame = classifier.classify(ev.msg.data)
+        if frame is None:
+            return
+        try:
+            self.ethertype_handlers.get(frame.ethertype, self.l2_handler)(ev, frame)
+        finally:
+            # A learned flow and its packet_out leave in the same write. The other
+            # switches' queues belong to their own shards.
+            self.flows.flush(ev.msg.datapath)
+
+    # Drop IPv6 packets (we use only ipv4 packages)
+    def ipv6_handler(self, ev, frame):
+        datapath = ev.msg.datapath
+        match = datapath.ofproto_parser.OFPMatch(eth_type=frame.ethertype)
+        actions = []
+        self.add_flow(datapath, 1, match, actions)
+        if self.trace.enabled:
+            self.trace.emit('ipv6_drop', dpid=datapath.id)
+
+    def arp_packet_handler(self, ev, frame):
+        arp_pkt = frame.arp()
+        if arp_pkt is None:
+            # Not IPv4 over ethernet ARP, just switch it
+            self.l2_handler(ev, frame)
+            return
+        if self.trace.enabled:
+            self.trace.emit('arp', dpid=ev.msg.datapath.id, op=arp_pkt.opcode,
+                            src=arp_pkt.src_mac, src_ip=arp_pkt.src_ip, dst_ip=arp_pkt.dst_ip)
+        self.arp_handler(arp_pkt, ev, ev.msg.datapath)
+
+    def l2_handler(self, ev, frame):
         msg = ev.msg  # openflow message between controller and switch
         datapath = msg.datapath  # datapath of openflow message
         ofproto = msg.datapath.ofproto  # Openflow protocol for the switch
         parser = msg.datapath.ofproto_parser  # Parser for the openflow protocol message
         in_port = msg.match['in_port']  # input port from the packet message
-        pkt = packet.Packet(msg.data)  # parse packet data from openflow message
-        ether_frame = pkt.get_protocol(ethernet.ethernet)  # ethernet protocol header
 
-        # Drop IPv6 packets (we use only ipv4 packages)
-        if pkt.get_protocol(ipv6.ipv6):
-            match = parser.OFPMatch(eth_type=ether_frame.ethertype)
-            actions = []
-            self.add_flow(datapath, 1, match, actions)
-            print("Dropped IPv6 Packet")
-            return
+        src_mac = frame.src  # source MAC
+        dst_mac = frame.dst  # Destination MAC
 
+        if self.trace.enabled:
+            self.trace.emit('packet_in', dpid=datapath.id, in_port=in_port,
+                            src=src_mac, dst=dst_mac)
 
-        arp_pkt = pkt.get_protocol(arp.arp)
-        print("ARP: ", arp_pkt)
-        #Check if packet is ARP-request
-        if arp_pkt:
-            self.arp_handler(arp_pkt, ev, datapath)
-            return
+        moved_from = self.mac_table.learn(datapath.id, mac_table.mac_to_int(frame.src_raw), in_port)
+        if moved_from is not None:
+            self.station_moved(datapath, src_mac, moved_from, in_port)
 
-        src_mac = ether_frame.src  # source MAC
-        dst_mac = ether_frame.dst  # Destination MAC
-
-        print("Source: ", src_mac)
-        print("Destination: ", dst_mac)
-        print("__________")
-        print("SwitchID: ", datapath.id)
-        print(self.mac_to_port)
-        print("__________")
-
-        self.mac_to_port[datapath.id][src_mac] = in_port
+        if msg.cookie == self.BROADCAST_COOKIE:
+            # The switch copied it along the spanning tree, this copy was for learning
+            return
 
-        if dst_mac in self.mac_to_port[datapath.id]:
-            out_port = self.mac_to_port[datapath.id][datapath.id]
+        out_port = self.mac_table.lookup(datapath.id, mac_table.mac_to_int(frame.dst_raw))
+        if out_port is None:
+            actions = self.flood_actions(datapath)
         else:
-            out_port = ofproto.OFPP_FLOOD
-
-        actions = [datapath.ofproto_parser.OFPActionOutput(out_port)]
+            actions = [parser.OFPActionOutput(out_port)]
 
-        # install a flow to avoid packet_in next time
-        if out_port != ofproto.OFPP_FLOOD:
-            self.add_flow(datapath, dst_mac, src_mac, actions)
+            # install a flow to avoid packet_in next time
+            match = parser.OFPMatch(in_port=in_port, eth_src=src_mac, eth_dst=dst_mac)
+            if msg.buffer_id != ofproto.OFP_NO_BUFFER:
+                # The switch forwards the buffered packet itself, no packet_out needed
+                self.add_flow(datapath, self.FLOW_PRIORITY, match, actions,
+                              self.FLOW_IDLE_TIMEOUT, self.FLOW_HARD_TIMEOUT,
+                              msg.buffer_id, self.LEARNED_COOKIE,
+                              table_id=self.table(datapath, pipeline.L2))
+                return
+            self.add_flow(datapath, self.FLOW_PRIORITY, match, actions,
+                          self.FLOW_IDLE_TIMEOUT, self.FLOW_HARD_TIMEOUT,
+                          cookie=self.LEARNED_COOKIE, table_id=self.table(datapath, pipeline.L2))
 
         data = None
         if msg.buffer_id == ofproto.OFP_NO_BUFFER:
             data = msg.data
 
-        out = datapath.ofproto_parser.OFPPacketOut(
+        out = parser.OFPPacketOut(
             datapath=datapath, buffer_id=msg.buffer_id, in_port=in_port,
             actions=actions, data=data)
-        datapath.send_msg(out)
+        self.send_msg(datapath, out)
 
+    # A station showed up on another port, the learned flows towards and from it are stale.
+    # Proactive flows carry no cookie and stay.
+    def station_moved(self, datapath, mac, old_port, new_port):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        if self.trace.enabled:
+            self.trace.emit('station_move', dpid=datapath.id, mac=mac, old=old_port, new=new_port)
+        for match in (parser.OFPMatch(eth_dst=mac), parser.OFPMatch(eth_src=mac)):
+            self.send_msg(datapath, parser.OFPFlowMod(
+                datapath=datapath, table_id=self.table(datapath, pipeline.L2),
+                command=ofproto.OFPFC_DELETE,
+                cookie=self.LEARNED_COOKIE, cookie_mask=0xffffffffffffffff,
+                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY, match=match))
 
 
+    @metrics.timed('arp')
     def arp_handler(self, arp_pkt, ev, datapath):
-        # ARP packet is received
-        print("ARP handler")
-        # Store the sender host information
+        in_port = ev.msg.match['in_port']
         src_ip = arp_pkt.src_ip
         src_mac = arp_pkt.src_mac
-        if src_ip not in self.arp_table:
-            self.arp_table[src_ip] = src_mac
-
         dst_ip = arp_pkt.dst_ip
 
-        if arp_pkt.opcode == arp.ARP_REQUEST:
-            if dst_ip in self.arp_table:
-                # If ARP request and destination MAC is known, send ARP reply
-                print("ARP destination is in hosts, sending ARP reply")
-                dst_mac = self.arp_table[dst_ip]
-                self.send_arp_reply(ev.msg.datapath,
-                                    dst_mac, src_mac, dst_ip, src_ip, ev.msg.match['in_port'])
-            else:
-                # If ARP request and destination MAC is not known, send ARP request to all hosts
-                print("ARP destination is not in hosts, sending ARP request")
-                dp_dict = datapath.ports
-                for key in dp_dict:
-                    if key != datapath.id:  # Don't send ARP request to the same Datapath
-                        self.send_arp_request(datapath, src_mac, src_ip, dst_ip)
+        # Every ARP packet (gratuitous ones included) refreshes the sender's binding and
+        # answers whoever was waiting for it
+        if src_ip != '0.0.0.0':
+            self.answer_waiting(src_ip, src_mac)
+        if arp_pkt.opcode == arp.ARP_REPLY and self.cluster is not None:
+            # The requester may sit on a switch of another node
+            self.cluster.send(('arp_reply', src_ip, src_mac))
 
-        else:
-            print("ARP reply received from ", src_ip)
-            # No need to do anything as we already stored the host IP, we wait for the requester to send another ARP request
+        if arp_pkt.opcode != arp.ARP_REQUEST or src_ip == dst_ip:
+            # Replies and announcements are consumed here, the requesters got their answer
+            return
+
+        action, dst_mac = self.arp_proxy.request(datapath.id, in_port, src_mac, src_ip, dst_ip)
+        if action == arp_proxy.REPLY:
+            self.send_arp_reply(datapath, dst_mac, src_mac, dst_ip, src_ip, in_port)
+        elif action == arp_proxy.FLOOD:
+            # One probe per switch for the whole fabric instead of one per port. It only
+            # goes to the edge ports with a spanning tree, without one copies that
+            # come back from other switches are recognised as ours and dropped.
+            if self.trace.enabled:
+                self.trace.emit('arp_flood', dpid=datapath.id, src=src_mac, dst_ip=dst_ip)
+            self.flood_arp_request(src_mac, src_ip, dst_ip)
+            if self.cluster is not None:
+                # Switches of the other nodes are flooded by their masters
+                self.cluster.send(('arp_flood', src_mac, src_ip, dst_ip))
+
+    # A learned binding answers the requests that were waiting for it, on the
+    # switches this node programs (only those send it requests)
+    def answer_waiting(self, ip, mac):
+        programmed = dict((datapath.id, datapath) for datapath in self.programmed())
+        answered = {}
+        for dpid, port, req_mac, req_ip in self.arp_proxy.learn(ip, mac):
+            if dpid in programmed:
+                self.send_arp_reply(programmed[dpid], mac, req_mac, ip, req_ip, port)
+                answered[dpid] = programmed[dpid]
+        # The packet_in handler only flushes its own switch
+        for datapath in answered.values():
+            self.flows.flush(datapath)
+
+    def flood_arp_request(self, src_mac, src_ip, dst_ip):
+        for datapath in self.programmed():
+            self.send_arp_request(datapath, src_mac, src_ip, dst_ip)
+            self.flows.flush(datapath)
+
+    # A cluster.send() of another node
+    def cluster_message(self, message):
+        kind, args = message[0], message[1:]
+        if kind == 'arp_flood':
+            self.flood_arp_request(*args)
+        elif kind == 'arp_reply':
+            self.answer_waiting(*args)
 
+    def _expire_loop(self):
+        while True:
+            hub.sleep(self.ARP_EXPIRE_INTERVAL)
+            self.arp_proxy.expire()
+            self.shadow.expire()
+            self.mac_table.expire()
+            if self.admission is not None:
+                self.admission.expire()
 
     def send_arp_reply(self, datapath, src_mac, dst_mac, src_ip, dst_ip, in_port):
         self.send_arp(datapath, arp.ARP_REPLY, src_mac,
@@ -162,43 +1066,22 @@ class LearningSwitch(app_manager.RyuApp):
                         src_ip, None, dst_ip, None)
 
     def send_arp(self, datapath, opcode, src_mac, src_ip, dst_mac, dst_ip, in_port):
-        eth_dst_mac = dst_mac
-        arp_dst_mac = dst_mac
-
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
 
-        if opcode == arp.ARP_REQUEST:
-            eth_dst_mac = 'ff:ff:ff:ff:ff:ff'
-            arp_dst_mac = '00:00:00:00:00:00'
-            actions = [datapath.ofproto_parser.OFPActionOutput(
-                datapath.ofproto.OFPP_FLOOD)]
+        if opcode == arp.ARP_REQUEST and self.broadcast is not None:
+            actions = spanning_tree.flood_actions(datapath, self.discovery.edge_ports(datapath.id))
+        elif opcode == arp.ARP_REQUEST:
+            actions = [parser.OFPActionOutput(ofproto.OFPP_FLOOD)]
         else:
-            actions = [datapath.ofproto_parser.OFPActionOutput(in_port)]
-
-        # Create Ethernet header
-        eth = ethernet.ethernet(
-            dst=eth_dst_mac,
-            src=src_mac,
-            ethertype=packet.ethernet.ether.ETH_TYPE_ARP
-        )
+            actions = [parser.OFPActionOutput(in_port)]
 
-        # Create ARP header
-        arp_header = arp.arp(
-            opcode=opcode,
-            src_mac=src_mac,
-            src_ip=src_ip,
-            dst_mac=arp_dst_mac,
-            dst_ip=dst_ip
-        )
-
-        # Create packet and send it
-        pkt = packet.Packet()
-        pkt.add_protocol(eth)
-        pkt.add_protocol(arp_header)
-
-        pkt.serialize()
-        datapath.send_packet_out(
-            buffer_id=datapath.ofproto.OFP_NO_BUFFER,
-            in_port=datapath.ofproto.OFPP_CONTROLLER,
+        # The frame comes from the cache, nothing is built or serialized per packet
+        out = parser.OFPPacketOut(
+            datapath=datapath,
+            buffer_id=ofproto.OFP_NO_BUFFER,
+            in_port=ofproto.OFPP_CONTROLLER,
             actions=actions,
-            data=pkt.data
-        )
\ No newline at end of file
+            data=self.arp_frames.frame(opcode, src_mac, src_ip, dst_mac, dst_ip)
+        )
+        self.send_msg(datapath, out)
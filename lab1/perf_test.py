@@ -0,0 +1,278 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+#!/bin/env python3
+
+# Scripted performance run, instead of pingall/iperf by hand in the CLI.
+# Starts a topology (the lab network, a description or a generated one, as in
+# run_network.py) and optionally the controller, then measures host pairs
+# concurrently:
+#
+#   first packet  one ping on a cold network, so ARP and the controller round
+#                 trip for the flow setup are part of it
+#   rtt           steady state ping once the flows are installed
+#   throughput    iperf (v2) TCP between the pairs, --iperf-parallel at a time
+#
+# Results go to a JSON and/or CSV report. With --baseline the summary is
+# compared against an earlier JSON report and the run fails on regressions.
+#
+#   sudo python3 perf_test.py --controller-cmd "ryu-manager new_approach/ans_controller.py" \
+#       --json run.json --baseline baseline.json
+#   sudo python3 perf_test.py --generate leaf-spine --leaves 8 --hosts 8 --pairs 64 --parallel 32
+#
+# The lab network measures all host pairs; a description or a generated
+# topology SAMPLE_PAIRS of them unless --pairs says otherwise (0 for all).
+
+import argparse
+import csv
+import itertools
+import json
+import random
+import re
+import shlex
+import socket
+import subprocess
+import sys
+import time
+
+from mininet.log import setLogLevel, info
+
+import run_network
+
+IPERF_BASE_PORT = 5001
+SAMPLE_PAIRS = 64
+
+# Summary fields for the baseline comparison, and whether bigger is better
+SUMMARY_FIELDS = {
+    'first_ms_p50': False,
+    'first_ms_p99': False,
+    'rtt_ms_p50': False,
+    'rtt_ms_p99': False,
+    'loss_pct': False,
+    'mbps_mean': True,
+    'mbps_total': True,
+}
+
+TIME_RE = re.compile(r'time=([\d.]+) ms')
+RTT_RE = re.compile(r'= ([\d.]+)/([\d.]+)/([\d.]+)/([\d.]+) ms')
+LOSS_RE = re.compile(r'([\d.]+)% packet loss')
+
+
+def parse_first(output):
+    m = TIME_RE.search(output)
+    return float(m.group(1)) if m else None
+
+
+def parse_ping(output):
+    # (avg rtt ms, max rtt ms, loss %) of a ping -q run
+    rtt = RTT_RE.search(output)
+    loss = LOSS_RE.search(output)
+    return (float(rtt.group(2)) if rtt else None, float(rtt.group(3)) if rtt else None,
+            float(loss.group(1)) if loss else 100.0)
+
+
+def parse_iperf(output):
+    # Mbit/s from iperf -y C, the last field of the last report line
+    for line in reversed(output.strip().splitlines()):
+        fields = line.split(',')
+        if len(fields) >= 9:
+            return int(fields[-1]) / 1e6
+    return None
+
+
+def run_batches(jobs, parallel):
+    # Runs (popen factory, parser) jobs, parallel processes at a time, and
+    # returns the parsed outputs in order
+    results = []
+    for i in range(0, len(jobs), parallel):
+        batch = [(factory(), parse) for factory, parse in jobs[i:i + parallel]]
+        for proc, parse in batch:
+            out, _ = proc.communicate()
+            results.append(parse(out.decode(errors='replace') if isinstance(out, bytes) else out))
+    return results
+
+
+def ping_cmd(host, dst, *args):
+    return lambda: host.popen(['ping'] + list(args) + [dst.IP()], stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT)
+
+
+def measure(net, pairs, args):
+    info('*** First packet latency, %d pairs\n' % len(pairs))
+    first = run_batches([(ping_cmd(src, dst, '-c', '1', '-W', '2'), parse_first)
+                         for src, dst in pairs], args.parallel)
+
+    info('*** Round trip time, %d pings per pair\n' % args.ping_count)
+    rtt = run_batches([(ping_cmd(src, dst, '-q', '-c', str(args.ping_count), '-i', '0.2'), parse_ping)
+                       for src, dst in pairs], args.parallel)
+
+    mbps = [None] * len(pairs)
+    if args.iperf_time:
+        info('*** Throughput, %d pairs for %ds, %d at a time\n'
+             % (len(pairs), args.iperf_time, args.iperf_parallel))
+        mbps = []
+        for start in range(0, len(pairs), args.iperf_parallel):
+            batch = pairs[start:start + args.iperf_parallel]
+            # One server port per pair, so pairs sharing a destination do not collide
+            servers = [dst.popen(['iperf', '-s', '-p', str(IPERF_BASE_PORT + i)],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                       for i, (_, dst) in enumerate(batch)]
+            time.sleep(1)
+            jobs = [(lambda src=src, dst=dst, i=i: src.popen(
+                        ['iperf', '-c', dst.IP(), '-p', str(IPERF_BASE_PORT + i), '-t', str(args.iperf_time),
+                         '-y', 'C'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL), parse_iperf)
+                    for i, (src, dst) in enumerate(batch)]
+            # The clients of a batch run at once, the fabric is measured under load
+            mbps.extend(run_batches(jobs, len(jobs)))
+            for server in servers:
+                server.terminate()
+                server.wait()
+
+    return [{'src': src.name, 'dst': dst.name, 'first_ms': f, 'rtt_ms': r[0], 'rtt_max_ms': r[1],
+             'loss_pct': r[2], 'mbps': m}
+            for (src, dst), f, r, m in zip(pairs, first, rtt, mbps)]
+
+
+def quantile(values, q):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(rows):
+    mbps = [r['mbps'] for r in rows if r['mbps'] is not None]
+    return {
+        'pairs': len(rows),
+        'first_ms_p50': quantile([r['first_ms'] for r in rows], 0.5),
+        'first_ms_p99': quantile([r['first_ms'] for r in rows], 0.99),
+        'first_lost': sum(1 for r in rows if r['first_ms'] is None),
+        'rtt_ms_p50': quantile([r['rtt_ms'] for r in rows], 0.5),
+        'rtt_ms_p99': quantile([r['rtt_ms'] for r in rows], 0.99),
+        'loss_pct': sum(r['loss_pct'] for r in rows) / len(rows) if rows else None,
+        'mbps_mean': sum(mbps) / len(mbps) if mbps else None,
+        'mbps_total': sum(mbps) if mbps else None,
+    }
+
+
+def compare(summary, baseline, tolerance):
+    # Prints the change of every summary field and returns the regressed ones
+    regressions = []
+    print('%-14s %12s %12s %9s' % ('', 'baseline', 'current', 'change'))
+    for field, higher_better in SUMMARY_FIELDS.items():
+        old, new = baseline.get(field), summary.get(field)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else (float('inf') if new > old else 0.0)
+        worse = -change if higher_better else change
+        regressed = worse > tolerance and abs(new - old) > 1e-9
+        if regressed:
+            regressions.append(field)
+        print('%-14s %12.3f %12.3f %+8.1f%%%s' % (field, old, new, change * 100,
+                                                  '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def write_csv(rows, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ['src', 'dst'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def wait_for_port(host, port, timeout=15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), 1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def select_pairs(hosts, count, seed):
+    pairs = list(itertools.combinations(hosts, 2))
+    if count and count < len(pairs):
+        pairs = random.Random(seed).sample(pairs, count)
+    return pairs
+
+
+def run(args):
+    topo = run_network.make_topo(args)
+
+    controller = None
+    if args.controller_cmd:
+        controller = subprocess.Popen(shlex.split(args.controller_cmd))
+        if not wait_for_port(args.controller, args.port):
+            controller.terminate()
+            sys.exit('controller did not come up on %s:%d' % (args.controller, args.port))
+
+    net = run_network.build(topo, args.controller, args.port, args.controllers)
+    try:
+        run_network.start(net, args.parallel_start)
+        net.waitConnected(timeout=30)
+        count = args.pairs
+        if count is None:
+            count = SAMPLE_PAIRS if args.topology or args.generate else 0
+        rows = measure(net, select_pairs(net.hosts, count, args.seed), args)
+    finally:
+        net.stop()
+        if controller is not None:
+            controller.terminate()
+            controller.wait()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure first packet latency, RTT and throughput')
+    run_network.add_arguments(parser)
+    parser.add_argument('--controller-cmd', help='start the controller with this command first')
+    parser.add_argument('--parallel-start', type=int, default=1, help='start this many switches at a time')
+    parser.add_argument('--pairs', type=int,
+                        help='sample this many host pairs, 0 for all; default all on the lab '
+                             'network, %d otherwise' % SAMPLE_PAIRS)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--parallel', type=int, default=16, help='concurrent pings')
+    parser.add_argument('--iperf-parallel', type=int, default=16, help='concurrent iperf pairs')
+    parser.add_argument('--ping-count', type=int, default=10)
+    parser.add_argument('--iperf-time', type=int, default=5, help='seconds per iperf run, 0 to skip')
+    parser.add_argument('--json', help='write the report here')
+    parser.add_argument('--csv', help='write the per pair results here')
+    parser.add_argument('--baseline', help='compare against this JSON report')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative change that counts as a regression')
+    args = parser.parse_args()
+
+    setLogLevel('info')
+    rows = run(args)
+    summary = summarize(rows)
+    print(json.dumps(summary, indent=2))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'summary': summary, 'pairs': rows}, f, indent=2)
+    if args.csv:
+        write_csv(rows, args.csv)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(summary, json.load(f)['summary'], args.tolerance)
+        if regressions:
+            sys.exit('regressed: %s' % ', '.join(regressions))
+
+
+if __name__ == '__main__':
+    main()
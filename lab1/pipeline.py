@@ -0,0 +1,150 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# The OpenFlow pipeline of the apps:
+#
+#   0 classifier  by EtherType: LLDP to the controller, IPv6 dropped
+#   1 acl         drops: blocked sources, firewall rules
+#   2 l3          IPv4 routes: the router's and the proactive ones
+#   3 l2          MAC forwarding: learned and proactive flows, broadcast
+#
+# Every table ends in a table-miss entry going to the next one, the last
+# one's goes to the controller. A rule only lives in the table of its kind,
+# so the tables add up: an ACL entry does not have to be repeated for every
+# route or MAC it applies to, as it would in one table.
+#
+# PIPELINE declares the tables with the match fields and instructions their
+# flows use. Before a switch is programmed its table-features reply is checked
+# against it (validate()). A switch that cannot run it gets FLAT, where every
+# table is table 0 and there are no gotos: the priorities of the rules keep
+# a single table working as it did before the pipeline.
+#
+# The app has to forward EventOFPTableFeaturesStatsReply to
+# TableFeatures.reply() and error messages to TableFeatures.error().
+
+from collections import namedtuple
+
+CLASSIFIER = 'classifier'
+ACL = 'acl'
+L3 = 'l3'
+L2 = 'l2'
+
+Table = namedtuple('Table', 'name table_id matches instructions')
+
+PIPELINE = (
+    Table(CLASSIFIER, 0, ('eth_type',), ('apply_actions', 'goto_table')),
+    Table(ACL, 1, ('in_port', 'eth_src', 'eth_type', 'ipv4_src', 'ipv4_dst', 'ip_proto',
+                   'tcp_src', 'tcp_dst', 'udp_src', 'udp_dst'), ('apply_actions', 'goto_table')),
+    Table(L3, 2, ('eth_type', 'ipv4_dst'), ('apply_actions', 'goto_table')),
+    Table(L2, 3, ('in_port', 'eth_src', 'eth_dst', 'eth_type'), ('apply_actions',)),
+)
+
+TABLES = dict((table.name, table.table_id) for table in PIPELINE)  # name -> table_id
+FLAT = dict((table.name, 0) for table in PIPELINE)
+
+
+def gotos(tables):
+    # (table_id, next table_id) of the table-miss entries passing packets down
+    # the pipeline, none for FLAT
+    if tables is FLAT:
+        return []
+    return [(table.table_id, following.table_id) for table, following in zip(PIPELINE, PIPELINE[1:])]
+
+
+def rule_table(tables, match):
+    # Table of a planner rule: routes by IPv4 destination go to l3, the rest to l2
+    return tables[L3] if any(field == 'ipv4_dst' for field, _ in match) else tables[L2]
+
+
+def validate(ofproto, features, pipeline=PIPELINE):
+    # Why a switch cannot run the pipeline, given all OFPTableFeaturesStats of its
+    # reply; empty if it can. Properties the switch does not report are not checked.
+    by_id = dict((feature.table_id, feature) for feature in features)
+    problems = []
+    for i, table in enumerate(pipeline):
+        feature = by_id.get(table.table_id)
+        if feature is None:
+            problems.append('no table %d for %s' % (table.table_id, table.name))
+            continue
+        props = dict((prop.type, prop) for prop in feature.properties)
+        last = i == len(pipeline) - 1
+
+        match = props.get(ofproto.OFPTFPT_MATCH)
+        if match is not None:
+            fields = set(oxm.type for oxm in match.oxm_ids)
+            problems.extend('table %d cannot match %s' % (table.table_id, field)
+                            for field in table.matches if field not in fields)
+
+        inst = _instructions(props.get(ofproto.OFPTFPT_INSTRUCTIONS))
+        if inst is not None:
+            problems.extend('table %d has no %s instruction' % (table.table_id, name)
+                            for name in table.instructions
+                            if getattr(ofproto, 'OFPIT_' + name.upper()) not in inst)
+
+        # The table-miss entry: goto the next table, or to the controller from the last
+        miss = _instructions(props.get(ofproto.OFPTFPT_INSTRUCTIONS_MISS,
+                                       props.get(ofproto.OFPTFPT_INSTRUCTIONS)))
+        needed = ofproto.OFPIT_APPLY_ACTIONS if last else ofproto.OFPIT_GOTO_TABLE
+        if miss is not None and needed not in miss:
+            problems.append('table %d cannot %s on a miss' %
+                            (table.table_id, 'apply actions' if last else 'goto'))
+        if not last:
+            following = pipeline[i + 1].table_id
+            next_tables = props.get(ofproto.OFPTFPT_NEXT_TABLES_MISS,
+                                    props.get(ofproto.OFPTFPT_NEXT_TABLES))
+            if next_tables is not None and following not in next_tables.table_ids:
+                problems.append('table %d cannot goto table %d' % (table.table_id, following))
+    return problems
+
+
+def _instructions(prop):
+    if prop is None:
+        return None
+    return set(inst.type for inst in prop.instruction_ids)
+
+
+class TableFeatures(object):
+    # Collects the parts of a multipart table-features reply per switch, matched by xid
+
+    def __init__(self):
+        self.parts = {}  # dpid -> (request, [OFPTableFeaturesStats] received so far)
+
+    def request(self, datapath):
+        # An empty request only asks, it does not reconfigure the tables
+        request = datapath.ofproto_parser.OFPTableFeaturesStatsRequest(datapath, 0, [])
+        self.parts[datapath.id] = (request, [])
+        return request
+
+    def reply(self, msg):
+        # Returns the features of every table with the last part, else None
+        pending = self.parts.get(msg.datapath.id)
+        if pending is None or pending[0].xid != msg.xid:
+            return None
+        pending[1].extend(msg.body)
+        if msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            return None
+        return self.parts.pop(msg.datapath.id)[1]
+
+    def error(self, msg):
+        # Whether an error message is the answer to a request, which is then done
+        pending = self.parts.get(msg.datapath.id)
+        if pending is None or pending[0].xid != msg.xid:
+            return False
+        del self.parts[msg.datapath.id]
+        return True
+
+    def disconnect(self, dpid):
+        self.parts.pop(dpid, None)
@@ -0,0 +1,148 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Computes the flow entries every switch needs from the static topology, so
+# traffic between known hosts never has to go through the controller.
+#
+# Rules are kept independent of ryu:
+#   match   -- sorted tuple of (OXM field, value) pairs
+#   actions -- tuple of ('output', port), ('set_field', field, value), ('dec_ttl',),
+#              ('select', ports) to spread traffic over several equal-cost ports
+#
+# ('select', ports) is only used with multipath. The app maps every port set
+# to an OpenFlow select group of the switch, see multipath.py.
+
+from collections import defaultdict
+
+from topology import PathComputer
+
+L2_PRIORITY = 20
+L3_PRIORITY = 20
+
+ETH_TYPE_IP = 0x0800
+
+
+class ProactivePlanner(object):
+
+    def __init__(self, topology, multipath=False):
+        self.topology = topology
+        self.multipath = multipath
+        self.paths = PathComputer(topology, multipath)
+        self.installed = {}  # dpid -> {match: (priority, actions)} of connected switches
+        self.endpoints_at = defaultdict(list)
+        for endpoint in topology.endpoints():
+            self.endpoints_at[endpoint[2]].append(endpoint)
+
+    def l2_rule(self, dpid, mac, at_dpid, at_port):
+        # Forward frames for mac towards the switch port it is attached to
+        if self.topology.is_router(dpid):
+            return None
+        if dpid == at_dpid:
+            return (('eth_dst', mac),), (L2_PRIORITY, (('output', at_port),))
+        if self.multipath:
+            ports = self.paths.out_ports(dpid, at_dpid)
+            if len(ports) > 1:
+                return (('eth_dst', mac),), (L2_PRIORITY, (('select', ports),))
+        out_port = self.paths.out_port(dpid, at_dpid)
+        if out_port is None:
+            return None
+        return (('eth_dst', mac),), (L2_PRIORITY, (('output', out_port),))
+
+    def l3_rule(self, dpid, host):
+        # Route to a host from the router interface whose subnet contains it
+        switch = self.topology.switches[dpid]
+        for port, (mac, iface) in switch.interfaces.items():
+            if host.ip not in iface.network:
+                continue
+            if host.dpid == dpid:
+                reachable = host.port == port
+            else:
+                reachable = self.topology.link_up(dpid, port) and \
+                    self.topology.links[(dpid, port)][0] in self.paths.dist.get(host.dpid, {})
+            if not reachable:
+                continue
+            match = (('eth_type', ETH_TYPE_IP), ('ipv4_dst', str(host.ip)))
+            actions = (('set_field', 'eth_src', mac), ('set_field', 'eth_dst', host.mac),
+                       ('dec_ttl',), ('output', port))
+            return match, (L3_PRIORITY, actions)
+        return None
+
+    def desired(self, dpid):
+        rules = {}
+        if self.topology.is_router(dpid):
+            for host in self.topology.hosts.values():
+                rule = self.l3_rule(dpid, host)
+                if rule is not None:
+                    rules[rule[0]] = rule[1]
+        else:
+            for mac, _, at_dpid, at_port in self.topology.endpoints():
+                rule = self.l2_rule(dpid, mac, at_dpid, at_port)
+                if rule is not None:
+                    rules[rule[0]] = rule[1]
+        return rules
+
+    def install_all(self, dpid):
+        # Full rule set for a switch that just connected
+        self.installed[dpid] = self.desired(dpid)
+        return [(match,) + rule for match, rule in self.installed[dpid].items()], []
+
+    def disconnect(self, dpid):
+        self.installed.pop(dpid, None)
+
+    def _update(self, changes, dpid, match, rule):
+        installed = self.installed.get(dpid)
+        if installed is None:
+            return
+        current = installed.get(match)
+        if current == rule:
+            return
+        adds, removes = changes.setdefault(dpid, ([], []))
+        if rule is None:
+            del installed[match]
+            removes.append((match,) + current)
+        else:
+            installed[match] = rule
+            adds.append((match,) + rule)
+
+    def link_changed(self, dpid, port, up):
+        # Update the topology and return {dpid: (adds, removes)} for connected switches,
+        # touching only rules for destinations whose path tree changed
+        link = self.topology.set_link_state(dpid, port, up)
+        if link is None:
+            return {}
+        changes = {}
+        routers = [d for d in self.installed if self.topology.is_router(d)]
+        for dst, old_members in self.paths.link_changed(*link).items():
+            members = old_members | set(self.paths.dist[dst])
+            for mac, _, at_dpid, at_port in self.endpoints_at[dst]:
+                for member in members:
+                    rule = self.l2_rule(member, mac, at_dpid, at_port)
+                    self._update(changes, member, (('eth_dst', mac),), rule and rule[1])
+            for host in self.topology.hosts.values():
+                if host.dpid != dst:
+                    continue
+                match = (('eth_type', ETH_TYPE_IP), ('ipv4_dst', str(host.ip)))
+                for router in routers:
+                    rule = self.l3_rule(router, host)
+                    self._update(changes, router, match, rule and rule[1])
+        # A router interface link going up or down changes that router's routes
+        for router in (link[0], link[2]):
+            if router in routers:
+                for host in self.topology.hosts.values():
+                    match = (('eth_type', ETH_TYPE_IP), ('ipv4_dst', str(host.ip)))
+                    rule = self.l3_rule(router, host)
+                    self._update(changes, router, match, rule and rule[1])
+        return changes
@@ -0,0 +1,103 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Flow reconciliation when a switch (re)connects. Instead of starting from an
+# empty table the app asks for a flow-stats dump, seeds its shadow table with
+# it and keeps every flow that still agrees with the controller state (rules
+# it would install anyway, learned flows whose ports match the restored MAC
+# table); only the rest is deleted. The switch keeps forwarding on its flows
+# all along and the controller relearns nothing it already knew.
+#
+# Flows are told apart by their cookie, see the *_COOKIE constants of the apps.
+#
+# The app has to forward EventOFPFlowStatsReply to reply().
+
+from mac_table import mac_to_int
+from shadow_table import instructions_key
+
+
+class FlowDump(object):
+    # Collects the parts of a multipart flow-stats reply per switch. Replies are
+    # matched by xid, flow stats the app polls for other reasons are not a dump.
+
+    def __init__(self):
+        self.parts = {}  # dpid -> (request, [OFPFlowStats] received so far)
+
+    def request(self, datapath):
+        # Flow-stats request for every flow in every table
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        request = parser.OFPFlowStatsRequest(datapath, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY,
+                                             ofproto.OFPG_ANY, 0, 0, parser.OFPMatch())
+        self.parts[datapath.id] = (request, [])
+        return request
+
+    def pending(self, dpid):
+        return dpid in self.parts
+
+    def reply(self, msg):
+        # Returns all flows of the switch with the last part, else None
+        pending = self.parts.get(msg.datapath.id)
+        if pending is None or pending[0].xid != msg.xid:
+            return None
+        pending[1].extend(msg.body)
+        if msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            return None
+        return self.parts.pop(msg.datapath.id)[1]
+
+    def disconnect(self, dpid):
+        self.parts.pop(dpid, None)
+
+
+def same_actions(datapath, stat, actions):
+    # Whether a dumped flow applies exactly these actions
+    ofproto = datapath.ofproto
+    parser = datapath.ofproto_parser
+    return instructions_key(stat.instructions) == instructions_key(
+        [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)])
+
+
+def uses_group(datapath, stat):
+    # Whether a dumped flow forwards to a group
+    group = datapath.ofproto_parser.OFPActionGroup
+    return any(isinstance(action, group)
+               for inst in stat.instructions for action in getattr(inst, 'actions', None) or ())
+
+
+def learned_flow_valid(datapath, stat, mac_table):
+    # A learned (in_port, eth_src, eth_dst) -> output flow is kept if the MAC
+    # table still has the destination behind its out port and does not know
+    # the source on another port
+    match = dict(stat.match.items())
+    try:
+        in_port, src, dst = match['in_port'], match['eth_src'], match['eth_dst']
+    except KeyError:
+        return False
+    out_port = mac_table.lookup(datapath.id, mac_to_int(dst))
+    if out_port is None or mac_table.lookup(datapath.id, mac_to_int(src)) not in (None, in_port):
+        return False
+    return same_actions(datapath, stat, [datapath.ofproto_parser.OFPActionOutput(out_port)])
+
+
+def delete_strict(datapath, stat):
+    # Flow_mod removing exactly this dumped flow
+    ofproto = datapath.ofproto
+    parser = datapath.ofproto_parser
+    return parser.OFPFlowMod(datapath=datapath, table_id=stat.table_id, priority=stat.priority,
+                             command=ofproto.OFPFC_DELETE_STRICT,
+                             cookie=stat.cookie, cookie_mask=0xffffffffffffffff,
+                             out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                             match=stat.match)
@@ -0,0 +1,200 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Controller side state of the s3 router: longest prefix match routes and
+# the ARP cache of next hops. The controller only resolves the first packet
+# towards a destination, everything after that is forwarded by the flows it
+# installs on the switch.
+
+import time
+from collections import deque
+from ipaddress import IPv4Address, IPv4Interface, IPv4Network
+
+
+class Route(object):
+    __slots__ = ('network', 'port', 'gateway')
+
+    def __init__(self, network, port, gateway=None):
+        self.network = network
+        self.port = port
+        self.gateway = gateway  # None for directly connected networks
+
+    def next_hop(self, dst_ip):
+        return self.gateway if self.gateway is not None else dst_ip
+
+    def __repr__(self):
+        return 'Route(%s, port=%d, gateway=%s)' % (self.network, self.port, self.gateway)
+
+
+class RouteTable(object):
+    # Longest prefix match over an index of prefix lengths: one dict per length,
+    # keyed by the masked network address. A lookup costs one dict probe per
+    # distinct length in the table (at most 33), independent of the number of routes.
+
+    def __init__(self):
+        self._tables = {}   # prefix length -> {network int: Route}
+        self._masks = []    # (mask, table), longest prefix first
+
+    def __len__(self):
+        return sum(len(t) for t in self._tables.values())
+
+    def _reindex(self):
+        self._masks = [((0xffffffff << (32 - plen)) & 0xffffffff, self._tables[plen])
+                       for plen in sorted(self._tables, reverse=True)]
+
+    def add(self, network, port, gateway=None):
+        network = IPv4Network(network)
+        if gateway is not None:
+            gateway = IPv4Address(gateway)
+        route = Route(network, port, gateway)
+        table = self._tables.get(network.prefixlen)
+        if table is None:
+            table = self._tables[network.prefixlen] = {}
+            self._reindex()
+        table[int(network.network_address)] = route
+        return route
+
+    def remove(self, network):
+        network = IPv4Network(network)
+        table = self._tables.get(network.prefixlen, {})
+        route = table.pop(int(network.network_address), None)
+        if not table and network.prefixlen in self._tables:
+            del self._tables[network.prefixlen]
+            self._reindex()
+        return route
+
+    def lookup(self, ip):
+        # ip may be an int, a string or an IPv4Address
+        if not isinstance(ip, int):
+            ip = int(IPv4Address(ip))
+        for mask, table in self._masks:
+            route = table.get(ip & mask)
+            if route is not None:
+                return route
+        return None
+
+    def routes(self):
+        for plen in sorted(self._tables, reverse=True):
+            for route in self._tables[plen].values():
+                yield route
+
+
+class ArpCache(object):
+    # IP -> MAC of next hops with expiry, plus the packets waiting for a resolution.
+    # A request unanswered for `retry` seconds is sent again, up to `retries` times
+    # in all; then the waiting packets are dropped and the next one starts over.
+
+    def __init__(self, ttl=300, max_pending=16, retry=1.0, retries=3):
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.retry = retry
+        self.retries = retries
+        self._entries = {}  # IPv4Address -> (mac, expiry time)
+        self._pending = {}  # IPv4Address -> [deque of queued packets, last request sent, requests sent]
+
+    def get(self, ip):
+        entry = self._entries.get(ip)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del self._entries[ip]
+            return None
+        return entry[0]
+
+    def learn(self, ip, mac):
+        # Returns the packets that were waiting for this address
+        self._entries[ip] = (mac, time.monotonic() + self.ttl)
+        pending = self._pending.pop(ip, None)
+        return pending[0] if pending is not None else ()
+
+    def items(self):
+        # (ip, mac, expiry) of the cached next hops
+        for ip, (mac, expiry) in self._entries.items():
+            yield ip, mac, expiry
+
+    def restore(self, ip, mac, expiry):
+        # Put back an entry from items(), unless it has expired by now
+        if expiry < time.monotonic():
+            return False
+        self._entries[IPv4Address(ip)] = (mac, expiry)
+        return True
+
+    def queue(self, ip, packet, now=None):
+        # Returns True if a request must be sent: for the first packet waiting for ip,
+        # or because the last request went unanswered
+        now = time.monotonic() if now is None else now
+        pending = self._pending.get(ip)
+        if pending is None or (pending[2] >= self.retries and pending[1] <= now - self.retry):
+            # Nothing waiting, or the last try failed and what waited is stale
+            self._pending[ip] = [deque([packet], maxlen=self.max_pending), now, 1]
+            return True
+        pending[0].append(packet)
+        if pending[1] <= now - self.retry:
+            pending[1] = now
+            pending[2] += 1
+            return True
+        return False
+
+    def expire(self, now=None):
+        # Next hops whose request is due again; drops the queues whose last try failed
+        now = time.monotonic() if now is None else now
+        resend = []
+        for ip, pending in list(self._pending.items()):
+            if pending[1] > now - self.retry:
+                continue
+            if pending[2] >= self.retries:
+                del self._pending[ip]
+            else:
+                pending[1] = now
+                pending[2] += 1
+                resend.append(ip)
+        for ip in [ip for ip, (_, expiry) in self._entries.items() if expiry < now]:
+            del self._entries[ip]
+        return resend
+
+
+class Router(object):
+
+    def __init__(self, port_to_mac, port_to_ip, port_to_subnet, arp_ttl=300, arp_retry=1.0,
+                 arp_retries=3):
+        self.interfaces = {}  # port -> (mac, IPv4Interface)
+        for port, mac in port_to_mac.items():
+            prefixlen = IPv4Network(port_to_subnet[port]).prefixlen
+            self.interfaces[port] = (mac, IPv4Interface('%s/%d' % (port_to_ip[port], prefixlen)))
+        self.own_ips = dict((iface.ip, port) for port, (_, iface) in self.interfaces.items())
+        self.routes = RouteTable()
+        self.arp = ArpCache(arp_ttl, retry=arp_retry, retries=arp_retries)
+        for port, (_, iface) in self.interfaces.items():
+            self.routes.add(iface.network, port)
+
+    def interface(self, port):
+        return self.interfaces[port]
+
+    def resolve(self, dst_ip):
+        # (route, next hop IP, next hop MAC or None), or None if there is no route
+        dst_ip = IPv4Address(dst_ip)
+        route = self.routes.lookup(int(dst_ip))
+        if route is None:
+            return None
+        next_hop = route.next_hop(dst_ip)
+        return route, next_hop, self.arp.get(next_hop)
+
+    def flow_prefix(self, route, dst_ip):
+        # Prefix the installed flow can cover: a route via a gateway shares one next
+        # hop MAC, a connected network needs one flow per host
+        if route.gateway is not None:
+            return str(route.network.network_address), str(route.network.netmask)
+        return str(dst_ip), '255.255.255.255'
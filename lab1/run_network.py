@@ -16,12 +16,28 @@
 
 #!/bin/env python3
 
+# Without options this starts the lab network below. --topology builds any
+# description in the topology.json format instead, --generate a fat-tree,
+# leaf-spine or linear topology from topo_gen.py:
+#
+#   sudo python3 run_network.py --generate fat-tree --k 8 --write topology.json --parallel 16 --no-cli
+
+import argparse
+import json
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
 from mininet.topo import Topo
 from mininet.net import Mininet
 from mininet.node import RemoteController, OVSKernelSwitch
 from mininet.link import TCLink
 from mininet.cli import CLI
-from mininet.log import setLogLevel
+from mininet.log import setLogLevel, info
+
+import topo_gen
+
+# Per-link TCLink options a description may carry
+LINK_PARAMS = ('bw', 'delay', 'jitter', 'loss', 'max_queue_size')
 
 
 class NetworkTopo(Topo):
@@ -30,10 +46,11 @@ class NetworkTopo(Topo):
 
         Topo.__init__(self)
 
-        h1 = self.addHost(name="h1", ip="10.0.1.2/24", defaultRoute="via 10.0.1.1")
-        h2 = self.addHost(name="h2", ip="10.0.1.2/24", defaultRoute="via 10.0.1.1")
-        ser = self.addHost(name="ser", ip="10.0.2.2/24", defaultRoute="via 10.0.2.1")
-        ext = self.addHost(name="ext", intf="ext_eth0", ip="192.168.1.123/24", defaultRoute="via 192.168.1.1")
+        # Addresses have to match topology.json, which the proactive controller mode loads
+        h1 = self.addHost(name="h1", ip="10.0.1.2/24", mac="00:00:00:00:00:01", defaultRoute="via 10.0.1.1")
+        h2 = self.addHost(name="h2", ip="10.0.1.3/24", mac="00:00:00:00:00:02", defaultRoute="via 10.0.1.1")
+        ser = self.addHost(name="ser", ip="10.0.2.2/24", mac="00:00:00:00:00:03", defaultRoute="via 10.0.2.1")
+        ext = self.addHost(name="ext", intf="ext_eth0", ip="192.168.1.123/24", mac="00:00:00:00:00:04", defaultRoute="via 192.168.1.1")
 
         s1 = self.addSwitch("s1", intf="s1_eth1")
         s2 = self.addSwitch("s2", intf="s2_eth2")
@@ -50,25 +67,131 @@ class NetworkTopo(Topo):
 
         # Build the specified network topology here
 
-def run():
-    topo = NetworkTopo()
+
+class DescribedTopo(Topo):
+    # Topology from a description dict. Port numbers, addresses and link
+    # parameters come from the description, router interfaces get their IP and
+    # MAC as link parameters when the link is built, so nothing is set per node
+    # after the network is up.
+
+    def __init__(self, desc):
+        self.desc = desc
+        Topo.__init__(self)
+
+    def build(self):
+        names = {}
+        interfaces = {}
+        for sw in self.desc['switches']:
+            names[sw['dpid']] = self.addSwitch(sw['name'], dpid='%016x' % sw['dpid'])
+            for port, iface in sw.get('interfaces', {}).items():
+                interfaces[sw['dpid'], int(port)] = {'ip': iface['ip'], 'mac': iface['mac']}
+        for host in self.desc['hosts']:
+            gateway = host.get('gateway')
+            name = self.addHost(host['name'], ip=host['ip'], mac=host['mac'],
+                                defaultRoute='via %s' % gateway if gateway else None)
+            self.addLink(name, names[host['switch']], port2=host['port'],
+                         params2=interfaces.get((host['switch'], host['port']), {}),
+                         **link_params(host))
+        for link in self.desc['links']:
+            self.addLink(names[link['src']], names[link['dst']],
+                         port1=link['src_port'], port2=link['dst_port'],
+                         params1=interfaces.get((link['src'], link['src_port']), {}),
+                         params2=interfaces.get((link['dst'], link['dst_port']), {}),
+                         **link_params(link))
+
+
+def link_params(entry):
+    return dict((k, entry[k]) for k in LINK_PARAMS if k in entry)
+
+
+def start(net, parallel):
+    # Mininet starts switches one by one, each with its own ovs-vsctl round
+    # trips. Switches have separate shells, so they can be started concurrently.
+    if parallel <= 1:
+        net.start()
+        return
+    info('*** Starting controller\n')
+    for controller in net.controllers:
+        controller.start()
+    info('*** Starting %d switches, %d at a time\n' % (len(net.switches), parallel))
+    with ThreadPoolExecutor(parallel) as pool:
+        list(pool.map(lambda switch: switch.start(net.controllers), net.switches))
+
+
+def wait():
+    info('*** Network is up, interrupt to stop\n')
+    try:
+        signal.pause()
+    except KeyboardInterrupt:
+        pass
+
+
+def make_topo(args):
+    if args.topology:
+        with open(args.topology) as f:
+            return DescribedTopo(json.load(f))
+    if args.generate:
+        desc = topo_gen.from_arguments(args.generate, args)
+        if getattr(args, 'write', None):
+            topo_gen.write(desc, args.write)
+        return DescribedTopo(desc)
+    return NetworkTopo()
+
+
+def build(topo, controller='127.0.0.1', port=6653, controllers=1):
     net = Mininet(topo=topo,
                   switch=OVSKernelSwitch,
                   link=TCLink,
                   controller=None)
-    net.addController(
-        'c1',
-        controller=RemoteController,
-        ip="127.0.0.1",
-        port=6653)
-    net.get("s3").intf("s3-eth1").setMAC("00:00:00:00:01:01")
-    net.get("s3").intf("s3-eth2").setMAC("00:00:00:00:01:02")  # setmac
-    net.get("s3").intf("s3-eth3").setMAC("00:00:00:00:01:03")  # setmac
-
-    net.start()
-    CLI(net)
+    # Every switch connects to all controllers, a cluster (cluster.py) listens
+    # on consecutive ports
+    for i in range(controllers):
+        net.addController(
+            'c%d' % (i + 1),
+            controller=RemoteController,
+            ip=controller,
+            port=port + i)
+    if isinstance(topo, NetworkTopo):
+        net.get("s3").intf("s3-eth1").setMAC("00:00:00:00:01:01")
+        net.get("s3").intf("s3-eth2").setMAC("00:00:00:00:01:02")  # setmac
+        net.get("s3").intf("s3-eth3").setMAC("00:00:00:00:01:03")  # setmac
+    return net
+
+
+def add_arguments(parser):
+    # Topology and controller options, shared with perf_test.py
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--topology', help='build this topology description')
+    source.add_argument('--generate', choices=('fat-tree', 'leaf-spine', 'linear'),
+                        help='generate a topology, see topo_gen.py for the options')
+    topo_gen.add_arguments(parser)
+    parser.add_argument('--controller', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6653)
+    parser.add_argument('--controllers', type=int, default=1,
+                        help='connect to this many controllers, on --port and the ports after it')
+
+
+def run(args):
+    net = build(make_topo(args), args.controller, args.port, args.controllers)
+    start(net, args.parallel)
+    if args.no_cli:
+        wait()
+    else:
+        CLI(net)
     net.stop()
 
-if __name__ == '__main__':
+
+def main():
+    parser = argparse.ArgumentParser(description='Start the lab network or a generated one in Mininet')
+    add_arguments(parser)
+    parser.add_argument('--write', help='save the generated description here, for the controller')
+    parser.add_argument('--parallel', type=int, default=1, help='start this many switches at a time')
+    parser.add_argument('--no-cli', action='store_true', help='run without the Mininet CLI')
+    args = parser.parse_args()
+
     setLogLevel('info')
-    run()
\ No newline at end of file
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Controller-side copy of the flows installed on every switch, indexed by
+# (table_id, priority, match). Every outgoing flow_mod is passed through
+# flow_mod() first, which returns False for an add that would install exactly
+# what is already there, so bursts of identical misses cost one flow_mod.
+#
+# The copy stays in sync through the flow_mods themselves, hard timeouts
+# (expired locally) and flow-removed messages. Idle timeouts can only be seen
+# through flow-removed, so flows with timeouts have to be sent with
+# OFPFF_SEND_FLOW_REM. When in doubt (switch error, reconnect) forget() the
+# switch, the worst case is a redundant flow_mod. After a reconnect a
+# flow-stats dump of the switch can seed() the copy again.
+
+import time
+
+
+def match_key(match):
+    # OFPMatch -> hashable, order independent key
+    return tuple(sorted(match.items()))
+
+
+def _fields(obj):
+    # Attributes that make up an action or instruction, without the ones the
+    # parser fills in (lengths), so built and parsed ones compare equal
+    return tuple(sorted((k, repr(v)) for k, v in vars(obj).items()
+                        if k not in ('len', 'actions', 'buf')))
+
+
+def instructions_key(instructions):
+    # Instructions of a flow_mod or of a flow-stats entry -> comparable key
+    key = []
+    for inst in instructions:
+        actions = getattr(inst, 'actions', None) or ()
+        key.append((type(inst).__name__, _fields(inst),
+                    tuple((type(a).__name__, _fields(a)) for a in actions)))
+    return tuple(key)
+
+
+def flow_key(stat):
+    # (table_id, priority, match_key) of a flow-stats entry or flow_mod
+    return stat.table_id, stat.priority, match_key(stat.match)
+
+
+class ShadowFlow(object):
+    __slots__ = ('table_id', 'priority', 'match', 'actions', 'cookie',
+                 'idle_timeout', 'hard_timeout', 'installed', 'expires')
+
+    def __init__(self, table_id, priority, match, actions, cookie,
+                 idle_timeout, hard_timeout, installed):
+        self.table_id = table_id
+        self.priority = priority
+        self.match = match  # match_key()
+        self.actions = actions
+        self.cookie = cookie
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.installed = installed
+        self.expires = installed + hard_timeout if hard_timeout else None
+
+    def same(self, other):
+        return (self.actions == other.actions and self.cookie == other.cookie and
+                self.idle_timeout == other.idle_timeout and
+                self.hard_timeout == other.hard_timeout)
+
+
+class ShadowTable(object):
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.flows = {}  # dpid -> {(table_id, priority, match_key): ShadowFlow}
+        self.suppressed = 0
+
+    def flow_mod(self, dpid, mod):
+        # Record an outgoing flow_mod. Returns False if it is redundant and should not be sent.
+        ofproto = mod.datapath.ofproto
+        flows = self.flows.setdefault(dpid, {})
+        key = flow_key(mod)
+
+        if mod.command in (ofproto.OFPFC_ADD, ofproto.OFPFC_MODIFY_STRICT):
+            now = self.clock()
+            flow = ShadowFlow(mod.table_id, mod.priority, key[2], instructions_key(mod.instructions),
+                              mod.cookie, mod.idle_timeout, mod.hard_timeout, now)
+            old = flows.get(key)
+            if old is not None and (old.expires is None or old.expires > now) and old.same(flow):
+                # A flow_mod carrying a buffer_id also releases the buffered packet,
+                # that one has to go out anyway
+                if mod.buffer_id == ofproto.OFP_NO_BUFFER:
+                    self.suppressed += 1
+                    return False
+            flows[key] = flow
+        elif mod.command == ofproto.OFPFC_DELETE_STRICT:
+            flows.pop(key, None)
+        elif mod.command == ofproto.OFPFC_DELETE:
+            # Every flow at least as specific as the match goes, in any priority
+            wanted = key[2]
+            mask = mod.cookie_mask
+            for other in [k for k, f in flows.items() if self._covers(wanted, f)
+                          and (mod.table_id == ofproto.OFPTT_ALL or k[0] == mod.table_id)
+                          and f.cookie & mask == mod.cookie & mask]:
+                del flows[other]
+        else:
+            # Non-strict modify, drop what it may touch so it gets re-sent next time
+            self.forget(dpid)
+        return True
+
+    @staticmethod
+    def _covers(wanted, flow):
+        fields = dict(flow.match)
+        return all(fields.get(k) == v for k, v in wanted)
+
+    def removed(self, dpid, msg):
+        # OFPFlowRemoved from the switch
+        key = flow_key(msg)
+        return self.flows.get(dpid, {}).pop(key, None)
+
+    def seed(self, dpid, stats):
+        # Replace the copy of a switch with what a flow-stats dump reports installed
+        now = self.clock()
+        flows = self.flows[dpid] = {}
+        for stat in stats:
+            key = flow_key(stat)
+            flows[key] = ShadowFlow(stat.table_id, stat.priority, key[2],
+                                    instructions_key(stat.instructions), stat.cookie,
+                                    stat.idle_timeout, stat.hard_timeout, now - stat.duration_sec)
+        return len(flows)
+
+    def forget(self, dpid):
+        self.flows.pop(dpid, None)
+
+    def expire(self):
+        now = self.clock()
+        for flows in self.flows.values():
+            for key in [k for k, f in flows.items() if f.expires is not None and f.expires <= now]:
+                del flows[key]
+
+    def lookup(self, dpid, priority, match, table_id=0):
+        # The installed flow with exactly this priority and match, or None
+        flow = self.flows.get(dpid, {}).get((table_id, priority, match_key(match)))
+        if flow is not None and flow.expires is not None and flow.expires <= self.clock():
+            return None
+        return flow
+
+    def installed(self, dpid, table_id=None, **fields):
+        # All flows of a switch whose match includes the given fields, e.g.
+        # installed(1, eth_dst='00:00:00:00:00:01')
+        now = self.clock()
+        wanted = tuple(fields.items())
+        return [f for f in self.flows.get(dpid, {}).values()
+                if (table_id is None or f.table_id == table_id) and
+                (f.expires is None or f.expires > now) and self._covers(wanted, f)]
+
+    def __len__(self):
+        return sum(len(flows) for flows in self.flows.values())
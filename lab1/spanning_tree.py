@@ -0,0 +1,171 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Loop-free broadcast over the links discovery.py found.
+#
+# BroadcastTree keeps a spanning tree of every connected part of the switch
+# graph, rooted at its lowest dpid. A switch floods to its tree ports and its
+# edge ports, the ones discovery probed without finding a switch behind them;
+# a link off the tree carries no broadcasts, so redundant links cannot loop.
+# Every switch has one OFPGT_ALL group with a bucket per flood port. The
+# switch skips the bucket of the port a packet came in on, so one group
+# serves every in_port, and broadcasts are copied along the tree by the
+# switches themselves.
+#
+# A link counts while either of its directions is discovered. Adding a link
+# inside a part of the tree changes nothing, removing one off the tree
+# neither; only the others rebuild the tree. A rebuild walks the old tree
+# edges first (0-1 BFS), so the parts the change did not cut keep their
+# edges. changed() reports the switches whose flood ports differ from what
+# their group has, everyone else gets no group_mod.
+#
+# Switches in `routers` do not bridge: a link to one is an edge port of its
+# neighbour and the tree never goes through it.
+
+from collections import deque
+
+BROADCAST_GROUP = 0xffffff00  # OFPG_MAX, multipath.py allocates its groups from 1
+BROADCAST_MAC = 'ff:ff:ff:ff:ff:ff'
+
+
+class BroadcastTree(object):
+
+    def __init__(self, discovery, routers=()):
+        self.discovery = discovery
+        self.routers = frozenset(routers)
+        self.edges = {}    # dpid -> {port: (peer dpid, peer port)}, links in either direction
+        self.tree = {}     # dpid -> ports on the tree
+        self.part = {}     # dpid -> root of its part of the tree
+        self.flood = {}    # dpid -> flood ports its group has, for switches with a group
+        self.dirty = set()
+        self.rebuilds = 0
+
+    def update(self, event):
+        # Discovery subscriber
+        if event.kind == 'settled':
+            self.dirty.add(event.src)
+            return
+        a, b = (event.src, event.src_port), (event.dst, event.dst_port)
+        self.dirty.update((a[0], b[0]))
+        if event.kind == 'add':
+            known = self.edges.get(a[0], {}).get(a[1]) == b
+            self._connect(a, b)
+            if known or a[0] in self.routers or b[0] in self.routers:
+                return
+            if self.part.get(a[0]) is None or self.part.get(a[0]) != self.part.get(b[0]):
+                self._rebuild()
+            return
+        if self.discovery.link(*b) == a:
+            # The other direction still answers
+            return
+        tree_edge = a[1] in self.tree.get(a[0], ()) and b[1] in self.tree.get(b[0], ())
+        self._disconnect(a, b)
+        self._disconnect(b, a)
+        if tree_edge:
+            self._rebuild()
+
+    def _connect(self, a, b):
+        for x, y in ((a, b), (b, a)):
+            ports = self.edges.setdefault(x[0], {})
+            old = ports.get(x[1])
+            if old is not None and old != y:
+                # Rewired, the old peer loses its end too
+                self._disconnect(old, x)
+            ports[x[1]] = y
+
+    def _disconnect(self, a, b):
+        ports = self.edges.get(a[0])
+        if ports is None or ports.get(a[1]) != b:
+            return
+        del ports[a[1]]
+        if not ports:
+            del self.edges[a[0]]
+        self.dirty.add(a[0])
+
+    def _rebuild(self):
+        self.rebuilds += 1
+        old = self.tree
+        tree, part = {}, {}
+        for root in sorted(self.edges):
+            if root in part or root in self.routers:
+                continue
+            queue = deque([(root, None)])
+            while queue:
+                dpid, via = queue.popleft()
+                if dpid in part:
+                    continue
+                part[dpid] = root
+                tree.setdefault(dpid, set())
+                if via is not None:
+                    parent, parent_port, port = via
+                    tree[parent].add(parent_port)
+                    tree[dpid].add(port)
+                for port, (peer, peer_port) in sorted(self.edges.get(dpid, {}).items()):
+                    if peer in part or peer in self.routers:
+                        continue
+                    entry = (peer, (dpid, port, peer_port))
+                    if port in old.get(dpid, ()) and peer_port in old.get(peer, ()):
+                        queue.appendleft(entry)
+                    else:
+                        queue.append(entry)
+        for dpid in set(tree) | set(old):
+            if tree.get(dpid) != old.get(dpid):
+                self.dirty.add(dpid)
+        self.tree, self.part = tree, part
+
+    def flood_ports(self, dpid):
+        # Ports a broadcast that enters the switch leaves on, in_port aside
+        ports = set(self.tree.get(dpid, ()))
+        ports.update(self.discovery.edge_ports(dpid))
+        ports.update(port for port, (peer, _) in self.edges.get(dpid, {}).items()
+                     if peer in self.routers)
+        return frozenset(ports)
+
+    def installed(self, dpid):
+        # The switch gets its group now, returns its ports
+        ports = self.flood[dpid] = self.flood_ports(dpid)
+        return ports
+
+    def forget(self, dpid):
+        self.flood.pop(dpid, None)
+
+    def changed(self):
+        # {dpid: flood ports} of the switches with a group whose ports changed
+        result = {}
+        for dpid in self.dirty:
+            if dpid not in self.flood:
+                continue
+            ports = self.flood_ports(dpid)
+            if ports != self.flood[dpid]:
+                self.flood[dpid] = result[dpid] = ports
+        self.dirty.clear()
+        return result
+
+
+def group_mod(datapath, command, ports=()):
+    # OFPGroupMod adding, modifying or deleting (command) the broadcast group of a switch
+    ofproto = datapath.ofproto
+    parser = datapath.ofproto_parser
+    buckets = [parser.OFPBucket(watch_port=ofproto.OFPP_ANY, watch_group=ofproto.OFPG_ANY,
+                                actions=[parser.OFPActionOutput(port)])
+               for port in sorted(ports)]
+    return parser.OFPGroupMod(datapath, command, ofproto.OFPGT_ALL, BROADCAST_GROUP, buckets)
+
+
+def flood_actions(datapath, ports, in_port=None):
+    # Output actions for a packet_out to ports, in_port aside
+    parser = datapath.ofproto_parser
+    return [parser.OFPActionOutput(port) for port in sorted(ports) if port != in_port]
@@ -0,0 +1,145 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Controller state that survives a restart, in an append-only log.
+#
+# The app passes its state to sync() every few seconds as
+# {namespace: {key: value}} with JSON-able keys and values (tuples are fine).
+# Only what changed since the last sync is appended, one [namespace, key,
+# value] record per line; a deleted key is a record with a null value. Once
+# the log holds compact_ratio times more records than there are live keys it
+# is rewritten with just the live ones, to a temporary file renamed over the
+# log, so a crash at any point leaves a complete log behind. A line torn by a
+# crash in the middle of a write is skipped on load, and a torn last line is
+# cut off so the next append starts on a line of its own.
+#
+# Times go into the log as wall clock seconds, the tables keep monotonic ones:
+# wall_time() and monotonic_time() convert with an offset taken once, so the
+# same instant always maps to the same logged value.
+
+import json
+import os
+import time
+
+_WALL_OFFSET = time.time() - time.monotonic()
+
+
+def wall_time(t):
+    return int(round(t + _WALL_OFFSET))
+
+
+def monotonic_time(t):
+    return t - _WALL_OFFSET
+
+
+def from_json(value):
+    # JSON arrays come back as lists, the live state uses tuples
+    if isinstance(value, list):
+        return tuple(from_json(v) for v in value)
+    return value
+
+
+class StateLog(object):
+
+    def __init__(self, path, compact_ratio=2.0, min_records=1024, fsync=False):
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.min_records = min_records
+        self.fsync = fsync
+        self.state = {}    # what the log holds: namespace -> {key: value}
+        self.records = 0   # lines in the log
+        self.torn = 0      # unreadable lines skipped by load()
+        self._file = None
+
+    def load(self):
+        # Replay the log, returns {namespace: {key: value}}
+        self.state = {}
+        self.records = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                end = 0  # end of the last complete line
+                for line in f:
+                    if line.endswith(b'\n'):
+                        end += len(line)
+                    try:
+                        namespace, key, value = json.loads(line)
+                    except ValueError:
+                        self.torn += 1
+                        continue
+                    self.records += 1
+                    entries = self.state.setdefault(namespace, {})
+                    key = from_json(key)
+                    if value is None:
+                        entries.pop(key, None)
+                    else:
+                        entries[key] = from_json(value)
+            if os.path.getsize(self.path) > end:
+                with open(self.path, 'r+b') as f:
+                    f.truncate(end)
+        return dict((namespace, dict(entries)) for namespace, entries in self.state.items())
+
+    def live(self):
+        return sum(len(entries) for entries in self.state.values())
+
+    def sync(self, state):
+        # Append the difference between state and the log, returns the number of records
+        lines = []
+        for namespace in set(state) | set(self.state):
+            new = state.get(namespace, {})
+            old = self.state.setdefault(namespace, {})
+            for key, value in new.items():
+                if old.get(key) != value:
+                    old[key] = value
+                    lines.append(self._record(namespace, key, value))
+            for key in [k for k in old if k not in new]:
+                del old[key]
+                lines.append(self._record(namespace, key, None))
+        if lines:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write(''.join(lines))
+            self._flush(self._file)
+            self.records += len(lines)
+        if self.records > max(self.min_records, self.compact_ratio * self.live()):
+            self.compact()
+        return len(lines)
+
+    def compact(self):
+        # Rewrite the log with one record per live key
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            for namespace, entries in self.state.items():
+                f.write(''.join(self._record(namespace, key, value) for key, value in entries.items()))
+            self._flush(f)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.replace(tmp, self.path)
+        self.records = self.live()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _flush(self, f):
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _record(namespace, key, value):
+        return json.dumps([namespace, key, value], separators=(',', ':')) + '\n'
@@ -0,0 +1,323 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Port and flow statistics of every connected switch.
+#
+# StatsPoller runs on a hub thread. Every round it sends a port-stats request
+# (and every flows_every rounds a flow-stats request) to all switches at once
+# and handles the replies as they come in, matched by xid, so one slow switch
+# holds up nobody. A switch that has not answered the previous round is
+# skipped instead of getting a second request, unless the request is older
+# than `timeout` intervals: then it is given up and the switch polled again.
+# Requests the switch answered with an error are given up at once (error()).
+# The interval adapts: late
+# replies double it, link rates that moved by more than change_threshold of
+# the link capacity halve it, quiet rounds stretch it by a quarter, always
+# within [min_interval, max_interval].
+#
+# Rates go into RateSeries: one row per switch port or flow in fixed size
+# NumPy ring buffers, the last `history` samples each. A reply updates all its
+# rows in a few vector operations; rate() and utilisation() are a dict lookup
+# and an array read. A port's rate is what it transmits, i.e. the load of its
+# link in the direction away from the switch. Flows are keyed by dpid plus
+# shadow_table.flow_key(), a flow missing from a dump is gone and so is its row.
+#
+# The app forwards EventOFPPortStatsReply to port_reply(),
+# EventOFPFlowStatsReply to flow_reply() and error messages to error(); they
+# return False for replies to requests they did not send.
+
+import time
+
+import numpy as np
+from ryu.lib import hub
+
+from shadow_table import flow_key
+
+
+class RateSeries(object):
+
+    def __init__(self, history=64, rows=64, clock=time.monotonic):
+        self.history = history
+        self.clock = clock
+        self.index = {}   # key -> row
+        self.keys = []    # row -> key, None for a free row
+        self.free = []
+        self.by_dpid = {}  # dpid (key[0]) -> set of rows
+        self.rates = np.zeros((0, history), np.float32)    # bit/s, ring per row
+        self.stamps = np.zeros((0, history), np.float64)   # sample times
+        self.pos = np.zeros(0, np.int32)           # next slot of every ring
+        self.filled = np.zeros(0, np.int32)        # samples in the ring
+        self.current = np.zeros(0, np.float64)     # latest rate
+        self.last_count = np.zeros(0, np.float64)  # counter (bytes) at the last update
+        self.last_time = np.zeros(0, np.float64)   # 0 before the first update
+        self.capacity = np.zeros(0, np.float64)    # bit/s, 0 if unknown
+        self._grow(rows)
+
+    def __len__(self):
+        return len(self.index)
+
+    def _grow(self, rows):
+        old = len(self.keys)
+        for name in ('rates', 'stamps', 'pos', 'filled', 'current', 'last_count',
+                     'last_time', 'capacity'):
+            array = getattr(self, name)
+            grown = np.zeros((rows,) + array.shape[1:], array.dtype)
+            grown[:old] = array
+            setattr(self, name, grown)
+        self.keys.extend([None] * (rows - old))
+        self.free.extend(range(rows - 1, old - 1, -1))
+
+    def rows(self, keys, capacity=None):
+        # Row of every key, allocated as needed with capacity(key) -> bit/s
+        index = self.index
+        rows = np.empty(len(keys), np.intp)
+        for i, key in enumerate(keys):
+            row = index.get(key)
+            if row is None:
+                if not self.free:
+                    self._grow(len(self.keys) * 2)
+                row = index[key] = self.free.pop()
+                self.keys[row] = key
+                self.by_dpid.setdefault(key[0], set()).add(row)
+                self.pos[row] = self.filled[row] = 0
+                self.last_time[row] = 0.0
+                self.current[row] = 0.0
+                self.capacity[row] = (capacity(key) or 0.0) if capacity is not None else 0.0
+            rows[i] = row
+        return rows
+
+    def update(self, rows, counts, now=None):
+        # Record counters (bytes) of rows. Returns the largest rate change relative
+        # to the capacity among the rows that have one.
+        if not len(rows):
+            return 0.0
+        now = self.clock() if now is None else now
+        counts = np.asarray(counts, np.float64)
+        last_time = self.last_time[rows]
+        delta = counts - self.last_count[rows]
+        self.last_count[rows] = counts
+        self.last_time[rows] = now
+        # The first update only sets the baseline, a counter that went back was reset
+        valid = (last_time > 0) & (last_time < now) & (delta >= 0)
+        if not valid.all():
+            rows, delta, last_time = rows[valid], delta[valid], last_time[valid]
+            if not len(rows):
+                return 0.0
+        rate = delta * 8 / (now - last_time)
+
+        pos = self.pos[rows]
+        self.rates[rows, pos] = rate
+        self.stamps[rows, pos] = now
+        self.pos[rows] = (pos + 1) % self.history
+        self.filled[rows] = np.minimum(self.filled[rows] + 1, self.history)
+
+        capacity = self.capacity[rows]
+        known = capacity > 0
+        change = 0.0
+        if known.any():
+            change = float(np.max(np.abs(rate[known] - self.current[rows][known]) / capacity[known]))
+        self.current[rows] = rate
+        return change
+
+    def release(self, rows):
+        for row in rows:
+            key = self.keys[row]
+            if key is None:
+                continue
+            del self.index[key]
+            self.keys[row] = None
+            self.by_dpid.get(key[0], set()).discard(row)
+            self.free.append(row)
+
+    def forget(self, dpid):
+        self.release(list(self.by_dpid.pop(dpid, ())))
+
+    def row(self, key):
+        return self.index.get(key)
+
+    def rate(self, key):
+        # Latest rate in bit/s, None before the second sample
+        row = self.index.get(key)
+        if row is None or not self.filled[row]:
+            return None
+        return float(self.current[row])
+
+    def utilisation(self, key):
+        # Latest rate over capacity, None if either is unknown
+        row = self.index.get(key)
+        if row is None or not self.filled[row] or not self.capacity[row]:
+            return None
+        return float(self.current[row] / self.capacity[row])
+
+    def latest(self):
+        # {key: latest rate} of every measured row
+        return dict((key, float(self.current[row])) for key, row in self.index.items()
+                    if self.filled[row])
+
+    def series(self, key):
+        # (times, rates) of the kept samples, oldest first
+        row = self.index.get(key)
+        if row is None:
+            return np.zeros(0), np.zeros(0, np.float32)
+        n, pos = self.filled[row], self.pos[row]
+        order = (np.arange(pos - n, pos) % self.history)
+        return self.stamps[row, order], self.rates[row, order]
+
+
+class StatsPoller(object):
+
+    def __init__(self, send, flush, datapaths, capacity=None, interval=5.0, min_interval=1.0,
+                 max_interval=30.0, change_threshold=0.1, flows_every=3, history=64,
+                 on_ports=None, on_flows=None, timeout=3, clock=time.monotonic):
+        self.send = send            # send(datapath, msg), queues a message
+        self.flush = flush          # flush(), writes out everything queued
+        self.datapaths = datapaths  # datapaths() -> connected Datapaths
+        self.capacity = capacity    # capacity(dpid, port) -> bit/s or None
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.change_threshold = change_threshold
+        self.flows_every = flows_every  # 0 polls no flow stats
+        self.timeout = timeout      # intervals until an unanswered request is given up
+        self.on_ports = on_ports    # on_ports(dpid) after a complete port-stats reply
+        self.on_flows = on_flows    # on_flows(dpid) after a complete flow-stats reply
+        self.clock = clock
+        self.ports = RateSeries(history, clock=clock)  # (dpid, port) -> tx rate
+        self.flows = RateSeries(history, clock=clock)  # (dpid,) + flow_key -> rate
+        self.port_requests = {}  # dpid -> (outstanding port-stats request, when sent)
+        self.flow_requests = {}  # dpid -> [outstanding flow-stats request, stats so far, when sent]
+        self.rounds = 0
+        self.late = 0            # switches skipped because of an unanswered request
+        self.timed_out = 0       # requests given up, unanswered or failed
+        self._change = 0.0
+
+    def run(self):
+        # The hub thread
+        while True:
+            hub.sleep(self.interval)
+            self.poll()
+
+    def poll(self):
+        self.rounds += 1
+        flows = self.flows_every and self.rounds % self.flows_every == 0
+        now = self.clock()
+        self.expire(now)
+        late = 0
+        for datapath in list(self.datapaths()):
+            ofproto = datapath.ofproto
+            parser = datapath.ofproto_parser
+            if datapath.id in self.port_requests:
+                late += 1
+                continue
+            request = parser.OFPPortStatsRequest(datapath, 0, ofproto.OFPP_ANY)
+            self.port_requests[datapath.id] = (request, now)
+            self.send(datapath, request)
+            if flows and datapath.id not in self.flow_requests:
+                request = parser.OFPFlowStatsRequest(datapath, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY,
+                                                     ofproto.OFPG_ANY, 0, 0, parser.OFPMatch())
+                self.flow_requests[datapath.id] = [request, [], now]
+                self.send(datapath, request)
+        # Every request of the round leaves now, the replies are handled as they arrive
+        self.flush()
+        self.late += late
+        self.adapt(late)
+
+    def expire(self, now=None):
+        # Give up the requests older than `timeout` intervals
+        now = self.clock() if now is None else now
+        deadline = now - self.timeout * self.interval
+        for requests, sent in ((self.port_requests, 1), (self.flow_requests, 2)):
+            for dpid in [dpid for dpid, pending in requests.items() if pending[sent] < deadline]:
+                del requests[dpid]
+                self.timed_out += 1
+
+    def error(self, msg):
+        # An error message answering one of the requests gives it up. Returns
+        # whether it did.
+        dpid = msg.datapath.id
+        for requests in (self.port_requests, self.flow_requests):
+            pending = requests.get(dpid)
+            if pending is not None and pending[0].xid == msg.xid:
+                del requests[dpid]
+                self.timed_out += 1
+                return True
+        return False
+
+    def adapt(self, late):
+        if late:
+            self.interval = min(self.max_interval, self.interval * 2)
+        elif self._change > self.change_threshold:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * 1.25)
+        self._change = 0.0
+
+    def port_reply(self, msg):
+        dpid = msg.datapath.id
+        pending = self.port_requests.get(dpid)
+        if pending is None or pending[0].xid != msg.xid:
+            return False
+        max_port = msg.datapath.ofproto.OFPP_MAX
+        body = [stat for stat in msg.body if stat.port_no <= max_port]
+        rows = self.ports.rows([(dpid, stat.port_no) for stat in body], self._port_capacity)
+        change = self.ports.update(rows, [stat.tx_bytes for stat in body])
+        self._change = max(self._change, change)
+        if not msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            del self.port_requests[dpid]
+            if self.on_ports is not None:
+                self.on_ports(dpid)
+        return True
+
+    def flow_reply(self, msg):
+        dpid = msg.datapath.id
+        pending = self.flow_requests.get(dpid)
+        if pending is None or pending[0].xid != msg.xid:
+            return False
+        pending[1].extend(msg.body)
+        if msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            return True
+        del self.flow_requests[dpid]
+        body = pending[1]
+        rows = self.flows.rows([(dpid,) + flow_key(stat) for stat in body])
+        self.flows.update(rows, [stat.byte_count for stat in body])
+        # Flows that are not in the dump any more are gone
+        self.flows.release(self.flows.by_dpid.get(dpid, set()) - set(rows.tolist()))
+        if self.on_flows is not None:
+            self.on_flows(dpid)
+        return True
+
+    def _port_capacity(self, key):
+        return self.capacity(*key) if self.capacity is not None else None
+
+    def disconnect(self, dpid):
+        self.port_requests.pop(dpid, None)
+        self.flow_requests.pop(dpid, None)
+        self.ports.forget(dpid)
+        self.flows.forget(dpid)
+
+    # Queries for routing and load balancing, all O(1)
+
+    def rate(self, dpid, port):
+        # Transmit rate of a switch port in bit/s, None until measured
+        return self.ports.rate((dpid, port))
+
+    def utilisation(self, dpid, port):
+        # Share of the link capacity a switch port transmits, None if unknown
+        return self.ports.utilisation((dpid, port))
+
+    def flow_rate(self, dpid, stat):
+        # Rate of a flow (flow-stats entry or flow_mod) in bit/s, None until measured
+        return self.flows.rate((dpid,) + flow_key(stat))
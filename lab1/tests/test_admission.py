@@ -0,0 +1,92 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Broadcasts punted to the controller count against the table-miss meter, on the
+# emulated switches of bench/fake_datapath.py
+
+import os
+import sys
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'bench'))
+
+import fake_datapath
+import scenarios
+from ryu.controller import ofp_event
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+
+CONTROLLERS = [os.path.join(HERE, os.pardir, 'new_approach', 'ans_controller.py'),
+               os.path.join(HERE, os.pardir, 'forwarding_test', 'ans_controller.py')]
+
+
+def meter_features(datapath):
+    ofproto = ofproto_v1_3
+    parser = ofproto_v1_3_parser
+    return parser.OFPMeterFeaturesStatsReply(datapath, body=[parser.OFPMeterFeaturesStats(
+        max_meter=64, band_types=1 << ofproto.OFPMBT_DROP,
+        capabilities=ofproto.OFPMF_PKTPS | ofproto.OFPMF_BURST, max_bands=1, max_color=0)], flags=0)
+
+
+def meter_of(entry):
+    for inst in entry.instructions:
+        if isinstance(inst, ofproto_v1_3_parser.OFPInstructionMeter):
+            return inst.meter_id
+    return None
+
+
+def flood(hosts=32):
+    # ARP requests and other broadcasts from every host, as in a broadcast storm
+    frames = []
+    for i in range(1, hosts + 1):
+        frames.append(scenarios.arp_frame(1, scenarios.host_mac(i), scenarios.host_ip(i),
+                                          bytes(6), scenarios.host_ip(i % hosts + 1)))
+        frames.append(scenarios.ipv4_frame(scenarios.host_mac(i), scenarios.BROADCAST))
+    return frames
+
+
+class BroadcastMeterTest(unittest.TestCase):
+
+    def connect(self, controller):
+        app = fake_datapath.load_app(controller)
+        datapath = fake_datapath.FakeDatapath(1)
+        fake_datapath.connect(app, datapath)
+        fake_datapath.deliver_replies(app, datapath)
+        return app, datapath
+
+    def test_broadcast_flood_is_metered(self):
+        for controller in CONTROLLERS:
+            app, datapath = self.connect(controller)
+            fake_datapath.deliver(app, ofp_event.ofp_msg_to_ev(meter_features(datapath)))
+            fake_datapath.deliver_replies(app, datapath)
+            for frame in flood():
+                entry = datapath.flow_table.lookup(fake_datapath.frame_fields(1, frame))
+                self.assertIsNotNone(entry, controller)
+                self.assertTrue(datapath.flow_table.punts_to_controller(entry), controller)
+                self.assertEqual(meter_of(entry), app.TABLE_MISS_METER_ID, controller)
+            app.close()
+
+    def test_no_meter_without_meter_support(self):
+        for controller in CONTROLLERS:
+            app, datapath = self.connect(controller)
+            for frame in flood(4):
+                entry = datapath.flow_table.lookup(fake_datapath.frame_fields(1, frame))
+                self.assertIsNone(meter_of(entry), controller)
+            app.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
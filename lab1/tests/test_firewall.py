@@ -0,0 +1,92 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# The firewall of ../firewall.rules on a router that gets a single table, on the
+# emulated switch of bench/fake_datapath.py
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'bench'))
+
+import fake_datapath
+import scenarios
+from ryu.lib.packet import ethernet, ipv4, packet, tcp
+from ryu.ofproto import ofproto_v1_3_parser
+
+CONTROLLER = os.path.join(HERE, os.pardir, 'forwarding_test', 'ans_controller.py')
+RULES = os.path.join(HERE, os.pardir, 'firewall.rules')
+
+# ext and ser of ../topology.json, and the router ports they are behind
+EXT_MAC, EXT_IP, EXT_PORT, EXT_GATEWAY_MAC = '00:00:00:00:00:04', '192.168.1.123', 3, '00:00:00:00:01:03'
+SER_MAC, SER_IP, SER_PORT, SER_GATEWAY_MAC = '00:00:00:00:00:03', '10.0.2.2', 2, '00:00:00:00:01:02'
+
+
+def tcp_frame(dst_port):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(dst=EXT_GATEWAY_MAC, src=EXT_MAC, ethertype=0x0800))
+    pkt.add_protocol(ipv4.ipv4(src=EXT_IP, dst=SER_IP, proto=6))
+    pkt.add_protocol(tcp.tcp(src_port=40000, dst_port=dst_port))
+    pkt.serialize()
+    return bytes(pkt.data)
+
+
+def outputs(entry):
+    return [action.port for inst in entry.instructions for action in getattr(inst, 'actions', [])
+            if isinstance(action, ofproto_v1_3_parser.OFPActionOutput)]
+
+
+class SingleTableFirewallTest(unittest.TestCase):
+
+    def setUp(self):
+        with mock.patch.dict(os.environ, {'ANS_FIREWALL': RULES}):
+            self.app = fake_datapath.load_app(CONTROLLER)
+        self.datapath = fake_datapath.FakeDatapath(self.app.ROUTER_DPID, ports=(1, 2, 3), n_tables=1)
+        fake_datapath.connect(self.app, self.datapath)
+        fake_datapath.deliver_replies(self.app, self.datapath)
+
+    def tearDown(self):
+        self.app.close()
+
+    def lookup(self, frame):
+        return self.datapath.flow_table.lookup(fake_datapath.frame_fields(EXT_PORT, frame))
+
+    def test_allowed_exception_is_forwarded(self):
+        http = tcp_frame(80)
+        self.assertTrue(self.datapath.flow_table.punts_to_controller(self.lookup(http)))
+
+        # The first packet waits for the server's MAC, then is routed and offloaded
+        fake_datapath.deliver(self.app, fake_datapath.packet_in(self.datapath, EXT_PORT, http))
+        reply = scenarios.arp_frame(2, bytes.fromhex(SER_MAC.replace(':', '')),
+                                    bytes(int(b) for b in SER_IP.split('.')),
+                                    bytes.fromhex(SER_GATEWAY_MAC.replace(':', '')),
+                                    bytes([10, 0, 2, 1]))
+        fake_datapath.deliver(self.app, fake_datapath.packet_in(self.datapath, SER_PORT, reply))
+        fake_datapath.deliver_replies(self.app, self.datapath)
+
+        entry = self.lookup(http)
+        self.assertFalse(self.datapath.flow_table.punts_to_controller(entry))
+        self.assertEqual(outputs(entry), [SER_PORT])
+
+    def test_denied_packets_are_dropped(self):
+        self.assertEqual(self.lookup(tcp_frame(22)).instructions, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
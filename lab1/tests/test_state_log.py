@@ -0,0 +1,73 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# A log torn by a crash in the middle of a write loads, and what is appended
+# after it loads again
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir))
+
+import state_log
+
+
+class TornLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_after_torn_tail(self):
+        log = state_log.StateLog(self.path)
+        log.sync({'mac': {(1, 'aa:aa:aa:aa:aa:01'): (1, 100)}})
+        log.close()
+        # The crash: half a record, no newline
+        with open(self.path, 'a') as f:
+            f.write('["mac",[1,"aa:aa:aa:aa:aa:02"],[2,')
+
+        log = state_log.StateLog(self.path)
+        self.assertEqual(log.load(), {'mac': {(1, 'aa:aa:aa:aa:aa:01'): (1, 100)}})
+        self.assertEqual(log.torn, 1)
+        log.sync({'mac': {(1, 'aa:aa:aa:aa:aa:01'): (1, 100), (1, 'aa:aa:aa:aa:aa:03'): (3, 200)}})
+        log.close()
+
+        log = state_log.StateLog(self.path)
+        self.assertEqual(log.load(), {'mac': {(1, 'aa:aa:aa:aa:aa:01'): (1, 100),
+                                              (1, 'aa:aa:aa:aa:aa:03'): (3, 200)}})
+        self.assertEqual(log.torn, 0)
+        self.assertEqual(log.records, 2)
+        log.close()
+
+    def test_complete_log_is_left_alone(self):
+        log = state_log.StateLog(self.path)
+        log.sync({'arp': {'10.0.1.2': ('00:00:00:00:00:02', 100)}})
+        log.close()
+        size = os.path.getsize(self.path)
+        self.assertEqual(state_log.StateLog(self.path).load(),
+                         {'arp': {'10.0.1.2': ('00:00:00:00:00:02', 100)}})
+        self.assertEqual(os.path.getsize(self.path), size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+#!/bin/env python3
+
+# Generates large topology descriptions in the topology.json format that
+# topology.Topology.load() reads and run_network.py --topology builds in
+# Mininet: k-ary fat-trees, leaf-spine fabrics and linear chains.
+#
+# Hosts get consecutive addresses in one 10.0.0.0/8 L2 domain, starting at
+# 10.0.0.2, and a MAC made from their address (10.0.1.2 -> 00:00:0a:00:01:02).
+# With a gateway, a router switch with the interface 10.0.0.1/8 hangs off the
+# first switch and every host routes through it. Links carry the bandwidth and
+# delay of their profile, used for Mininet's TCLink. With --parallel-links every
+# switch-to-switch link is made that many times, each on its own pair of ports.
+#
+#   python3 topo_gen.py fat-tree --k 8 -o fattree8.json
+#   python3 topo_gen.py leaf-spine --spines 4 --leaves 32 --hosts 40 --profile datacenter
+
+import argparse
+import json
+from ipaddress import IPv4Address, IPv4Network
+
+HOST_NETWORK = IPv4Network('10.0.0.0/8')
+GATEWAY_IP = HOST_NETWORK.network_address + 1
+
+# Link profile -> link kind -> TCLink parameters. 'host' links attach hosts,
+# 'edge' links connect access switches upwards and 'core' links the layers above.
+PROFILES = {
+    'none': {'host': {}, 'edge': {}, 'core': {}},
+    'lab': {
+        'host': {'bw': 15, 'delay': '10ms'},
+        'edge': {'bw': 15, 'delay': '10ms'},
+        'core': {'bw': 15, 'delay': '10ms'},
+    },
+    'datacenter': {
+        'host': {'bw': 100, 'delay': '0.1ms'},
+        'edge': {'bw': 1000, 'delay': '0.1ms'},
+        'core': {'bw': 1000, 'delay': '0.2ms'},
+    },
+}
+
+
+def host_ip(n):
+    # n-th host from 1, skipping .0, .1 and .255 in the last byte
+    block, low = divmod(n - 1, 252)
+    return HOST_NETWORK.network_address + (block << 8) + low + 2
+
+
+def host_mac(ip):
+    return '00:00:' + ':'.join('%02x' % b for b in IPv4Address(ip).packed)
+
+
+def router_mac(port):
+    return '00:00:00:00:01:%02x' % port
+
+
+class Builder(object):
+
+    def __init__(self, profile='none', parallel=1):
+        self.profile = PROFILES[profile]
+        self.parallel = parallel
+        self.switches = []
+        self.hosts = []
+        self.links = []
+        self.next_port = {}  # dpid -> next free port
+
+    def switch(self, name, **extra):
+        dpid = len(self.switches) + 1
+        self.switches.append(dict(dpid=dpid, name=name, **extra))
+        self.next_port[dpid] = 1
+        return dpid
+
+    def port(self, dpid):
+        port = self.next_port[dpid]
+        self.next_port[dpid] = port + 1
+        return port
+
+    def link(self, dpid1, dpid2, kind, parallel=None):
+        for _ in range(parallel or self.parallel):
+            self.links.append(dict(src=dpid1, src_port=self.port(dpid1),
+                                   dst=dpid2, dst_port=self.port(dpid2), **self.profile[kind]))
+
+    def host(self, dpid):
+        n = len(self.hosts) + 1
+        ip = host_ip(n)
+        self.hosts.append(dict(name='h%d' % n, mac=host_mac(ip),
+                               ip='%s/%d' % (ip, HOST_NETWORK.prefixlen),
+                               switch=dpid, port=self.port(dpid), **self.profile['host']))
+
+    def gateway(self, dpid):
+        # Router with one interface in the host network, attached to dpid
+        router = self.switch('r1', router=True, interfaces={
+            '1': {'mac': router_mac(1), 'ip': '%s/%d' % (GATEWAY_IP, HOST_NETWORK.prefixlen)}})
+        self.link(router, dpid, 'core', parallel=1)
+        for host in self.hosts:
+            host['gateway'] = str(GATEWAY_IP)
+
+    def description(self):
+        return {'switches': self.switches, 'hosts': self.hosts, 'links': self.links}
+
+
+def fat_tree(k, profile='none', gateway=False, parallel=1):
+    # k pods of k/2 edge and k/2 aggregation switches, (k/2)^2 core switches,
+    # k/2 hosts per edge switch: k^3/4 hosts in total
+    if k < 2 or k % 2:
+        raise ValueError('fat-tree needs an even k >= 2')
+    half = k // 2
+    b = Builder(profile, parallel)
+    cores = [b.switch('core%d' % (i + 1)) for i in range(half * half)]
+    for pod in range(k):
+        aggs = [b.switch('agg%d' % (pod * half + i + 1)) for i in range(half)]
+        edges = [b.switch('edge%d' % (pod * half + i + 1)) for i in range(half)]
+        for edge in edges:
+            for _ in range(half):
+                b.host(edge)
+            for agg in aggs:
+                b.link(edge, agg, 'edge')
+        # Aggregation switch i of every pod connects to core switches i*k/2 .. i*k/2 + k/2 - 1
+        for i, agg in enumerate(aggs):
+            for core in cores[i * half:(i + 1) * half]:
+                b.link(agg, core, 'core')
+    if gateway:
+        b.gateway(cores[0])
+    return b.description()
+
+
+def leaf_spine(spines, leaves, hosts_per_leaf, profile='none', gateway=False, parallel=1):
+    b = Builder(profile, parallel)
+    spine_ids = [b.switch('spine%d' % (i + 1)) for i in range(spines)]
+    for i in range(leaves):
+        leaf = b.switch('leaf%d' % (i + 1))
+        for _ in range(hosts_per_leaf):
+            b.host(leaf)
+        for spine in spine_ids:
+            b.link(leaf, spine, 'edge')
+    if gateway:
+        b.gateway(spine_ids[0])
+    return b.description()
+
+
+def linear(switches, hosts_per_switch, profile='none', gateway=False, parallel=1):
+    b = Builder(profile, parallel)
+    previous = None
+    for i in range(switches):
+        dpid = b.switch('s%d' % (i + 1))
+        for _ in range(hosts_per_switch):
+            b.host(dpid)
+        if previous is not None:
+            b.link(previous, dpid, 'edge')
+        previous = dpid
+    if gateway:
+        b.gateway(1)
+    return b.description()
+
+
+def generate(kind, k=4, spines=2, leaves=4, switches=4, hosts=2, profile='none', gateway=False,
+             parallel=1):
+    if kind == 'fat-tree':
+        return fat_tree(k, profile, gateway, parallel)
+    if kind == 'leaf-spine':
+        return leaf_spine(spines, leaves, hosts, profile, gateway, parallel)
+    if kind == 'linear':
+        return linear(switches, hosts, profile, gateway, parallel)
+    raise ValueError('unknown topology %s' % kind)
+
+
+def add_arguments(parser):
+    # Generator options, shared with run_network.py
+    parser.add_argument('--k', type=int, default=4, help='fat-tree arity')
+    parser.add_argument('--spines', type=int, default=2)
+    parser.add_argument('--leaves', type=int, default=4)
+    parser.add_argument('--switches', type=int, default=4, help='length of a linear chain')
+    parser.add_argument('--hosts', type=int, default=2, help='hosts per leaf / linear switch')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='none',
+                        help='link bandwidth and delay profile')
+    parser.add_argument('--gateway', action='store_true', help='add a router as default gateway')
+    parser.add_argument('--parallel-links', type=int, default=1,
+                        help='links between every pair of connected switches')
+
+
+def from_arguments(kind, args):
+    return generate(kind, args.k, args.spines, args.leaves, args.switches, args.hosts,
+                    args.profile, args.gateway, args.parallel_links)
+
+
+def write(desc, path):
+    with open(path, 'w') as f:
+        json.dump(desc, f, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a topology description')
+    parser.add_argument('kind', choices=('fat-tree', 'leaf-spine', 'linear'))
+    add_arguments(parser)
+    parser.add_argument('-o', '--output', help='write the description here instead of stdout')
+    args = parser.parse_args()
+
+    desc = from_arguments(args.kind, args)
+    if args.output:
+        write(desc, args.output)
+        print('%s: %d switches, %d hosts, %d links' % (args.output, len(desc['switches']),
+                                                       len(desc['hosts']), len(desc['links'])))
+    else:
+        print(json.dumps(desc, indent=1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Static description of the network (switches, router interfaces, hosts and
+# links) and shortest path computation over it.
+
+import json
+from collections import deque
+from ipaddress import IPv4Interface
+
+
+class Switch(object):
+    __slots__ = ('dpid', 'name', 'router', 'interfaces')
+
+    def __init__(self, dpid, name, router=False, interfaces=None):
+        self.dpid = dpid
+        self.name = name
+        self.router = router
+        # Router only: port_no -> (mac, IPv4Interface)
+        self.interfaces = interfaces or {}
+
+
+class Host(object):
+    __slots__ = ('name', 'mac', 'ip', 'dpid', 'port')
+
+    def __init__(self, name, mac, ip, dpid, port):
+        self.name = name
+        self.mac = mac
+        self.ip = ip
+        self.dpid = dpid
+        self.port = port
+
+
+class Topology(object):
+
+    def __init__(self):
+        self.switches = {}  # dpid -> Switch
+        self.hosts = {}     # name -> Host
+        self.links = {}     # (dpid, port) -> (peer dpid, peer port), both directions
+        self.adjacency = {}  # dpid -> {port: (peer dpid, peer port)}
+        self.link_params = {}  # (dpid, port) -> {'bw': .., 'delay': ..}
+        self.down = set()   # (dpid, port) of links that are currently down
+
+    def add_switch(self, dpid, name=None, router=False, interfaces=None):
+        self.switches[dpid] = Switch(dpid, name or 's%d' % dpid, router, interfaces)
+        self.adjacency.setdefault(dpid, {})
+
+    def add_host(self, name, mac, ip, dpid, port):
+        self.hosts[name] = Host(name, mac, ip, dpid, port)
+
+    def add_link(self, dpid1, port1, dpid2, port2, **params):
+        self.links[(dpid1, port1)] = (dpid2, port2)
+        self.links[(dpid2, port2)] = (dpid1, port1)
+        self.adjacency.setdefault(dpid1, {})[port1] = (dpid2, port2)
+        self.adjacency.setdefault(dpid2, {})[port2] = (dpid1, port1)
+        self.link_params[(dpid1, port1)] = params
+        self.link_params[(dpid2, port2)] = params
+
+    def is_router(self, dpid):
+        switch = self.switches.get(dpid)
+        return switch is not None and switch.router
+
+    def link_up(self, dpid, port):
+        return (dpid, port) in self.links and (dpid, port) not in self.down
+
+    def set_link_state(self, dpid, port, up):
+        # Returns the affected link as (dpid, port, peer dpid, peer port) or None
+        peer = self.links.get((dpid, port))
+        if peer is None or self.link_up(dpid, port) == up:
+            return None
+        for end in ((dpid, port), peer):
+            if up:
+                self.down.discard(end)
+            else:
+                self.down.add(end)
+        return (dpid, port) + peer
+
+    def neighbors(self, dpid):
+        # (local port, peer dpid, peer port) for every working link of a switch
+        for port, (peer, peer_port) in self.adjacency.get(dpid, {}).items():
+            if (dpid, port) not in self.down:
+                yield port, peer, peer_port
+
+    def endpoints(self):
+        # Every MAC address the L2 switches deliver to: hosts and router interfaces.
+        # Yields (mac, ip, dpid, port) where (dpid, port) is where the MAC is attached.
+        for host in self.hosts.values():
+            yield host.mac, host.ip, host.dpid, host.port
+        for switch in self.switches.values():
+            for port, (mac, iface) in switch.interfaces.items():
+                peer = self.links.get((switch.dpid, port))
+                if peer is not None:
+                    yield mac, iface.ip, peer[0], peer[1]
+
+    @classmethod
+    def from_dict(cls, desc):
+        topo = cls()
+        for sw in desc.get('switches', []):
+            interfaces = dict((int(port), (iface['mac'], IPv4Interface(iface['ip'])))
+                              for port, iface in sw.get('interfaces', {}).items())
+            topo.add_switch(sw['dpid'], sw.get('name'), sw.get('router', False), interfaces)
+        for host in desc.get('hosts', []):
+            topo.add_host(host['name'], host['mac'], IPv4Interface(host['ip']).ip,
+                          host['switch'], host['port'])
+        for link in desc.get('links', []):
+            params = dict((k, v) for k, v in link.items()
+                          if k not in ('src', 'src_port', 'dst', 'dst_port'))
+            topo.add_link(link['src'], link['src_port'], link['dst'], link['dst_port'], **params)
+        return topo
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+class PathComputer(object):
+    # Shortest path trees towards every switch of the L2 fabric. Routers end an
+    # L2 segment, so paths never cross them. Link changes only recompute the
+    # trees they can actually change. With multipath, every link between two
+    # hops of a tree counts as used, since out_ports() spreads traffic over all
+    # of them.
+
+    def __init__(self, topology, multipath=False):
+        self.topology = topology
+        self.multipath = multipath
+        self.next_hop = {}  # dst dpid -> {dpid: out port towards dst}
+        self.dist = {}      # dst dpid -> {dpid: hop count}
+        for dpid in topology.switches:
+            self.compute(dpid)
+
+    def compute(self, dst):
+        next_hop = {}
+        dist = {dst: 0}
+        if not self.topology.is_router(dst):
+            queue = deque([dst])
+            while queue:
+                dpid = queue.popleft()
+                for port, peer, peer_port in self.topology.neighbors(dpid):
+                    if peer in dist or self.topology.is_router(peer):
+                        continue
+                    dist[peer] = dist[dpid] + 1
+                    next_hop[peer] = peer_port
+                    queue.append(peer)
+        self.next_hop[dst] = next_hop
+        self.dist[dst] = dist
+
+    def out_port(self, dpid, dst):
+        # Port of dpid on the shortest path to dst, None if dst is unreachable
+        return self.next_hop.get(dst, {}).get(dpid)
+
+    def out_ports(self, dpid, dst):
+        # Every port of dpid on some shortest path to dst (parallel links included),
+        # sorted; empty if dst is unreachable
+        dist = self.dist.get(dst, {})
+        hops = dist.get(dpid)
+        if not hops:
+            return ()
+        return tuple(sorted(port for port, peer, _ in self.topology.neighbors(dpid)
+                            if dist.get(peer) == hops - 1 and not self.topology.is_router(peer)))
+
+    def path(self, src, dst):
+        # Switches from src to dst, both included
+        hops = [src]
+        while hops[-1] != dst:
+            port = self.out_port(hops[-1], dst)
+            if port is None:
+                return None
+            hops.append(self.topology.links[(hops[-1], port)][0])
+        return hops
+
+    def link_changed(self, dpid1, port1, dpid2, port2):
+        # Recompute the trees a link state change can affect. Returns the root of
+        # each recomputed tree with the switches that were part of it before.
+        affected = {}
+        for dst in list(self.dist):
+            dist = self.dist[dst]
+            d1, d2 = dist.get(dpid1), dist.get(dpid2)
+            if self.topology.link_up(dpid1, port1):
+                # A new link only matters if it shortcuts the current tree, or with
+                # multipath if it is one more equal-cost link
+                stale = (d1 is None) != (d2 is None) or \
+                    (d1 is not None and abs(d1 - d2) > (0 if self.multipath else 1))
+            elif self.multipath:
+                stale = d1 is not None and d2 is not None and abs(d1 - d2) == 1
+            else:
+                # A failed link only matters if the tree used it
+                stale = self.next_hop[dst].get(dpid1) == port1 or \
+                    self.next_hop[dst].get(dpid2) == port2
+            if stale:
+                affected[dst] = set(dist)
+                self.compute(dst)
+        return affected
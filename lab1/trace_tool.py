@@ -0,0 +1,97 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+#!/bin/env python3
+
+# Decodes and summarises a controller trace written by tracing.EventLog.
+#
+#   python3 trace_tool.py /tmp/controller.trace
+#   python3 trace_tool.py /tmp/controller.trace --event packet_in --dump
+
+import argparse
+import json
+from collections import Counter
+
+
+def read_trace(path, events=None):
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # The controller may have been killed halfway through a line
+                continue
+            if events is None or rec.get('ev') in events:
+                yield rec
+
+
+def summarise(records, top):
+    per_event = Counter()
+    per_dpid = Counter()
+    per_src = Counter()
+    first = last = None
+    for rec in records:
+        per_event[rec.get('ev')] += 1
+        if 'dpid' in rec:
+            per_dpid[(rec['ev'], rec['dpid'])] += 1
+        if 'src' in rec:
+            per_src[rec['src']] += 1
+        t = rec.get('t')
+        if t is not None:
+            first = t if first is None else min(first, t)
+            last = t if last is None else max(last, t)
+
+    span = (last - first) if first is not None else 0.0
+    print('records: %d over %.3f s' % (sum(per_event.values()), span))
+    print('')
+    print('%-20s %10s %10s' % ('event', 'count', 'per s'))
+    for event, count in per_event.most_common():
+        print('%-20s %10d %10.1f' % (event, count, count / span if span else 0.0))
+    if per_dpid:
+        print('')
+        print('%-20s %10s %10s' % ('event', 'dpid', 'count'))
+        for (event, dpid), count in sorted(per_dpid.items()):
+            print('%-20s %10s %10d' % (event, dpid, count))
+    if per_src:
+        print('')
+        print('top %d sources' % top)
+        for src, count in per_src.most_common(top):
+            print('  %-20s %10d' % (src, count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarise a controller event trace')
+    parser.add_argument('trace')
+    parser.add_argument('--event', action='append', help='only look at this event type')
+    parser.add_argument('--dump', action='store_true', help='print the decoded records')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    events = set(args.event) if args.event else None
+    if args.dump:
+        for rec in read_trace(args.trace, events):
+            t = rec.pop('t', 0.0)
+            ev = rec.pop('ev', '?')
+            print('%.6f %-14s %s' % (t, ev, ' '.join('%s=%s' % kv for kv in sorted(rec.items()))))
+    else:
+        summarise(read_trace(args.trace, events), args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+ Copyright 2024 Computer Networks Group @ UPB
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+ """
+
+# Structured event tracing for the controllers' hot paths.
+#
+# Call sites guard every event with the enabled flag:
+#
+#     if self.trace.enabled:
+#         self.trace.emit('packet_in', dpid=datapath.id, src=src_mac)
+#
+# so a disabled log costs one attribute lookup and nothing is formatted.
+# An enabled log appends (time, event, fields) to a bounded ring buffer; a
+# hub thread turns the records into JSON lines and writes them out.
+# Per-event sampling keeps every n-th event of a type.
+#
+# Enable it with the environment of ryu-manager:
+#     ANS_TRACE=/tmp/controller.trace ANS_TRACE_SAMPLE=packet_in=0.1,flow_mod=1
+
+import json
+import os
+import time
+from collections import deque
+
+from ryu.lib import hub
+
+
+class EventLog(object):
+
+    def __init__(self, path=None, capacity=65536, flush_interval=0.5, sample=None):
+        self.enabled = path is not None
+        self.path = path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._buffer = deque(maxlen=capacity)
+        # event -> keep every n-th record, from rates in (0, 1]
+        self._every = dict((event, max(1, int(round(1.0 / rate))))
+                           for event, rate in (sample or {}).items() if rate > 0)
+        self._muted = set(event for event, rate in (sample or {}).items() if rate <= 0)
+        self._seen = {}
+        self._thread = None
+        if self.enabled:
+            self._file = open(path, 'a')
+            self._thread = hub.spawn(self._flush_loop)
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        path = environ.get('ANS_TRACE')
+        sample = {}
+        for item in environ.get('ANS_TRACE_SAMPLE', '').split(','):
+            if '=' in item:
+                event, rate = item.split('=', 1)
+                sample[event.strip()] = float(rate)
+        return cls(path, sample=sample)
+
+    def emit(self, event, **fields):
+        if event in self._muted:
+            return
+        every = self._every.get(event)
+        if every is not None:
+            seen = self._seen.get(event, 0) + 1
+            self._seen[event] = seen
+            if seen % every:
+                return
+        if len(self._buffer) == self.capacity:
+            self.dropped += 1
+        self._buffer.append((time.time(), event, fields))
+
+    def flush(self):
+        buffer = self._buffer
+        lines = []
+        while buffer:
+            t, event, fields = buffer.popleft()
+            fields['t'] = round(t, 6)
+            fields['ev'] = event
+            lines.append(json.dumps(fields, default=str, separators=(',', ':')))
+        if lines:
+            self._file.write('\n'.join(lines) + '\n')
+            self._file.flush()
+
+    def _flush_loop(self):
+        while True:
+            hub.sleep(self.flush_interval)
+            self.flush()
+
+    def close(self):
+        if not self.enabled:
+            return
+        hub.kill(self._thread)
+        self._thread = None
+        self.flush()
+        if self.dropped:
+            self._file.write(json.dumps({'t': time.time(), 'ev': 'trace_dropped',
+                                         'count': self.dropped}) + '\n')
+        self._file.close()
+        self.enabled = False